@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Measures the overheads of the test harness by running missions against the
+fake vehicle and attack server provided by start_core, rather than against
+an ArduPilot SITL. For each run, the following phases are timed:
+
+    attacker    launching and connecting to the (fake) attack server
+    connect     connecting to the vehicle and waiting for it to be ready
+    upload      issuing a mission that the vehicle doesn't hold
+    reissue     issuing a mission that the vehicle already holds
+    execute     executing the mission (dominated by simulated flight time)
+    latency     the delay between the vehicle completing its mission and
+                Mission.execute returning
+    teardown    closing the vehicle connection and stopping the attacker
+
+Afterwards, the throughput of concurrent runs (each using its own instance
+ports) is reported.
+
+With --execute, each run instead goes through `test.execute`, which launches
+the fake vehicle in place of sim_vehicle.py (via a stand-in ArduPilot tree),
+and the phases recorded in the outcome of the test are reported.
+
+Usage:
+    python benchmarks/harness.py [--runs N] [--concurrency K] [--lightweight]
+                                 [--execute]
+"""
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer as timer
+import argparse
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from start_core.attack import Attack, Attacker
+from start_core.fake import FakeVehicle
+from start_core.mission import Mission, pack_commands
+from start_core.ports import Ports, PortAllocator
+from start_core.sitl import SITL
+from start_core.test import execute
+import start_core.fake_attack
+
+HOME = (-35.362938, 149.165085, 584.0, 270.0)
+
+# a short, square mission at an altitude of 20 metres
+COMMANDS = [
+    (3, 22, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 20.0),
+    (3, 16, 0.0, 0.0, 0.0, 0.0, -35.362000, 149.165085, 20.0),
+    (3, 16, 0.0, 0.0, 0.0, 0.0, -35.362000, 149.166000, 20.0),
+    (3, 16, 0.0, 0.0, 0.0, 0.0, -35.362938, 149.166000, 20.0),
+    (3, 20, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+]
+
+PHASES = ['attacker', 'connect', 'upload', 'reissue', 'execute', 'latency',
+          'teardown']
+
+# the phases recorded by test.execute
+EXECUTE_PHASES = ['launch', 'attacker', 'connect', 'wait_ready', 'armable',
+                  'arm', 'issue', 'mode', 'flight', 'teardown', 'total']
+
+# a stand-in for sim_vehicle.py that runs the fake vehicle for the instance
+# and home location that it is given
+FAKE_SIM_VEHICLE = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -I) instance="$2"; shift ;;
+        -l) home="$2"; shift ;;
+        -v) vehicle="$2"; shift ;;
+    esac
+    shift
+done
+PYTHONPATH={path}${{PYTHONPATH:+:$PYTHONPATH}} exec {python} -m start_core.fake \\
+    --vehicle "$vehicle" --instance "$instance" --home="$home" --speed {speed}
+'''
+
+
+def fake_ardupilot(speed):  # type: (float) -> str
+    """
+    Creates a stand-in ArduPilot tree whose sim_vehicle.py runs the fake
+    vehicle, and returns the location of its sim_vehicle.py.
+    """
+    dir_source = tempfile.mkdtemp(prefix='fake-ardupilot')
+    dir_autotest = os.path.join(dir_source, 'Tools', 'autotest')
+    os.makedirs(dir_autotest)
+    fn = os.path.join(dir_autotest, 'sim_vehicle.py')
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    with open(fn, 'w') as f:
+        f.write(FAKE_SIM_VEHICLE.format(path=os.path.abspath(path),
+                                        python=sys.executable,
+                                        speed=speed))
+    os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+    return fn
+
+
+def run(instance, vehicle, speed, lightweight=False):
+    # type: (int, str, float, bool) -> dict
+    """
+    Executes a single mission against a fake vehicle, and returns the time
+    taken by each phase.
+    """
+    ports = Ports(instance)
+    sitl = SITL('Tools/autotest/sim_vehicle.py', vehicle, HOME, instance)
+    mission = Mission('<benchmark>', vehicle, pack_commands(COMMANDS), HOME)
+    script = os.path.splitext(start_core.fake_attack.__file__)[0] + '.py'
+    attack = Attack(script=script,
+                    flags='--ready',
+                    longitude=0.0, latitude=0.0, radius=0.0)
+    outputs = [('127.0.0.1', ports.harness), ('127.0.0.1', ports.attacker)]
+    timings = {}
+
+    with FakeVehicle(outputs, vehicle, HOME, rate_heartbeat=2.0,
+                     speed=speed) as fake:
+        t = timer()
+        attacker = Attacker(attack, sitl.url_attacker, ports.attack_server,
+                            expect_ready=True)
+        attacker.prepare()
+        timings['attacker'] = timer() - t
+
+        t = timer()
+        conn = sitl.connect(timeout=10, lightweight=lightweight)
+        timings['connect'] = timer() - t
+
+        try:
+            t = timer()
+            mission.issue(conn)
+            timings['upload'] = timer() - t
+
+            t = timer()
+            mission.issue(conn)
+            timings['reissue'] = timer() - t
+
+            attacker.start()
+            t = timer()
+            mission.execute(time_limit=60,
+                            conn=conn,
+                            speedup=1,
+                            timeout_heartbeat=3,
+                            check_wps=False,
+                            enable_workaround=True)
+            t_end = timer()
+            timings['execute'] = t_end - t
+            if fake.mission_completed_at is not None:
+                timings['latency'] = t_end - fake.mission_completed_at
+        finally:
+            t = timer()
+            conn.close()
+            attacker.stop()
+            timings['teardown'] = timer() - t
+    return timings
+
+
+def run_execute(instance, vehicle, fn_harness, lightweight=False):
+    # type: (int, str, str, bool) -> dict
+    """
+    Executes a single test against a fake vehicle via `test.execute`, and
+    returns the time taken by each of the phases that it records.
+    """
+    sitl = SITL(fn_harness, vehicle, HOME, instance)
+    mission = Mission('<benchmark>', vehicle, pack_commands(COMMANDS), HOME)
+    script = os.path.splitext(start_core.fake_attack.__file__)[0] + '.py'
+    attack = Attack(script=script,
+                    flags='',
+                    longitude=0.0, latitude=0.0, radius=0.0)
+    t = timer()
+    outcome = execute(sitl, mission, attack,
+                      timeout_mission=60,
+                      timeout_liveness=3,
+                      lightweight_client=lightweight)
+    timings = dict(outcome.timings)
+    timings['total'] = timer() - t
+    if not outcome.passed:
+        print("test failed: {} ({})".format(outcome.reason, outcome.distance), file=sys.stderr)
+    return timings
+
+
+def percentile(values, p):  # type: (list, float) -> float
+    values = sorted(values)
+    i = min(len(values) - 1, int(round(p * (len(values) - 1))))
+    return values[i]
+
+
+def main():  # type: () -> int
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of sequential runs')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of concurrent runs for throughput')
+    parser.add_argument('--vehicle', default='ArduCopter')
+    parser.add_argument('--speed', type=float, default=200.0,
+                        help='ground speed of the fake vehicle (m/s)')
+    parser.add_argument('--lightweight', action='store_true',
+                        help='connect via the lightweight MAVLink client')
+    parser.add_argument('--execute', action='store_true',
+                        help='run each test via test.execute')
+    args = parser.parse_args()
+
+    if args.execute:
+        fn_harness = fake_ardupilot(args.speed)
+        single = lambda i: run_execute(i, args.vehicle, fn_harness,
+                                       args.lightweight)
+        phases = EXECUTE_PHASES
+    else:
+        fn_harness = None
+        single = lambda i: run(i, args.vehicle, args.speed, args.lightweight)
+        phases = PHASES
+
+    try:
+        return report(args, single, phases)
+    finally:
+        if fn_harness:
+            shutil.rmtree(os.path.dirname(os.path.dirname(os.path.dirname(
+                fn_harness))), ignore_errors=True)
+
+
+def report(args, single, phases):
+    # type: (argparse.Namespace, Callable[[int], dict], List[str]) -> int
+    results = [single(0) for _ in range(args.runs)]
+    print("{:<10} {:>10} {:>10} {:>10}".format('phase', 'median', 'p90',
+                                               'max'))
+    for phase in phases:
+        values = [r[phase] for r in results if phase in r]
+        if not values:
+            continue
+        print("{:<10} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms".format(
+            phase,
+            percentile(values, 0.5) * 1000,
+            percentile(values, 0.9) * 1000,
+            max(values) * 1000))
+
+    if args.concurrency > 0:
+        num_runs = 2 * args.concurrency
+        allocator = PortAllocator(first_instance=1)
+
+        def run_concurrent(_):
+            with allocator.allocate() as ports:
+                return single(ports.instance)
+
+        pool = ThreadPool(args.concurrency)
+        try:
+            t = timer()
+            pool.map(run_concurrent, range(num_runs))
+            duration = timer() - t
+        finally:
+            pool.close()
+            pool.join()
+        print("throughput: {:.2f} runs/s ({} runs, {} concurrent)".format(
+            num_runs / duration, num_runs, args.concurrency))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Measures the time taken to import each of the modules within start_core in a
+fresh interpreter, and checks that modules that don't talk to a vehicle do
+not import the MAVLink stack (i.e., dronekit and pymavlink).
+
+Exits with a non-zero status if any module exceeds its import-time budget or
+imports the MAVLink stack.
+
+Usage:
+    python benchmarks/import_time.py [--budget SECONDS] [--repeat N]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DIR_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'src')
+
+# modules that must be importable without the MAVLink stack
+MODULES = [
+    'start_core',
+    'start_core.catalog',
+    'start_core.scenario',
+    'start_core.mission',
+    'start_core.sitl',
+    'start_core.test',
+    'start_core.pool',
+    'start_core.warm',
+    'start_core.telemetry'
+]
+
+HEAVY = ('dronekit', 'pymavlink')
+
+PROBE = """
+import json, sys
+from timeit import default_timer as timer
+start = timer()
+import {module}
+elapsed = timer() - start
+heavy = sorted(m for m in sys.modules if m.split('.')[0] in {heavy!r})
+print(json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+"""
+
+
+def probe(module):  # type: (str) -> dict
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [DIR_SRC] + [p for p in [env.get('PYTHONPATH')] if p])
+    code = PROBE.format(module=module, heavy=HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():  # type: () -> int
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=0.25,
+                        help='maximum import time for each module (seconds)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of fresh interpreters used per module')
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        results = [probe(module) for _ in range(args.repeat)]
+        best = min(r['elapsed'] for r in results)
+        heavy = results[0]['heavy']
+        status = 'ok'
+        if heavy:
+            status = 'imports {}'.format(', '.join(m for m in heavy
+                                                   if '.' not in m))
+            failed = True
+        elif best > args.budget:
+            status = 'over budget'
+            failed = True
+        print("{:<24} {:8.1f} ms  {}".format(module, best * 1000, status))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
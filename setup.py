@@ -24,6 +24,11 @@ setuptools.setup(
         # 'pymavlink>=2.2.10',
         'typing'
     ],
+    # numpy is only needed by the optional analysis helpers (geodesy and
+    # telemetry.load); the core of the package uses the standard library
+    extras_require={
+        'analysis': ['numpy']
+    },
     include_package_data=True,
     packages=['start_core'],
     package_dir={'': 'src'},
@@ -0,0 +1,619 @@
+"""
+This module provides an asyncio-based counterpart to the test harness. Rather
+than dedicating threads to each SITL, attack server and vehicle connection,
+everything is driven by a single event loop, allowing one process to
+orchestrate many concurrent simulations. Requires Python 3.5 or later.
+"""
+__all__ = ['MAVLinkEndpoint', 'AsyncAttacker', 'connect', 'upload_mission',
+           'execute_mission', 'execute']
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import logging
+
+from pymavlink import mavutil
+
+from .sitl import SITL
+from .mission import Mission
+from .attack import Attack
+from .deadline import Deadline, SimulationDeadline
+from .simtime import SimulationClock
+from .exceptions import TimeoutException, MissionUploadException, \
+    AttackServerException
+from .helper import Location
+from .protocol import MAV_CMD_COMPONENT_ARM_DISARM, MAV_CMD_MISSION_START, \
+    MAV_MODE_FLAG_SAFETY_ARMED, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, \
+    MAV_MISSION_ACCEPTED, MODE_AUTO, is_waypoint_text, is_completion_text, \
+    mission_items, int_item
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+mavlink = mavutil.mavlink
+
+# the number of seconds to wait for the vehicle to act upon a command before
+# resending it
+TIMEOUT_COMMAND = Mission.TIMEOUT_COMMAND
+
+MAV_TYPE_GCS = 6
+
+
+class MAVLinkEndpoint(asyncio.DatagramProtocol):
+    """
+    Provides an asynchronous MAVLink connection to a vehicle. In the same way
+    as a pymavlink `udpin:` connection, the endpoint listens on a local UDP
+    port and replies to whichever address last sent it a message.
+    """
+    def __init__(self):  # type: () -> None
+        self.__loop = asyncio.get_event_loop()
+        self.__mav = mavlink.MAVLink(None, srcSystem=255, srcComponent=0)
+        self.__mav.robust_parsing = True
+        self.__transport = None  # type: Optional[asyncio.DatagramTransport]
+        self.__peer = None  # type: Optional[Tuple[str, int]]
+        self.__listeners = {}  # type: Dict[str, List[Callable[[Any], None]]]
+        self.__time_last_heartbeat = None  # type: Optional[float]
+        self.__connected = asyncio.Event()
+        self.target_system = 1
+        self.target_component = 1
+        self.armed = False
+        self.custom_mode = None  # type: Optional[int]
+        self.location = None  # type: Optional[Location]
+
+    @property
+    def mav(self):  # type: () -> mavlink.MAVLink
+        """
+        The MAVLink encoder used by this endpoint.
+        """
+        return self.__mav
+
+    @property
+    def last_heartbeat(self):  # type: () -> float
+        """
+        The number of seconds since the last heartbeat was received.
+        """
+        if self.__time_last_heartbeat is None:
+            return float('inf')
+        return self.__loop.time() - self.__time_last_heartbeat
+
+    def connection_made(self, transport):
+        self.__transport = transport
+
+    def datagram_received(self, data, addr):
+        self.__peer = addr
+        for message in self.__mav.parse_buffer(data) or []:
+            self.__dispatch(message)
+
+    def __dispatch(self, message):  # type: (Any) -> None
+        kind = message.get_type()
+        if kind == 'HEARTBEAT' and message.type != MAV_TYPE_GCS:
+            self.__time_last_heartbeat = self.__loop.time()
+            self.target_system = message.get_srcSystem()
+            self.target_component = message.get_srcComponent()
+            self.armed = bool(message.base_mode & MAV_MODE_FLAG_SAFETY_ARMED)
+            if message.base_mode & MAV_MODE_FLAG_CUSTOM_MODE_ENABLED:
+                self.custom_mode = message.custom_mode
+            self.__connected.set()
+        elif kind == 'GLOBAL_POSITION_INT':
+            self.location = Location(message.lat / 1.0e7,
+                                     message.lon / 1.0e7,
+                                     message.alt / 1.0e3)
+        for listener in list(self.__listeners.get(kind, [])):
+            listener(message)
+
+    def add_listener(self,
+                     kind,      # type: str
+                     listener   # type: Callable[[Any], None]
+                     ):         # type: (...) -> None
+        """
+        Attaches a callback to all messages of a given type.
+        """
+        self.__listeners.setdefault(kind, []).append(listener)
+
+    def remove_listener(self,
+                        kind,       # type: str
+                        listener    # type: Callable[[Any], None]
+                        ):          # type: (...) -> None
+        self.__listeners[kind].remove(listener)
+
+    def send(self, message):  # type: (Any) -> None
+        """
+        Sends a message to the vehicle.
+        """
+        if self.__peer is None:
+            logger.debug("dropping message: no connection to vehicle: %s",
+                         message)
+            return
+        self.__transport.sendto(message.pack(self.__mav), self.__peer)
+        self.__mav.seq = (self.__mav.seq + 1) % 256
+
+    def command_long(self, command, *params):  # type: (int, *float) -> None
+        """
+        Sends a COMMAND_LONG to the vehicle.
+        """
+        params = list(params) + [0] * (7 - len(params))
+        message = self.__mav.command_long_encode(self.target_system,
+                                                 self.target_component,
+                                                 command, 0, *params)
+        self.send(message)
+
+    async def receive(self,
+                      kinds,            # type: List[str]
+                      condition=None,   # type: Optional[Callable[[Any], bool]]
+                      timeout=None      # type: Optional[float]
+                      ):                # type: (...) -> Any
+        """
+        Waits for the next message of one of the given types that satisfies
+        an optional condition.
+
+        Raises:
+            asyncio.TimeoutError: if no such message arrives within the
+                timeout.
+        """
+        future = self.__loop.create_future()
+
+        def listener(message):
+            if future.done():
+                return
+            if condition is None or condition(message):
+                future.set_result(message)
+
+        for kind in kinds:
+            self.add_listener(kind, listener)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            for kind in kinds:
+                self.remove_listener(kind, listener)
+
+    async def wait_connected(self):  # type: () -> None
+        """
+        Waits until a heartbeat has been received from the vehicle.
+        """
+        await self.__connected.wait()
+
+    def close(self):  # type: () -> None
+        if self.__transport:
+            self.__transport.close()
+            self.__transport = None
+
+
+async def _receive(endpoint,        # type: MAVLinkEndpoint
+                   deadline,        # type: Deadline
+                   kinds,           # type: List[str]
+                   condition=None,  # type: Optional[Callable[[Any], bool]]
+                   timeout=None     # type: Optional[float]
+                   ):               # type: (...) -> Optional[Any]
+    """
+    Waits for a message from the vehicle within both a given deadline and an
+    optional timeout.
+
+    Returns:
+        the message, or None if the timeout elapsed.
+
+    Raises:
+        TimeoutException: if the deadline expired.
+    """
+    limit = deadline.remaining
+    if timeout is not None:
+        limit = min(timeout, limit)
+    try:
+        return await endpoint.receive(kinds, condition, limit)
+    except asyncio.TimeoutError:
+        deadline.check()
+        return None
+
+
+async def connect(port,     # type: int
+                  timeout   # type: float
+                  ):        # type: (...) -> MAVLinkEndpoint
+    """
+    Listens for a vehicle on a given local UDP port.
+
+    Raises:
+        TimeoutException: if no heartbeat is received from the vehicle
+            within the given number of seconds.
+    """
+    loop = asyncio.get_event_loop()
+    logger.debug("listening for vehicle on port %d", port)
+    (_, endpoint) = await loop.create_datagram_endpoint(
+        MAVLinkEndpoint, local_addr=('127.0.0.1', port))
+    try:
+        await asyncio.wait_for(endpoint.wait_connected(), timeout)
+    except asyncio.TimeoutError:
+        endpoint.close()
+        raise TimeoutException
+    logger.debug("established connection with vehicle")
+
+    # ask the vehicle to stream its state to us
+    message = endpoint.mav.request_data_stream_encode(
+        endpoint.target_system, endpoint.target_component,
+        mavlink.MAV_DATA_STREAM_ALL, 4, 1)
+    endpoint.send(message)
+    return endpoint
+
+
+async def upload_mission(endpoint,  # type: MAVLinkEndpoint
+                         mission,   # type: Mission
+                         deadline   # type: Deadline
+                         ):         # type: (...) -> None
+    """
+    Uploads a mission to the vehicle via the MAVLink mission protocol.
+
+    Raises:
+        MissionUploadException: if the vehicle rejects the mission.
+        TimeoutException: if the deadline expires before the upload completes.
+    """
+    items = mission_items(mission.command_tuples, mission.home)
+    mav = endpoint.mav
+    kinds = ['MISSION_REQUEST', 'MISSION_REQUEST_INT', 'MISSION_ACK']
+    started = False
+
+    logger.debug("uploading mission to vehicle")
+    endpoint.send(mav.mission_count_encode(endpoint.target_system,
+                                           endpoint.target_component,
+                                           len(items)))
+    while True:
+        message = await _receive(endpoint, deadline, kinds,
+                                 timeout=TIMEOUT_COMMAND)
+        if message is None:
+            if not started:
+                logger.debug("resending mission count")
+                endpoint.send(mav.mission_count_encode(
+                    endpoint.target_system, endpoint.target_component,
+                    len(items)))
+            continue
+
+        if message.get_type() == 'MISSION_ACK':
+            if message.type != MAV_MISSION_ACCEPTED:
+                msg = "vehicle rejected mission (MAV_MISSION_RESULT: {})"
+                raise MissionUploadException(msg.format(message.type))
+            logger.debug("finished uploading mission to vehicle")
+            return
+
+        if message.seq >= len(items):
+            msg = "vehicle requested mission item {} of {}"
+            raise MissionUploadException(msg.format(message.seq, len(items)))
+        started = True
+        item = items[message.seq]
+        if message.get_type() == 'MISSION_REQUEST_INT':
+            reply = mav.mission_item_int_encode(endpoint.target_system,
+                                                endpoint.target_component,
+                                                *int_item(item))
+        else:
+            reply = mav.mission_item_encode(endpoint.target_system,
+                                            endpoint.target_component,
+                                            *item)
+        endpoint.send(reply)
+
+
+async def execute_mission(mission,              # type: Mission
+                          endpoint,             # type: MAVLinkEndpoint
+                          time_limit,           # type: int
+                          speedup,              # type: int
+                          timeout_heartbeat,    # type: int
+                          check_wps,            # type: bool
+                          enable_workaround     # type: bool
+                          ):                    # type: (...) -> Tuple[bool, str]
+    """
+    Executes a mission on a given vehicle. Equivalent to `Mission.execute`.
+
+    Raises:
+        TimeoutException: if the mission doesn't finish executing within the
+            given time limit.
+    """
+    clock = SimulationClock(rate=speedup)
+    for name in SimulationClock.MESSAGES:
+        endpoint.add_listener(name, clock.on_message)
+    try:
+        return await _execute_mission(mission, endpoint, clock, time_limit,
+                                      timeout_heartbeat, check_wps,
+                                      enable_workaround)
+    finally:
+        for name in SimulationClock.MESSAGES:
+            endpoint.remove_listener(name, clock.on_message)
+
+
+async def _execute_mission(mission,             # type: Mission
+                           endpoint,            # type: MAVLinkEndpoint
+                           clock,               # type: SimulationClock
+                           time_limit,          # type: int
+                           timeout_heartbeat,   # type: int
+                           check_wps,           # type: bool
+                           enable_workaround    # type: bool
+                           ):                   # type: (...) -> Tuple[bool, str]
+    with SimulationDeadline(time_limit, clock) as deadline:
+        oracle = mission.oracle_for(enable_workaround)
+
+        # the vehicle rejects arming commands until it is armable
+        logger.debug("attempting to arm vehicle")
+        while not endpoint.armed:
+            endpoint.command_long(MAV_CMD_COMPONENT_ARM_DISARM, 1)
+            await _receive(endpoint, deadline, ['HEARTBEAT'],
+                           lambda m: m.base_mode & MAV_MODE_FLAG_SAFETY_ARMED,
+                           TIMEOUT_COMMAND)
+        logger.debug("vehicle is armed")
+
+        await upload_mission(endpoint, mission, deadline)
+
+        logger.debug("switching vehicle mode to AUTO")
+        mode = MODE_AUTO[mission.vehicle]
+        while endpoint.custom_mode != mode:
+            message = endpoint.mav.set_mode_encode(
+                endpoint.target_system,
+                MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
+                mode)
+            endpoint.send(message)
+            await _receive(endpoint, deadline, ['HEARTBEAT'],
+                           lambda m: m.custom_mode == mode,
+                           TIMEOUT_COMMAND)
+        logger.debug("switched vehicle mode to AUTO")
+
+        logger.debug("sending mission start message to vehicle")
+        endpoint.command_long(MAV_CMD_MISSION_START,
+                              1, len(mission) + 1, 0, 0, 0, 0, 4)
+        logger.debug("sent mission start message to vehicle")
+
+        # monitor the mission
+        mission_complete = asyncio.Event()
+        actual_num_wps_visited = [0]
+        pos_last = [endpoint.location]
+        is_copter = mission.vehicle == 'ArduCopter'
+
+        def on_waypoint(message):
+            text = message.text
+            if isinstance(text, bytes):
+                text = text.decode('utf-8', 'replace')
+            logger.debug("received STATUSTEXT from vehicle: %s", text)
+            if is_waypoint_text(text):
+                actual_num_wps_visited[0] += 1
+            if is_completion_text(text, is_copter):
+                logger.debug("message indicates end of mission")
+                actual_num_wps_visited[0] += 1
+                pos_last[0] = endpoint.location
+                mission_complete.set()
+
+        endpoint.add_listener('STATUSTEXT', on_waypoint)
+        try:
+            logger.debug("waiting for mission to terminate")
+            while not mission_complete.is_set():
+                time_to_heartbeat_loss = \
+                    timeout_heartbeat - endpoint.last_heartbeat
+                if time_to_heartbeat_loss <= 0:
+                    logger.debug("vehicle became unresponsive (heartbeat timeout: %.2f seconds)",
+                                 timeout_heartbeat)
+                    return (False, "vehicle became unresponsive.")
+                try:
+                    await asyncio.wait_for(
+                        mission_complete.wait(),
+                        min(time_to_heartbeat_loss, deadline.remaining))
+                except asyncio.TimeoutError:
+                    deadline.check()
+        finally:
+            endpoint.remove_listener('STATUSTEXT', on_waypoint)
+
+        logger.debug("mission has terminated")
+        return oracle.judge(actual_num_wps_visited[0], pos_last[0], check_wps)
+
+
+class AsyncAttacker(object):
+    """
+    Responsible for launching a given attack on a vehicle. Equivalent to
+    `Attacker`.
+    """
+    def __init__(self,
+                 attack,            # type: Attack
+                 url_sitl,          # type: str
+                 port,              # type: int
+                 timeout_ready=10,  # type: float
+                 expect_ready=False # type: bool
+                 ):                 # type: (...) -> None
+        self.__attack = attack
+        self.__url_sitl = url_sitl
+        self.__port = port
+        self.__timeout_ready = timeout_ready
+        self.__expect_ready = expect_ready
+        self.__report = 0
+        self.__fn_log = None
+        self.__fn_mav = None
+        self.__process = None  # type: Optional[asyncio.subprocess.Process]
+        self.__reader = None  # type: Optional[asyncio.StreamReader]
+        self.__writer = None  # type: Optional[asyncio.StreamWriter]
+
+    async def prepare(self):  # type: () -> None
+        """
+        Launches the attack server and connects to it as soon as it begins
+        listening.
+
+        Raises:
+            AttackServerException: if the attack server doesn't become ready
+                within the timeout.
+        """
+        logger.debug("preparing attacker")
+        self.__fn_log = tempfile.NamedTemporaryFile()
+        self.__fn_mav = tempfile.NamedTemporaryFile()
+        cmd = self.__attack.command(self.__url_sitl,
+                                    self.__port,
+                                    self.__report,
+                                    self.__fn_log.name,
+                                    self.__fn_mav.name)
+
+        logger.debug("launching attack server via command: %s", cmd)
+        self.__process = await asyncio.create_subprocess_shell(
+            cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True)
+        logger.debug("launched attack server")
+
+        deadline = Deadline(self.__timeout_ready)
+        delay = 0.01
+        while True:
+            try:
+                (self.__reader, self.__writer) = \
+                    await asyncio.open_connection('0.0.0.0', self.__port)
+                break
+            except OSError:
+                pass
+            if self.__process.returncode is not None:
+                msg = "attack server terminated unexpectedly (exit code: {})"
+                raise AttackServerException(
+                    msg.format(self.__process.returncode))
+            if deadline.expired:
+                msg = "attack server failed to start within {} seconds"
+                raise AttackServerException(msg.format(deadline.seconds))
+            await asyncio.sleep(min(delay, deadline.remaining))
+            delay = min(delay * 2, 0.5)
+        logger.debug("connected to attack server")
+
+        if self.__expect_ready:
+            logger.debug("waiting for READY message from attack server")
+            try:
+                reply = await asyncio.wait_for(self.__reader.readline(),
+                                               max(deadline.remaining, 0.001))
+            except asyncio.TimeoutError:
+                reply = None
+            if reply is None or reply.strip() != b"READY":
+                msg = "attack server failed to send READY message (reply: {})"
+                raise AttackServerException(msg.format(reply))
+            logger.debug("received READY message from attack server")
+        logger.debug("attacker is prepared")
+
+    async def __send(self, line):  # type: (str) -> None
+        self.__writer.write((line + "\n").encode('ascii'))
+        await self.__writer.drain()
+
+    async def start(self):  # type: () -> None
+        logger.debug("sending START message to attack server")
+        await self.__send("START")
+
+    async def was_successful(self, timeout=None):  # type: (Optional[float]) -> bool
+        """
+        Raises:
+            asyncio.TimeoutError: if the attack server doesn't reply within
+                the given number of seconds.
+        """
+        await self.__send("CHECK")
+        reply = await asyncio.wait_for(self.__reader.readline(), timeout)
+        return b"NO" not in reply.strip()
+
+    async def stop(self):  # type: () -> None
+        logger.debug("stopping attacker")
+        if self.__writer:
+            logger.debug("sending EXIT message to attack server")
+            try:
+                await self.__send("EXIT")
+            except (ConnectionError, OSError):
+                logger.debug("failed to send EXIT message to attack server")
+            self.__writer.close()
+            self.__writer = None
+            self.__reader = None
+
+        if self.__process:
+            logger.debug("closing attack server process [%d] via SIGKILL",
+                         self.__process.pid)
+            try:
+                os.killpg(self.__process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            await self.__process.wait()
+            self.__process = None
+
+        self.__fn_log = None
+        self.__fn_mav = None
+        logger.debug("stopped attacker")
+
+
+async def _launch_sitl(sitl,        # type: SITL
+                       prefix,      # type: Optional[str]
+                       speedup,     # type: int
+                       dir_run      # type: str
+                       ):           # type: (...) -> asyncio.subprocess.Process
+    command = sitl.command(prefix, speedup)
+    logger.debug("launching SITL via command: %s", command)
+    process = await asyncio.create_subprocess_shell(
+        command,
+        cwd=dir_run,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True)
+    logger.debug("launched SITL")
+    return process
+
+
+async def execute(sitl,                   # type: SITL
+                  mission,                # type: Mission
+                  attack=None,            # type: Optional[Attack]
+                  speedup=1,              # type: int
+                  prefix='',              # type: str
+                  timeout_mission=240,    # type: int
+                  timeout_liveness=1,     # type: int
+                  timeout_connection=10,  # type: int
+                  port_attacker=None,     # type: Optional[int]
+                  check_wps=False,        # type: bool
+                  enable_workaround=True  # type: bool
+                  ):                      # type: (...) -> Tuple[bool, str]
+    """
+    Executes the test. Accepts the same arguments as `test.execute`.
+
+    Returns:
+        a tuple of the form `(passed, reason)`.
+    """
+    attacker = None
+    if attack:
+        if port_attacker is None:
+            port_attacker = sitl.ports.attack_server
+        attacker = AsyncAttacker(attack,
+                                 sitl.url_attacker,
+                                 port_attacker,
+                                 timeout_ready=timeout_connection)
+
+    process = None
+    endpoint = None
+    dir_run = tempfile.mkdtemp(prefix='sitl')
+    try:
+        process = await _launch_sitl(sitl, prefix, speedup, dir_run)
+        if attacker:
+            await attacker.prepare()
+
+        logger.debug("trying to connect to vehicle [%s]", sitl.url)
+        endpoint = await connect(sitl.ports.harness, timeout_connection)
+
+        if attacker:
+            logger.debug("launching attack on vehicle")
+            await attacker.start()
+            logger.debug("launched attack on vehicle")
+        else:
+            logger.debug("skipping attack launch: no attack provided.")
+
+        return await execute_mission(mission,
+                                     endpoint,
+                                     time_limit=timeout_mission,
+                                     speedup=speedup,
+                                     timeout_heartbeat=timeout_liveness,
+                                     check_wps=check_wps,
+                                     enable_workaround=enable_workaround)
+    except TimeoutException:
+        return (False, "timeout occurred")
+    finally:
+        if attacker:
+            logger.debug("closing attack server")
+            await attacker.stop()
+            logger.debug("closed attack server")
+        if endpoint:
+            logger.debug("closing connection to vehicle")
+            endpoint.close()
+            logger.debug("closed connection to vehicle")
+        if process:
+            logger.debug("sending SIGTERM to SITL process [%d]", process.pid)
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            await process.wait()
+            logger.debug("sent SIGTERM to SITL process [%d]", process.pid)
+        shutil.rmtree(dir_run, ignore_errors=True)
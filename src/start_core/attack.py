@@ -1,10 +1,13 @@
 __all__ = ['Attack', 'Attacker']
 
+from typing import Callable, List, Optional
+from timeit import default_timer as timer
 import subprocess
 import signal
 import socket
 import os
 import tempfile
+import threading
 import time
 import logging
 
@@ -12,6 +15,8 @@ import attr
 import configparser
 
 from .helper import DEVNULL
+from .deadline import Deadline
+from .exceptions import AttackServerException
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
@@ -29,19 +34,111 @@ class Attack(object):
     latitude = attr.ib(type=float)
     radius = attr.ib(type=float)
 
+    def command(self,
+                url_sitl,   # type: str
+                port,       # type: int
+                report,     # type: int
+                fn_log,     # type: str
+                fn_mav      # type: str
+                ):          # type: (...) -> str
+        """
+        Computes the command that should be used to launch the attack server
+        for this attack.
+
+        Parameters:
+            url_sitl: the MAVLink URL of the vehicle under attack.
+            port: the port on which the attack server should listen.
+            report: the report timeout for the attack server.
+            fn_log: the file to which the attack server should write its log.
+            fn_mav: the file to which the attack server should write its
+                MAVLink log.
+        """
+        cmd = [
+            'python',
+            self.script,
+            "--master={}".format(url_sitl),
+            "--baudrate=115200",
+            "--port={}".format(port),
+            "--report-timeout={}".format(report),
+            "--logfile={}".format(fn_log),
+            "--mavlog={}".format(fn_mav)
+        ]
+
+        if self.flags != '':
+            tokens = self.flags.split(",")
+            cmd.extend(tokens)
+
+        cmd.extend([self.latitude, self.longitude, self.radius])
+        cmd = [str(s) for s in cmd]
+        return ' '.join(cmd)
+
+
+class _Request(object):
+    """
+    A request that awaits a reply from the attack server within a given
+    number of seconds.
+    """
+    def __init__(self, timeout):  # type: (float) -> None
+        self.__done = threading.Event()
+        self.timeout = timeout
+        self.expires_at = timer() + timeout
+        self.reply = None  # type: Optional[str]
+        self.error = None  # type: Optional[str]
+
+    def resolve(self, reply):  # type: (str) -> None
+        self.reply = reply
+        self.__done.set()
+
+    def fail(self, error):  # type: (str) -> None
+        self.error = error
+        self.__done.set()
+
+    def wait(self, timeout):  # type: (Optional[float]) -> bool
+        return self.__done.wait(timeout)
+
 
 class Attacker(object):
     """
     Responsible for launching a given attack on a vehicle.
+
+    Replies from the attack server are read on a background thread, and so
+    requests never block for longer than their timeout, and several requests
+    may be in flight at once (replies arrive in the order that requests were
+    sent). An attack server may also push an unsolicited SUCCESS line as soon
+    as its attack succeeds; listeners added via `add_success_listener` are
+    called as soon as success is known, however it was learned.
+
+    Requests that go unanswered for longer than their timeout are failed, and
+    writes to the attack server block for at most the request timeout, so a
+    stuck attack server can't stall the caller.
     """
     def __init__(self,
-                 attack,    # type: Attack
-                 url_sitl,  # type: str
-                 port       # type: int
-                 ):         # type: (...) -> None
+                 attack,            # type: Attack
+                 url_sitl,          # type: str
+                 port,              # type: int
+                 timeout_ready=10,  # type: float
+                 expect_ready=False,# type: bool
+                 timeout_request=5  # type: float
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            attack: the attack that should be launched.
+            url_sitl: the MAVLink URL of the vehicle under attack.
+            port: the port on which the attack server should listen.
+            timeout_ready: the number of seconds to wait for the attack server
+                to become ready.
+            expect_ready: if True, the attack server is expected to send a
+                READY line once it has accepted a connection, and the attacker
+                won't be considered prepared until that line is received.
+            timeout_request: the default number of seconds to wait for the
+                attack server to reply to a request.
+        """
         self.__attack = attack
         self.__url_sitl = url_sitl
         self.__port = port
+        self.__timeout_ready = timeout_ready
+        self.__expect_ready = expect_ready
+        self.__timeout_request = timeout_request
 
         # FIXME I can't find any documentation or examples for this parameter.
         # The default value in START is -1.
@@ -55,9 +152,55 @@ class Attacker(object):
 
         self.__fn_log = None
         self.__fn_mav = None
-        self.__connection = None
-        self.__socket = None
+        self.__socket = None  # type: Optional[socket.socket]
         self.__process = None
+        self.__reader = None  # type: Optional[threading.Thread]
+
+        # guards the state shared with the reader thread
+        self.__lock = threading.Lock()
+        # serialises writes to the attack server, so that requests are sent
+        # in the same order that they are added to the pending queue. the
+        # reader thread never takes this lock.
+        self.__send_lock = threading.Lock()
+        self.__pending = []  # type: List[_Request]
+        self.__num_unanswered = 0
+        self.__ready = threading.Event()
+        self.__closed = False
+        self.__successful = threading.Event()
+        self.__listeners = []  # type: List[Callable[[], None]]
+
+    @property
+    def succeeded(self):  # type: () -> bool
+        """
+        Indicates whether the attack server is known to have succeeded,
+        either because it pushed a SUCCESS line or because it replied YES to
+        a check. Never blocks.
+        """
+        return self.__successful.is_set()
+
+    @property
+    def num_unanswered(self):  # type: () -> int
+        """
+        The number of consecutive requests that the attack server has failed
+        to answer in time since it last replied.
+        """
+        return self.__num_unanswered
+
+    def add_success_listener(self, listener):  # type: (Callable[[], None]) -> None
+        """
+        Adds a function that is called, from the reader thread, once the
+        attack is known to have succeeded. If the attack has already
+        succeeded, the function is called immediately.
+        """
+        with self.__lock:
+            self.__listeners.append(listener)
+        if self.succeeded:
+            listener()
+
+    def remove_success_listener(self, listener):  # type: (Callable[[], None]) -> None
+        with self.__lock:
+            if listener in self.__listeners:
+                self.__listeners.remove(listener)
 
     def prepare(self):  # type: () -> None
         logger.debug("preparing attacker")
@@ -65,24 +208,11 @@ class Attacker(object):
         self.__fn_log = tempfile.NamedTemporaryFile()
         self.__fn_mav = tempfile.NamedTemporaryFile()
 
-        cmd = [
-            'python',
-            attack.script,
-            "--master={}".format(self.__url_sitl),
-            "--baudrate=115200",
-            "--port={}".format(self.__port),
-            "--report-timeout={}".format(self.__report),
-            "--logfile={}".format(self.__fn_log.name),
-            "--mavlog={}".format(self.__fn_mav.name)
-        ]
-
-        if attack.flags != '':
-            tokens = attack.flags.split(",")
-            cmd.extend(tokens)
-
-        cmd.extend([attack.latitude, attack.longitude, attack.radius])
-        cmd = [str(s) for s in cmd]
-        cmd = ' '.join(cmd)
+        cmd = attack.command(self.__url_sitl,
+                             self.__port,
+                             self.__report,
+                             self.__fn_log.name,
+                             self.__fn_mav.name)
 
         # launch server
         logger.debug("launching attack server via command: %s", cmd)
@@ -95,39 +225,184 @@ class Attacker(object):
                                           # stderr=subprocess.STDOUT)
         logger.debug("launched attack server")
 
-        # connect
-        logger.debug("creating socket to attack server")
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        time.sleep(2) # TODO hacky?
-        logger.debug("connecting to attack server via socket")
-        self.__socket .connect(("0.0.0.0", self.__port))
-        logger.debug("connected to attack server")
-        logger.debug("creating file via socket")
-        self.__connection = self.__socket.makefile()
-        logger.debug("created file via socket")
+        deadline = Deadline(self.__timeout_ready)
+        self.__socket = self.__connect(deadline)
+        # bounds the time for which a write to a stuck attack server blocks
+        self.__socket.settimeout(self.__timeout_request)
+        self.__reader = threading.Thread(target=self.__read)
+        self.__reader.daemon = True
+        self.__reader.start()
+
+        if self.__expect_ready:
+            logger.debug("waiting for READY message from attack server")
+            if not self.__ready.wait(max(deadline.remaining, 0.001)):
+                msg = "attack server failed to send READY message"
+                raise AttackServerException(msg)
+            logger.debug("received READY message from attack server")
         logger.debug("attacker is prepared")
 
+    def __connect(self, deadline):  # type: (Deadline) -> socket.socket
+        """
+        Connects to the attack server as soon as it begins listening, backing
+        off exponentially between connection attempts.
+
+        Raises:
+            AttackServerException: if the attack server terminates or fails to
+                accept a connection before the deadline.
+        """
+        delay = 0.01
+        while True:
+            logger.debug("connecting to attack server via socket")
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect(("0.0.0.0", self.__port))
+                logger.debug("connected to attack server")
+                return sock
+            except socket.error:
+                sock.close()
+
+            if self.__process.poll() is not None:
+                msg = "attack server terminated unexpectedly (exit code: {})"
+                raise AttackServerException(
+                    msg.format(self.__process.returncode))
+            if deadline.expired:
+                msg = "attack server failed to start within {} seconds"
+                raise AttackServerException(msg.format(deadline.seconds))
+            time.sleep(min(delay, deadline.remaining))
+            delay = min(delay * 2, 0.5)
+
+    def __read(self):  # type: () -> None
+        """
+        Reads lines from the attack server until its connection is closed.
+        """
+        buff = b''
+        while True:
+            try:
+                data = self.__socket.recv(4096)
+            except socket.timeout:
+                continue
+            except (socket.error, AttributeError):
+                data = b''
+            if not data:
+                break
+            buff += data
+            while b'\n' in buff:
+                (line, buff) = buff.split(b'\n', 1)
+                self.__on_line(line.strip().decode('ascii', 'replace'))
+
+        logger.debug("connection to attack server was closed")
+        with self.__lock:
+            self.__closed = True
+            pending = self.__pending
+            self.__pending = []
+        for request in pending:
+            request.fail("connection to attack server was closed")
+
+    def __on_line(self, line):  # type: (str) -> None
+        if line == "READY":
+            self.__ready.set()
+        elif line == "SUCCESS":
+            logger.debug("attack server reported that attack was successful")
+            self.__on_success()
+        else:
+            with self.__lock:
+                request = self.__pending.pop(0) if self.__pending else None
+                self.__num_unanswered = 0
+            if request is None:
+                logger.debug("ignoring unexpected line from attack server: %s",
+                             line)
+                return
+            if "NO" not in line:
+                self.__on_success()
+            request.resolve(line)
+
+    def __on_success(self):  # type: () -> None
+        if self.__successful.is_set():
+            return
+        self.__successful.set()
+        with self.__lock:
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("attack success listener failed")
+
+    def __send(self, line):  # type: (str) -> None
+        with self.__send_lock:
+            self.__socket.sendall((line + "\n").encode('ascii'))
+
+    def __request(self,
+                  line,     # type: str
+                  timeout   # type: float
+                  ):        # type: (...) -> _Request
+        """
+        Sends a request to the attack server without waiting for its reply.
+
+        Raises:
+            AttackServerException: if the connection to the attack server
+                has been closed, or if the request couldn't be sent.
+        """
+        request = _Request(timeout)
+        with self.__send_lock:
+            with self.__lock:
+                if self.__closed:
+                    raise AttackServerException(
+                        "connection to attack server was closed")
+                self.__pending.append(request)
+            try:
+                self.__socket.sendall((line + "\n").encode('ascii'))
+            except socket.error as err:
+                with self.__lock:
+                    if request in self.__pending:
+                        self.__pending.remove(request)
+                raise AttackServerException(
+                    "failed to send {} to attack server: {}".format(line, err))
+        return request
+
+    def __expire(self):  # type: () -> List[_Request]
+        """
+        Fails the pending requests that have gone unanswered for longer than
+        their timeout. Since every request is a CHECK, a late reply to an
+        expired request is taken as the reply to the next pending request.
+
+        Returns:
+            the requests that expired.
+        """
+        now = timer()
+        with self.__lock:
+            expired = [r for r in self.__pending if r.expires_at <= now]
+            if expired:
+                self.__pending = [r for r in self.__pending
+                                  if r.expires_at > now]
+                self.__num_unanswered += len(expired)
+        for request in expired:
+            msg = "attack server failed to reply within {} seconds"
+            request.fail(msg.format(request.timeout))
+        return expired
+
     def start(self):  # type: () -> None
-        logging.debug("sending START message to attack server")
-        self.__connection.write("START\n")
-        self.__connection.flush()
-        logging.debug("send START message to attack server")
+        logger.debug("sending START message to attack server")
+        self.__send("START")
+        logger.debug("sent START message to attack server")
 
     def stop(self):  # type: () -> None
         logger.debug("stopping attacker")
         # close connection
-        if self.__connection:
-            logger.debug("sending EXIT message to attack server")
-            self.__connection.write("EXIT\n")
-            self.__connection.flush()
-            self.__connection.close()
-            self.__connection = None
-            logger.debug("sent EXIT message to attack server and closed connection")
-
-        # close socket
         if self.__socket:
+            logger.debug("sending EXIT message to attack server")
+            try:
+                self.__send("EXIT")
+            except socket.error:
+                logger.debug("failed to send EXIT message to attack server")
             logger.debug("closing attack server socket")
+            try:
+                self.__socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            if self.__reader:
+                self.__reader.join()
+                self.__reader = None
             self.__socket.close()
             logger.debug("closed attack server socket")
             self.__socket = None
@@ -147,9 +422,53 @@ class Attacker(object):
 
         logger.debug("stopped attacker")
 
-    def was_successful(self):  # type: () -> bool
-        self.__connection.write("CHECK\n")
-        self.__connection.flush()
+    def check(self):  # type: () -> None
+        """
+        Asks the attack server whether its attack was successful, without
+        waiting for its reply. The reply is reflected by `succeeded`. At most
+        one such request is in flight at a time: if the previous request is
+        still awaiting its reply, no new request is sent.
+
+        Raises:
+            AttackServerException: if the previous request went unanswered
+                for longer than the request timeout, or if the request could
+                not be sent.
+        """
+        if self.succeeded:
+            return
+        if self.__expire():
+            msg = "attack server failed to reply to CHECK within {} seconds"
+            raise AttackServerException(msg.format(self.__timeout_request))
+        with self.__lock:
+            if self.__pending:
+                return
+        self.__request("CHECK", self.__timeout_request)
+
+    def was_successful(self, timeout=None):  # type: (Optional[float]) -> bool
+        """
+        Asks the attack server whether its attack was successful, and waits
+        for its reply.
+
+        Parameters:
+            timeout: the number of seconds to wait for a reply. Defaults to
+                the request timeout given to the attacker.
 
-        reply = self.__connection.readline().strip()
-        return "NO" not in reply
+        Raises:
+            AttackServerException: if the attack server didn't reply in time,
+                or if its connection was closed.
+        """
+        if self.succeeded:
+            return True
+        if timeout is None:
+            timeout = self.__timeout_request
+        request = self.__request("CHECK", timeout)
+        if not request.wait(timeout):
+            with self.__lock:
+                if request in self.__pending:
+                    self.__pending.remove(request)
+                    self.__num_unanswered += 1
+            msg = "attack server failed to reply to CHECK within {} seconds"
+            raise AttackServerException(msg.format(timeout))
+        if request.error:
+            raise AttackServerException(request.error)
+        return "NO" not in request.reply
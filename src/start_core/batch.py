@@ -0,0 +1,399 @@
+"""
+This module is used to build many patched variants of a scenario at once
+(e.g., a generation of candidate repairs). The base version of the scenario
+is checked out, patched with its vulnerability, configured and built exactly
+once. The variants are then built in parallel by a number of workers, each
+of which owns a copy of the base version. For each of its patches, a worker
+applies the patch, incrementally rebuilds the SITL (so that only the
+translation units touched by the patch are recompiled), exports the files
+needed to launch the SITL, and reverses the patch.
+
+Waf records the absolute paths of the files that it builds, and so each
+worker must configure and build its copy once before building any patches.
+If ccache is installed, a compiler cache that is shared by the base version
+and all of the workers lets those builds, and the rebuilds of files that
+were touched by a reversed patch, reuse the objects compiled for the base
+version rather than compiling them again.
+"""
+__all__ = ['BuildResult', 'BatchBuilder']
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import logging
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import attr
+
+from .sitl import SITL
+from .build_cache import BuildCache, bundle_paths
+from .exceptions import PatchBuildException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+# the number of lines of build output that are included in build failures
+NUM_OUTPUT_LINES = 20
+
+
+@attr.s(frozen=True)
+class BuildResult(object):
+    """
+    Describes the outcome of building a single patched variant of a scenario.
+    Exactly one of `sitl` and `error` is provided.
+    """
+    filename_patch = attr.ib(type=str)
+    sitl = attr.ib(type=Optional[SITL], default=None)
+    error = attr.ib(type=Optional[PatchBuildException], default=None)
+    cached = attr.ib(type=bool, default=False)
+
+    @property
+    def succeeded(self):  # type: () -> bool
+        return self.sitl is not None
+
+
+def _which(program):  # type: (str) -> Optional[str]
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        fn = os.path.join(directory, program)
+        if os.path.isfile(fn) and os.access(fn, os.X_OK):
+            return fn
+    return None
+
+
+def _run(cmd,   # type: str
+         cwd,   # type: str
+         env    # type: Dict[str, str]
+         ):     # type: (...) -> Tuple[int, str]
+    """
+    Executes a given shell command, and returns its exit code and combined
+    output.
+    """
+    logger.debug("executing command in %s: %s", cwd, cmd)
+    process = subprocess.Popen(cmd,
+                               shell=True,
+                               cwd=cwd,
+                               env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    (output, _) = process.communicate()
+    output = output.decode('utf-8', 'replace')
+    logger.debug("command exited with code %d: %s", process.returncode, cmd)
+    return (process.returncode, output)
+
+
+def _failure(message, output):  # type: (str, str) -> PatchBuildException
+    tail = output.rstrip().splitlines()[-NUM_OUTPUT_LINES:]
+    return PatchBuildException('\n'.join([message] + tail))
+
+
+class BatchBuilder(object):
+    """
+    Builds many patched variants of a given scenario in parallel. The
+    builder should be used as a context manager: the SITLs that it produces
+    may only be used within that context, after which all of their files
+    are destroyed.
+    """
+    def __init__(self,
+                 scenario,          # type: Scenario
+                 dir_ardupilot,     # type: str
+                 workers=None,      # type: Optional[int]
+                 cache=None         # type: Optional[BuildCache]
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            scenario: the scenario whose variants should be built.
+            dir_ardupilot: the ArduPilot repository.
+            workers: the number of variants that may be built at once. By
+                default, one worker is used for every four CPUs.
+            cache: an optional build cache. Variants that are in the cache
+                are not built, and variants that are built are added to it.
+        """
+        if workers is None:
+            workers = max(1, multiprocessing.cpu_count() // 4)
+        self.__scenario = scenario
+        self.__dir_ardupilot = dir_ardupilot
+        self.__workers = workers
+        self.__jobs = max(1, multiprocessing.cpu_count() // workers)
+        self.__cache = cache
+        self.__ccache = _which('ccache')
+        self.__dir_batch = None  # type: Optional[str]
+        self.__dir_base = None  # type: Optional[str]
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__threads = []  # type: List[threading.Thread]
+        self.__cached = []  # type: List[Any]
+        self.__num_variants = 0
+
+    def __enter__(self):  # type: () -> BatchBuilder
+        self.__dir_batch = tempfile.mkdtemp(prefix='batch')
+        logger.debug("using temporary batch build directory: %s",
+                     self.__dir_batch)
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.__stopped.set()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        for entry in self.__cached:
+            entry.__exit__(None, None, None)
+        self.__cached = []
+        if self.__dir_batch:
+            logger.debug("destroying temporary batch build directory: %s",
+                         self.__dir_batch)
+            shutil.rmtree(self.__dir_batch, ignore_errors=True)
+            self.__dir_batch = None
+
+    def __environment(self, dir_tree):  # type: (str) -> Dict[str, str]
+        """
+        Computes the environment for builds within a given source tree.
+        """
+        env = dict(os.environ)
+        if self.__ccache:
+            env.setdefault('CCACHE_DIR',
+                           os.path.join(self.__dir_batch, 'ccache'))
+            # allows objects to be shared between trees at different paths
+            env['CCACHE_BASEDIR'] = dir_tree
+            env['CCACHE_NOHASHDIR'] = '1'
+            env.setdefault('CC', 'ccache gcc')
+            env.setdefault('CXX', 'ccache g++')
+        return env
+
+    def __waf(self, dir_tree, args):  # type: (str, str) -> Tuple[int, str]
+        cmd = "./waf {}".format(args)
+        return _run(cmd, dir_tree, self.__environment(dir_tree))
+
+    def __build_tree(self, dir_tree):  # type: (str) -> None
+        """
+        Configures and builds the SITL within a given source tree.
+
+        Raises:
+            PatchBuildException: if the SITL failed to build.
+        """
+        for args in ['configure --no-submodule-update',
+                     '{} -j{}'.format(self.__scenario.waf_target,
+                                      self.__jobs)]:
+            (code, output) = self.__waf(dir_tree, args)
+            if code != 0:
+                msg = "failed to build base version of scenario: {}"
+                raise _failure(msg.format(self.__scenario.name), output)
+
+    def __prepare_base(self):  # type: () -> None
+        """
+        Checks out the base version of the scenario. If ccache is available,
+        the base version is also configured and built, so that its objects
+        may be shared with the workers; otherwise, since workers rebuild
+        their trees from scratch, building it would be wasted effort.
+        """
+        dir_base = os.path.join(self.__dir_batch, 'base')
+        logger.debug("copying files to base build context: %s", dir_base)
+        shutil.copytree(self.__dir_ardupilot, dir_base, symlinks=True)
+        self.__scenario._prepare_in(dir_base)
+        if self.__ccache:
+            self.__build_tree(dir_base)
+            logger.debug("built base version of scenario")
+        else:
+            logger.debug("ccache not found: skipping build of base version")
+        self.__dir_base = dir_base
+
+    def __prepare_worker(self, index):  # type: (int) -> str
+        """
+        Creates the source tree for a given worker by copying the base
+        version, and builds its SITL.
+        """
+        dir_worker = os.path.join(self.__dir_batch, 'worker{}'.format(index))
+        shutil.rmtree(dir_worker, ignore_errors=True)
+
+        # the build directory is tied to the path of the base version
+        dir_base = self.__dir_base
+
+        def ignore(directory, names):
+            if directory == dir_base:
+                return ['build']
+            return []
+
+        logger.debug("creating worker tree: %s", dir_worker)
+        shutil.copytree(dir_base, dir_worker, symlinks=True, ignore=ignore)
+        self.__build_tree(dir_worker)
+        logger.debug("created worker tree: %s", dir_worker)
+        return dir_worker
+
+    def __export(self, dir_worker):  # type: (str) -> SITL
+        """
+        Copies the files needed to launch the SITL that was built within a
+        given worker tree to a new directory.
+        """
+        vehicle = self.__scenario.mission.vehicle
+        with self.__lock:
+            self.__num_variants += 1
+            dir_variant = os.path.join(self.__dir_batch,
+                                       'variant{}'.format(self.__num_variants))
+        for path in bundle_paths(vehicle):
+            shutil.copytree(os.path.join(dir_worker, path),
+                            os.path.join(dir_variant, path),
+                            symlinks=True)
+        fn_harness = os.path.join(dir_variant, 'Tools/autotest/sim_vehicle.py')
+        return SITL(fn_harness, vehicle, self.__scenario.mission.home)
+
+    def __build_patch(self,
+                      dir_worker,       # type: str
+                      filename_patch    # type: str
+                      ):                # type: (...) -> Tuple[BuildResult, bool]
+        """
+        Builds the variant of the scenario for a given patch within a given
+        worker tree, before restoring the tree to its original state.
+
+        Returns:
+            a tuple of the form `(result, restored)`, where `restored`
+            indicates whether the tree was successfully restored.
+        """
+        scenario = self.__scenario
+        env = self.__environment(dir_worker)
+        fn_patch = os.path.abspath(filename_patch)
+
+        # a dry run ensures that the tree is untouched if the patch fails
+        cmd = "patch -p1 --dry-run --no-backup-if-mismatch -i '{}'"
+        (code, output) = _run(cmd.format(fn_patch), dir_worker, env)
+        if code != 0:
+            error = _failure("failed to apply patch: {}".format(filename_patch),
+                             output)
+            return (BuildResult(filename_patch, error=error), True)
+
+        cmd = "patch -p1 --no-backup-if-mismatch -i '{}'".format(fn_patch)
+        (code, output) = _run(cmd, dir_worker, env)
+        if code != 0:
+            # the patch may have been partially applied, and so the tree
+            # can't be trusted
+            error = _failure("failed to apply patch: {}".format(filename_patch),
+                             output)
+            return (BuildResult(filename_patch, error=error), False)
+        try:
+            args = '{} -j{}'.format(scenario.waf_target, self.__jobs)
+            (code, output) = self.__waf(dir_worker, args)
+            if code != 0:
+                msg = "failed to build patch: {}".format(filename_patch)
+                result = BuildResult(filename_patch,
+                                     error=_failure(msg, output))
+            else:
+                if self.__cache:
+                    key = BuildCache.key(scenario.revision,
+                                         scenario.diff_fn,
+                                         filename_patch,
+                                         scenario.mission.vehicle)
+                    self.__cache.store(key, dir_worker,
+                                       scenario.mission.vehicle)
+                result = BuildResult(filename_patch,
+                                     sitl=self.__export(dir_worker))
+        finally:
+            cmd = "patch -p1 -R -E --no-backup-if-mismatch -i '{}'"
+            (code, _) = _run(cmd.format(fn_patch), dir_worker, env)
+        return (result, code == 0)
+
+    def __work(self,
+               index,       # type: int
+               patches,     # type: queue.Queue
+               results      # type: queue.Queue
+               ):           # type: (...) -> None
+        """
+        Builds patches from a given queue until the queue is empty or the
+        builder is stopped.
+        """
+        dir_worker = None  # type: Optional[str]
+        try:
+            while not self.__stopped.is_set():
+                try:
+                    filename_patch = patches.get_nowait()
+                except queue.Empty:
+                    return
+                logger.debug("worker %d building patch: %s",
+                             index, filename_patch)
+                restored = False
+                try:
+                    if dir_worker is None:
+                        dir_worker = self.__prepare_worker(index)
+                    (result, restored) = self.__build_patch(dir_worker,
+                                                            filename_patch)
+                except Exception as err:
+                    logger.exception("worker %d failed to build patch: %s",
+                                     index, filename_patch)
+                    msg = "failed to build patch: {} ({})"
+                    error = PatchBuildException(msg.format(filename_patch, err))
+                    result = BuildResult(filename_patch, error=error)
+                results.put(result)
+                if not restored and dir_worker:
+                    logger.debug("failed to restore tree for worker %d: recreating it",
+                                 index)
+                    shutil.rmtree(dir_worker, ignore_errors=True)
+                    dir_worker = None
+        finally:
+            if dir_worker:
+                shutil.rmtree(dir_worker, ignore_errors=True)
+
+    def build(self,
+              filenames_patches     # type: Iterable[str]
+              ):                    # type: (...) -> Iterator[BuildResult]
+        """
+        Builds the variant of the scenario for each of a given set of
+        patches, yielding the result for each patch as soon as it has been
+        built. Results are not necessarily produced in the order of the
+        patches.
+
+        Raises:
+            subprocess.CalledProcessError: if the base version of the
+                scenario couldn't be checked out.
+            PatchBuildException: if the base version of the scenario failed
+                to build.
+        """
+        assert self.__dir_batch, "batch builder must be used as a context"
+        scenario = self.__scenario
+        patches = queue.Queue()  # type: queue.Queue
+        num_patches = 0
+        for filename_patch in filenames_patches:
+            if self.__cache:
+                key = BuildCache.key(scenario.revision,
+                                     scenario.diff_fn,
+                                     filename_patch,
+                                     scenario.mission.vehicle)
+                entry = self.__cache.open(key)
+                dir_cached = entry.__enter__()
+                if dir_cached:
+                    self.__cached.append(entry)
+                    logger.debug("using cached build for patch: %s",
+                                 filename_patch)
+                    fn_harness = os.path.join(dir_cached,
+                                              'Tools/autotest/sim_vehicle.py')
+                    sitl = SITL(fn_harness,
+                                scenario.mission.vehicle,
+                                scenario.mission.home)
+                    yield BuildResult(filename_patch, sitl=sitl, cached=True)
+                    continue
+                entry.__exit__(None, None, None)
+            patches.put(filename_patch)
+            num_patches += 1
+
+        if num_patches == 0:
+            return
+        if not self.__dir_base:
+            self.__prepare_base()
+
+        results = queue.Queue()  # type: queue.Queue
+        num_workers = min(self.__workers, num_patches)
+        logger.debug("building %d patches with %d workers",
+                     num_patches, num_workers)
+        threads = [threading.Thread(target=self.__work,
+                                    args=(i, patches, results))
+                   for i in range(num_workers)]
+        self.__threads += threads
+        for thread in threads:
+            thread.start()
+
+        for _ in range(num_patches):
+            yield results.get()
@@ -0,0 +1,218 @@
+"""
+This module implements an on-disk, content-addressed cache of built SITL
+binaries. Entries are keyed by a hash of the inputs to a build, and the cache
+is kept within a given size by evicting its least recently used entries.
+"""
+__all__ = ['BuildCache', 'bundle_paths']
+
+from typing import Iterator, List, Optional, Tuple
+import os
+import shutil
+import tempfile
+import hashlib
+import fcntl
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+def bundle_paths(vehicle):  # type: (str) -> List[str]
+    """
+    Returns the paths, relative to the root of a build context, of the files
+    that are needed to launch the SITL for a given vehicle.
+    """
+    return ['Tools', vehicle, 'build/sitl/bin']
+
+
+def _disk_usage(directory):  # type: (str) -> int
+    size = 0
+    for (root, _, files) in os.walk(directory):
+        for fn in files:
+            fn = os.path.join(root, fn)
+            if not os.path.islink(fn):
+                size += os.path.getsize(fn)
+    return size
+
+
+class BuildCache(object):
+    """
+    Provides a size-bounded, least-recently-used cache of built SITLs. Only
+    the files that are required to launch the SITL (i.e., the `Tools` and
+    vehicle directories, and the built binaries) are kept. Safe to share
+    between processes.
+    """
+    def __init__(self,
+                 directory,                 # type: str
+                 max_size=20 * (1024 ** 3)  # type: int
+                 ):                         # type: (...) -> None
+        """
+        Parameters:
+            directory: the directory in which cached builds should be stored.
+            max_size: the maximum number of bytes that the cache may occupy.
+        """
+        self.__directory = os.path.abspath(directory)
+        self.__max_size = max_size
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+
+    @property
+    def directory(self):  # type: () -> str
+        return self.__directory
+
+    @staticmethod
+    def key(revision,   # type: str
+            fn_diff,    # type: str
+            fn_patch,   # type: Optional[str]
+            vehicle     # type: str
+            ):          # type: (...) -> str
+        """
+        Computes the cache key for a build from the contents of its inputs.
+        """
+        h = hashlib.sha256()
+        h.update(revision.encode('utf-8') + b'\0')
+        h.update(vehicle.encode('utf-8') + b'\0')
+        for fn in [fn_diff, fn_patch]:
+            if fn is None:
+                h.update(b'\0')
+                continue
+            with open(fn, 'rb') as f:
+                contents = f.read()
+            h.update(hashlib.sha256(contents).hexdigest().encode('ascii'))
+        return h.hexdigest()
+
+    def __entry(self, key):  # type: (str) -> str
+        return os.path.join(self.__directory, key)
+
+    @contextlib.contextmanager
+    def __locked(self):  # type: () -> Iterator[None]
+        """
+        Holds an exclusive lock over the contents of the cache.
+        """
+        with open(os.path.join(self.__directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def open(self, key):  # type: (str) -> Iterator[Optional[str]]
+        """
+        Provides access to a cached build for the duration of a context,
+        during which the build is protected from eviction.
+
+        Returns:
+            the directory containing the cached build, or None if the build
+            isn't in the cache.
+        """
+        dir_entry = self.__entry(key)
+        fn_lock = os.path.join(dir_entry, '.lock')
+        try:
+            f = open(fn_lock, 'r')
+        except (IOError, OSError):
+            logger.debug("build cache miss: %s", key)
+            yield None
+            return
+
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            # the entry may have been evicted while we waited for the lock
+            if not os.path.isdir(dir_entry):
+                logger.debug("build cache miss: %s", key)
+                yield None
+                return
+            logger.debug("build cache hit: %s", key)
+            os.utime(fn_lock, None)
+            yield dir_entry
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def store(self,
+              key,          # type: str
+              dir_source,   # type: str
+              vehicle       # type: str
+              ):            # type: (...) -> None
+        """
+        Adds the SITL from a given build context to the cache before evicting
+        entries as necessary to bring the cache back within its size limit.
+        """
+        logger.debug("storing build in cache: %s", key)
+        dir_tmp = tempfile.mkdtemp(prefix='.tmp', dir=self.__directory)
+        try:
+            for path in bundle_paths(vehicle):
+                src = os.path.join(dir_source, path)
+                dst = os.path.join(dir_tmp, path)
+                shutil.copytree(src, dst, symlinks=True)
+            with open(os.path.join(dir_tmp, '.size'), 'w') as f:
+                f.write(str(_disk_usage(dir_tmp)))
+            open(os.path.join(dir_tmp, '.lock'), 'w').close()
+
+            with self.__locked():
+                if os.path.isdir(self.__entry(key)):
+                    logger.debug("build was already cached: %s", key)
+                else:
+                    os.rename(dir_tmp, self.__entry(key))
+                    logger.debug("stored build in cache: %s", key)
+                self.__evict(keep=key)
+        finally:
+            shutil.rmtree(dir_tmp, ignore_errors=True)
+
+    def __entries(self):  # type: () -> List[Tuple[float, int, str]]
+        """
+        Returns a list of the (last use, size, key) of each cached build.
+        """
+        entries = []
+        for key in os.listdir(self.__directory):
+            if key.startswith('.'):
+                continue
+            dir_entry = self.__entry(key)
+            try:
+                last_used = os.path.getmtime(os.path.join(dir_entry, '.lock'))
+                with open(os.path.join(dir_entry, '.size'), 'r') as f:
+                    size = int(f.read())
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append((last_used, size, key))
+        return entries
+
+    def __evict(self, keep):  # type: (str) -> None
+        """
+        Evicts the least recently used builds, other than those that are in
+        use or the given build, until the cache is within its size limit.
+        Must be called while holding the cache lock.
+        """
+        entries = sorted(self.__entries())
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, key) in entries:
+            if total <= self.__max_size:
+                break
+            if key == keep:
+                continue
+            dir_entry = self.__entry(key)
+            with open(os.path.join(dir_entry, '.lock'), 'r') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    logger.debug("skipping eviction of build in use: %s", key)
+                    continue
+                dir_trash = tempfile.mkdtemp(prefix='.trash',
+                                             dir=self.__directory)
+                os.rename(dir_entry, os.path.join(dir_trash, key))
+            shutil.rmtree(dir_trash, ignore_errors=True)
+            total -= size
+            logger.debug("evicted build from cache: %s", key)
+
+    def clear(self):  # type: () -> None
+        """
+        Removes all builds that aren't in use from the cache.
+        """
+        with self.__locked():
+            max_size = self.__max_size
+            self.__max_size = 0
+            try:
+                self.__evict(keep='')
+            finally:
+                self.__max_size = max_size
@@ -0,0 +1,355 @@
+"""
+This module provides a catalog of the scenarios within a directory tree.
+The catalog is backed by a persistent JSON index, which records the
+description of each scenario (i.e., its name, revision, vehicle, home, and
+files), allowing the catalog to be opened and queried without parsing any
+configuration files. The mission and attack for a scenario are only loaded
+once the scenario itself is requested.
+
+The index is invalidated by changes to the directory tree: a scenario is
+re-read only if the modification time and size of one of its files has
+changed and the contents of that file (as given by its hash) differ.
+"""
+__all__ = ['ScenarioEntry', 'Catalog']
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import os
+import json
+import fnmatch
+import hashlib
+import tempfile
+import logging
+
+import attr
+import configparser
+
+from .scenario import Scenario, read_config
+from .exceptions import STARTException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+INDEX_VERSION = 1
+
+# (modification time, size, sha1)
+FileStamp = Tuple[Optional[float], Optional[int], Optional[str]]
+
+# (modification time, names of subdirectories, names of scenario files)
+DirectoryStamp = Tuple[float, List[str], List[str]]
+
+
+def _hash(fn):  # type: (str) -> Optional[str]
+    h = hashlib.sha1()
+    try:
+        with open(fn, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                h.update(block)
+    except (IOError, OSError):
+        return None
+    return h.hexdigest()
+
+
+def _stamp(fn, digest=True):  # type: (str, bool) -> FileStamp
+    """
+    Returns the modification time, size and (optionally) hash of a file.
+    Missing files are given an empty stamp.
+    """
+    try:
+        stat = os.stat(fn)
+    except (IOError, OSError):
+        return (None, None, None)
+    return (stat.st_mtime, stat.st_size, _hash(fn) if digest else None)
+
+
+@attr.s(frozen=True)
+class ScenarioEntry(object):
+    """
+    Describes a scenario within a catalog without loading its mission or
+    attack.
+    """
+    filename = attr.ib(type=str)
+    name = attr.ib(type=str)
+    revision = attr.ib(type=str)
+    vehicle = attr.ib(type=str)
+    home = attr.ib(type=Tuple[float, float, float, float], converter=tuple)
+    description = attr.ib(type=Dict[str, Any], repr=False, cmp=False)
+
+    @staticmethod
+    def from_description(desc):  # type: (Dict[str, Any]) -> ScenarioEntry
+        return ScenarioEntry(filename=desc['filename'],
+                             name=desc['name'],
+                             revision=desc['revision'],
+                             vehicle=desc['vehicle'],
+                             home=desc['home'],
+                             description=desc)
+
+    @property
+    def files(self):  # type: () -> List[str]
+        """
+        The files upon which this scenario depends.
+        """
+        desc = self.description
+        return [desc['filename'], desc['fn_mission'], desc['fn_diff'],
+                desc['fn_attack']]
+
+    def scenario(self):  # type: () -> Scenario
+        """
+        Loads this scenario, together with its mission and attack.
+        """
+        logger.debug("materialising scenario: %s", self.name)
+        return Scenario.from_description(self.description)
+
+
+class Catalog(object):
+    """
+    Provides an index of the scenarios whose configuration files, matching a
+    given pattern, reside within a given directory tree.
+    """
+    def __init__(self,
+                 directory,             # type: str
+                 fn_index=None,         # type: Optional[str]
+                 pattern='*.config'     # type: str
+                 ):                     # type: (...) -> None
+        """
+        Opens the catalog for a given directory, reusing its index if the
+        index is up to date, and otherwise updating the index.
+
+        Parameters:
+            directory: the directory tree that contains the scenarios.
+            fn_index: the file in which the index should be stored. Defaults
+                to `.catalog.json` within the given directory.
+            pattern: the pattern used to identify scenario files.
+        """
+        self.__directory = os.path.abspath(directory)
+        if fn_index is None:
+            fn_index = os.path.join(self.__directory, '.catalog.json')
+        self.__fn_index = fn_index
+        self.__pattern = pattern
+
+        self.__directories = {}  # type: Dict[str, DirectoryStamp]
+        self.__files = {}  # type: Dict[str, FileStamp]
+        self.__errors = {}  # type: Dict[str, str]
+        self.__entries = []  # type: List[ScenarioEntry]
+        self.__by_name = {}  # type: Dict[str, ScenarioEntry]
+        self.__by_vehicle = {}  # type: Dict[str, List[ScenarioEntry]]
+        self.__by_revision = {}  # type: Dict[str, List[ScenarioEntry]]
+
+        # indicates that the stamps within the index have been updated
+        self.__stale_stamps = False
+
+        if not self.__read_index() or not self.__is_fresh():
+            self.refresh()
+        elif self.__stale_stamps:
+            self.__save()
+
+    @property
+    def directory(self):  # type: () -> str
+        return self.__directory
+
+    @property
+    def errors(self):  # type: () -> Dict[str, str]
+        """
+        The reason that each invalid scenario file was excluded from the
+        catalog, indexed by filename.
+        """
+        return dict(self.__errors)
+
+    def __len__(self):  # type: () -> int
+        return len(self.__entries)
+
+    def __iter__(self):  # type: () -> Iterator[ScenarioEntry]
+        return iter(self.__entries)
+
+    def __getitem__(self, name):  # type: (str) -> ScenarioEntry
+        """
+        Retrieves the scenario with a given name.
+
+        Raises:
+            KeyError: if there is no scenario with the given name.
+        """
+        return self.__by_name[name]
+
+    def find(self,
+             vehicle=None,  # type: Optional[str]
+             revision=None  # type: Optional[str]
+             ):             # type: (...) -> List[ScenarioEntry]
+        """
+        Returns the scenarios for a given vehicle and/or revision.
+        """
+        if vehicle is not None:
+            entries = self.__by_vehicle.get(vehicle, [])
+        elif revision is not None:
+            entries = self.__by_revision.get(revision, [])
+        else:
+            entries = self.__entries
+        if revision is not None:
+            entries = [e for e in entries if e.revision == revision]
+        return list(entries)
+
+    def __index(self, entries):  # type: (List[ScenarioEntry]) -> None
+        entries = sorted(entries, key=lambda e: e.filename)
+        self.__entries = entries
+        self.__by_name = {e.name: e for e in entries}
+        self.__by_vehicle = {}
+        self.__by_revision = {}
+        for entry in entries:
+            self.__by_vehicle.setdefault(entry.vehicle, []).append(entry)
+            self.__by_revision.setdefault(entry.revision, []).append(entry)
+
+    def __read_index(self):  # type: () -> bool
+        """
+        Attempts to load the index from disk.
+
+        Returns:
+            True if the index was loaded, or False if it doesn't exist or is
+            incompatible with this catalog.
+        """
+        try:
+            with open(self.__fn_index, 'r') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            logger.debug("failed to read catalog index: %s", self.__fn_index)
+            return False
+        if index.get('version') != INDEX_VERSION or \
+           index.get('pattern') != self.__pattern:
+            logger.debug("ignoring incompatible catalog index")
+            return False
+        self.__directories = {dn: tuple(s)
+                              for (dn, s) in index['directories'].items()}
+        self.__files = {fn: tuple(s) for (fn, s) in index['files'].items()}
+        self.__errors = index['errors']
+        self.__index([ScenarioEntry.from_description(d)
+                      for d in index['scenarios']])
+        logger.debug("read catalog index: %d scenarios", len(self))
+        return True
+
+    def __write_index(self):  # type: () -> None
+        index = {'version': INDEX_VERSION,
+                 'pattern': self.__pattern,
+                 'directories': self.__directories,
+                 'files': self.__files,
+                 'errors': self.__errors,
+                 'scenarios': [e.description for e in self.__entries]}
+        dir_index = os.path.dirname(os.path.abspath(self.__fn_index))
+        (fd, fn_tmp) = tempfile.mkstemp(prefix='.catalog', dir=dir_index)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.rename(fn_tmp, self.__fn_index)
+        except Exception:
+            os.remove(fn_tmp)
+            raise
+        logger.debug("wrote catalog index: %s", self.__fn_index)
+
+    def __is_unchanged(self, fn):  # type: (str) -> bool
+        """
+        Determines whether a given file is unchanged since it was indexed.
+        A file whose modification time or size has changed is rehashed, and
+        its recorded stamp is updated if its contents are unchanged.
+        """
+        stamp = self.__files.get(fn)
+        if stamp is None:
+            return False
+        (mtime, size, _) = _stamp(fn, digest=False)
+        if (mtime, size) == tuple(stamp[:2]):
+            return True
+        current = _stamp(fn)
+        if current[2] is not None and current[2] == stamp[2]:
+            self.__files[fn] = current
+            self.__stale_stamps = True
+            return True
+        return False
+
+    def __scan(self, dn):  # type: (str) -> DirectoryStamp
+        """
+        Lists the (non-hidden) subdirectories and scenario files within a
+        given directory.
+        """
+        mtime = os.stat(dn).st_mtime
+        subdirs = []  # type: List[str]
+        files = []  # type: List[str]
+        for name in os.listdir(dn):
+            if os.path.isdir(os.path.join(dn, name)):
+                if not name.startswith('.'):
+                    subdirs.append(name)
+            elif fnmatch.fnmatch(name, self.__pattern):
+                files.append(name)
+        return (mtime, sorted(subdirs), sorted(files))
+
+    def __is_fresh(self):  # type: () -> bool
+        """
+        Determines whether the index is up to date. Since adding or removing
+        a file changes the modification time of its directory, only those
+        directories whose modification time has changed (e.g., because the
+        index was written to them) are listed.
+        """
+        for (dn, stamp) in list(self.__directories.items()):
+            try:
+                if os.stat(dn).st_mtime == stamp[0]:
+                    continue
+                current = self.__scan(dn)
+            except OSError:
+                return False
+            if current[1:] != tuple(stamp[1:]):
+                return False
+            self.__directories[dn] = current
+        return all(self.__is_unchanged(fn) for fn in list(self.__files))
+
+    def refresh(self):  # type: () -> None
+        """
+        Scans the directory tree for scenarios and updates the index. Only
+        those scenarios whose files have changed since they were last indexed
+        are read.
+        """
+        logger.debug("scanning for scenarios: %s", self.__directory)
+        previous = {e.filename: e for e in self.__entries}
+        directories = {}  # type: Dict[str, DirectoryStamp]
+        filenames = []  # type: List[str]
+        queue = [self.__directory]
+        while queue:
+            dn = queue.pop()
+            stamp = self.__scan(dn)
+            directories[dn] = stamp
+            queue += [os.path.join(dn, d) for d in stamp[1]]
+            filenames += [os.path.join(dn, fn) for fn in stamp[2]]
+
+        entries = []  # type: List[ScenarioEntry]
+        files = {}  # type: Dict[str, FileStamp]
+        errors = {}  # type: Dict[str, str]
+        for fn in sorted(filenames):
+            entry = previous.get(fn)
+            if entry and all(self.__is_unchanged(f) for f in entry.files):
+                entries.append(entry)
+                for f in entry.files:
+                    files[f] = self.__files[f]
+            elif fn in self.__errors and self.__is_unchanged(fn):
+                errors[fn] = self.__errors[fn]
+                files[fn] = self.__files[fn]
+            else:
+                logger.debug("reading scenario: %s", fn)
+                try:
+                    desc = Scenario.describe(fn, read_config(fn))
+                except (STARTException, AssertionError,
+                        configparser.Error, ValueError) as err:
+                    logger.debug("skipping invalid scenario: %s (%s)", fn, err)
+                    errors[fn] = str(err) or err.__class__.__name__
+                    files[fn] = _stamp(fn)
+                    continue
+                entry = ScenarioEntry.from_description(desc)
+                entries.append(entry)
+                for f in entry.files:
+                    files[f] = _stamp(f)
+
+        self.__directories = directories
+        self.__files = files
+        self.__errors = errors
+        self.__index(entries)
+        logger.debug("found %d scenarios", len(entries))
+        self.__save()
+
+    def __save(self):  # type: () -> None
+        try:
+            self.__write_index()
+        except (IOError, OSError):
+            logger.exception("failed to write catalog index")
+        self.__stale_stamps = False
@@ -0,0 +1,363 @@
+"""
+This module provides a lightweight MAVLink client that may be used in place
+of a Dronekit `Vehicle` by the test harness. Unlike Dronekit, the client
+doesn't download the parameters of the vehicle (or track most of its
+attributes) before it is ready; it waits only for a heartbeat and a position.
+
+The client implements the subset of the Dronekit `Vehicle` interface that is
+used by `Mission.issue` and `Mission.execute`: message and attribute
+listeners, `send_mavlink` and `message_factory`, `armed`, `mode`,
+`is_armable`, `location.global_frame`, `groundspeed`, `heading` and
+`last_heartbeat`. It doesn't provide access to parameters, and so can't be
+used by warm SITL pools.
+"""
+__all__ = ['VehicleMode', 'Locations', 'MAVLinkClient']
+
+from typing import Any, Callable, Dict, List, Optional
+from timeit import default_timer as timer
+import threading
+import math
+import logging
+
+import attr
+from pymavlink import mavutil
+
+from .helper import Location
+from .exceptions import TimeoutException
+from .protocol import MAV_CMD_COMPONENT_ARM_DISARM, \
+    MAV_MODE_FLAG_SAFETY_ARMED, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+mavlink = mavutil.mavlink
+
+MAV_TYPE_GCS = 6
+MAV_AUTOPILOT_INVALID = 8
+
+# EKF_STATUS_REPORT flags
+EKF_POS_HORIZ_ABS = 16
+EKF_CONST_POS_MODE = 128
+EKF_PRED_POS_HORIZ_ABS = 512
+
+# a listener is called with the client, the name of the message (or
+# attribute), and the message (or the value of the attribute)
+Listener = Callable[[Any, str, Any], None]
+
+
+@attr.s(frozen=True)
+class VehicleMode(object):
+    """
+    Describes a flight mode by its name, in the same way as Dronekit.
+    """
+    name = attr.ib(type=str)
+
+
+@attr.s(frozen=True)
+class Locations(object):
+    """
+    Describes the location of a vehicle. Only the global frame is tracked.
+    """
+    global_frame = attr.ib(type=Optional[Location])
+
+
+class MAVLinkClient(object):
+    """
+    A minimal MAVLink connection to a vehicle. Messages are received, and
+    listeners are called, on a background thread.
+    """
+    def __init__(self,
+                 url,                   # type: str
+                 heartbeat_timeout=30,  # type: float
+                 rate=4                 # type: int
+                 ):                     # type: (...) -> None
+        """
+        Connects to the vehicle at a given MAVLink URL, and blocks until a
+        heartbeat is received from the vehicle.
+
+        Parameters:
+            url: the MAVLink URL of the vehicle (e.g., `udp:127.0.0.1:14550`).
+            heartbeat_timeout: the number of seconds to wait for a heartbeat.
+            rate: the rate (in Hz) at which the vehicle should stream its
+                telemetry.
+
+        Raises:
+            TimeoutException: if no heartbeat was received from the vehicle.
+        """
+        self.__master = mavutil.mavlink_connection(url, source_system=255)
+        self.__lock_send = threading.Lock()
+        self.__lock_listeners = threading.Lock()
+        self.__message_listeners = {}  # type: Dict[str, List[Listener]]
+        self.__attribute_listeners = {}  # type: Dict[str, List[Listener]]
+        self.__closed = threading.Event()
+        self.__changed = threading.Condition()
+
+        self.__time_last_heartbeat = None  # type: Optional[float]
+        self.__target_system = 1
+        self.__target_component = 1
+        self.__mav_type = None  # type: Optional[int]
+        self.__armed = False
+        self.__mode = None  # type: Optional[VehicleMode]
+        self.__fix_type = None  # type: Optional[int]
+        self.__ekf_poshorizabs = False
+        self.__ekf_constposmode = False
+        self.__ekf_predposhorizabs = False
+        self.__location = None  # type: Optional[Location]
+        self.__groundspeed = None  # type: Optional[float]
+        self.__heading = None  # type: Optional[int]
+
+        self.__thread_receive = threading.Thread(target=self.__receive)
+        self.__thread_receive.daemon = True
+        self.__thread_receive.start()
+        self.__thread_heartbeat = threading.Thread(target=self.__heartbeat)
+        self.__thread_heartbeat.daemon = True
+        self.__thread_heartbeat.start()
+
+        try:
+            logger.debug("waiting for heartbeat from vehicle [%s]", url)
+            self.__wait(lambda: self.__time_last_heartbeat is not None,
+                        heartbeat_timeout)
+        except TimeoutException:
+            self.close()
+            raise
+        logger.debug("received heartbeat from vehicle [%s]", url)
+        self.__master.mav.request_data_stream_send(
+            self.__target_system, self.__target_component,
+            mavlink.MAV_DATA_STREAM_ALL, rate, 1)
+
+    def __wait(self,
+               condition,   # type: Callable[[], bool]
+               timeout      # type: float
+               ):           # type: (...) -> None
+        time_end = timer() + timeout
+        with self.__changed:
+            while not condition():
+                remaining = time_end - timer()
+                if remaining <= 0:
+                    raise TimeoutException
+                self.__changed.wait(remaining)
+
+    def wait_ready(self, timeout=30):  # type: (float) -> None
+        """
+        Blocks until the mode and position of the vehicle are known.
+
+        Raises:
+            TimeoutException: if the vehicle didn't become ready in time.
+        """
+        self.__wait(lambda: self.__mode is not None and
+                    self.__location is not None,
+                    timeout)
+
+    def close(self):  # type: () -> None
+        """
+        Closes the connection to the vehicle.
+        """
+        if self.__closed.is_set():
+            return
+        self.__closed.set()
+        current = threading.current_thread()
+        for thread in [self.__thread_receive, self.__thread_heartbeat]:
+            if thread is not current:
+                thread.join()
+        self.__master.close()
+
+    @property
+    def message_factory(self):  # type: () -> mavlink.MAVLink
+        return self.__master.mav
+
+    def send_mavlink(self, message):  # type: (Any) -> None
+        """
+        Sends a given message to the vehicle.
+        """
+        with self.__lock_send:
+            self.__master.mav.send(message)
+
+    @property
+    def last_heartbeat(self):  # type: () -> float
+        """
+        The number of seconds since the last heartbeat was received.
+        """
+        if self.__time_last_heartbeat is None:
+            return float('inf')
+        return timer() - self.__time_last_heartbeat
+
+    @property
+    def armed(self):  # type: () -> bool
+        return self.__armed
+
+    @armed.setter
+    def armed(self, value):  # type: (bool) -> None
+        message = self.message_factory.command_long_encode(
+            self.__target_system, self.__target_component,
+            MAV_CMD_COMPONENT_ARM_DISARM, 0,
+            1 if value else 0, 0, 0, 0, 0, 0, 0)
+        self.send_mavlink(message)
+
+    @property
+    def mode(self):  # type: () -> Optional[VehicleMode]
+        return self.__mode
+
+    @mode.setter
+    def mode(self, mode):  # type: (Any) -> None
+        name = getattr(mode, 'name', mode)
+        number = mavutil.mode_mapping_byname(self.__mav_type)[name]
+        message = self.message_factory.set_mode_encode(
+            self.__target_system, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, number)
+        self.send_mavlink(message)
+
+    @property
+    def ekf_ok(self):  # type: () -> bool
+        if self.__armed:
+            return self.__ekf_poshorizabs and not self.__ekf_constposmode
+        return self.__ekf_poshorizabs or self.__ekf_predposhorizabs
+
+    @property
+    def is_armable(self):  # type: () -> bool
+        return self.__mode is not None and \
+            self.__mode.name != 'INITIALISING' and \
+            self.__fix_type is not None and self.__fix_type > 1 and \
+            self.__ekf_predposhorizabs
+
+    @property
+    def location(self):  # type: () -> Locations
+        return Locations(self.__location)
+
+    @property
+    def groundspeed(self):  # type: () -> Optional[float]
+        return self.__groundspeed
+
+    @property
+    def heading(self):  # type: () -> Optional[int]
+        return self.__heading
+
+    def add_message_listener(self, name, listener):  # type: (str, Listener) -> None
+        """
+        Attaches a listener to all messages of a given type, or to all
+        messages if the type is `*`.
+        """
+        with self.__lock_listeners:
+            listeners = list(self.__message_listeners.get(name, []))
+            listeners.append(listener)
+            self.__message_listeners[name] = listeners
+
+    def remove_message_listener(self, name, listener):  # type: (str, Listener) -> None
+        with self.__lock_listeners:
+            listeners = list(self.__message_listeners.get(name, []))
+            if listener in listeners:
+                listeners.remove(listener)
+            self.__message_listeners[name] = listeners
+
+    def add_attribute_listener(self, name, listener):  # type: (str, Listener) -> None
+        """
+        Attaches a listener to changes to a given attribute. Only `armed`,
+        `mode`, `gps_0`, `ekf_ok` and `location` are supported.
+        """
+        with self.__lock_listeners:
+            listeners = list(self.__attribute_listeners.get(name, []))
+            listeners.append(listener)
+            self.__attribute_listeners[name] = listeners
+
+    def remove_attribute_listener(self, name, listener):  # type: (str, Listener) -> None
+        with self.__lock_listeners:
+            listeners = list(self.__attribute_listeners.get(name, []))
+            if listener in listeners:
+                listeners.remove(listener)
+            self.__attribute_listeners[name] = listeners
+
+    def __notify(self, name, value):  # type: (str, Any) -> None
+        for listener in self.__attribute_listeners.get(name, []):
+            try:
+                listener(self, name, value)
+            except Exception:
+                logger.exception("attribute listener failed: %s", name)
+
+    def __heartbeat(self):  # type: () -> None
+        """
+        Sends a heartbeat to the vehicle once per second, as Dronekit does.
+        """
+        while not self.__closed.wait(1.0):
+            message = self.message_factory.heartbeat_encode(
+                MAV_TYPE_GCS, MAV_AUTOPILOT_INVALID, 0, 0, 0)
+            with self.__lock_send:
+                try:
+                    self.__master.mav.send(message)
+                except Exception:
+                    logger.exception("failed to send heartbeat")
+
+    def __receive(self):  # type: () -> None
+        while not self.__closed.is_set():
+            try:
+                message = self.__master.recv_match(blocking=True, timeout=0.1)
+            except Exception:
+                if self.__closed.is_set():
+                    return
+                logger.exception("failed to receive message")
+                continue
+            if message is None:
+                continue
+            name = message.get_type()
+            if name == 'BAD_DATA':
+                continue
+            self.__update(name, message)
+            listeners = self.__message_listeners.get(name, []) + \
+                self.__message_listeners.get('*', [])
+            for listener in listeners:
+                try:
+                    listener(self, name, message)
+                except Exception:
+                    logger.exception("message listener failed: %s", name)
+
+    def __update(self, name, message):  # type: (str, Any) -> None
+        """
+        Updates the tracked state of the vehicle using a given message.
+        """
+        changed = []  # type: List[str]
+        if name == 'HEARTBEAT':
+            if message.type == MAV_TYPE_GCS or \
+               message.autopilot == MAV_AUTOPILOT_INVALID:
+                return
+            self.__time_last_heartbeat = timer()
+            self.__target_system = message.get_srcSystem()
+            self.__target_component = message.get_srcComponent()
+            self.__mav_type = message.type
+            armed = bool(message.base_mode & MAV_MODE_FLAG_SAFETY_ARMED)
+            if armed != self.__armed:
+                self.__armed = armed
+                changed.append('armed')
+            mode = VehicleMode(mavutil.mode_string_v10(message))
+            if mode != self.__mode:
+                self.__mode = mode
+                changed.append('mode')
+        elif name == 'GLOBAL_POSITION_INT':
+            self.__location = Location(message.lat / 1.0e7,
+                                       message.lon / 1.0e7,
+                                       message.alt / 1.0e3)
+            self.__groundspeed = math.hypot(message.vx, message.vy) / 100.0
+            if message.hdg != 65535:
+                self.__heading = message.hdg // 100
+            changed.append('location')
+        elif name == 'VFR_HUD':
+            self.__groundspeed = message.groundspeed
+            self.__heading = message.heading
+        elif name == 'GPS_RAW_INT':
+            if message.fix_type != self.__fix_type:
+                self.__fix_type = message.fix_type
+                changed.append('gps_0')
+        elif name == 'EKF_STATUS_REPORT':
+            self.__ekf_poshorizabs = bool(message.flags & EKF_POS_HORIZ_ABS)
+            self.__ekf_constposmode = bool(message.flags & EKF_CONST_POS_MODE)
+            self.__ekf_predposhorizabs = \
+                bool(message.flags & EKF_PRED_POS_HORIZ_ABS)
+            changed.append('ekf_ok')
+        else:
+            return
+
+        with self.__changed:
+            self.__changed.notify_all()
+        values = {'armed': self.__armed,
+                  'mode': self.__mode,
+                  'gps_0': self.__fix_type,
+                  'ekf_ok': self.ekf_ok,
+                  'location': self.location}
+        for attribute in changed:
+            self.__notify(attribute, values[attribute])
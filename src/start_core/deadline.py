@@ -0,0 +1,224 @@
+"""
+This module provides deadlines, which are used to impose time limits on the
+execution of missions. Unlike SIGALRM, deadlines may be used from any thread
+(or, via `remaining`, from within an event loop), any number of deadlines may
+be active at once, and a deadline is cancelled as soon as it is no longer
+needed. Deadlines may be measured either in wall-clock time or in the
+simulation time of a vehicle.
+"""
+__all__ = ['Deadline', 'SimulationDeadline']
+
+from typing import Optional
+from timeit import default_timer as timer
+import threading
+import logging
+
+from .exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+class Deadline(object):
+    """
+    A wall-clock deadline that may be checked and waited upon from any thread.
+    When used as a context manager, the deadline is cancelled upon leaving the
+    context.
+    """
+    def __init__(self, seconds):  # type: (float) -> None
+        self.__seconds = seconds
+        self.__expires_at = timer() + seconds
+        self.__cancelled = False
+
+    def __enter__(self):  # type: () -> Deadline
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.cancel()
+
+    @property
+    def seconds(self):  # type: () -> float
+        """
+        The length of this deadline, measured in seconds.
+        """
+        return self.__seconds
+
+    @property
+    def remaining(self):  # type: () -> float
+        """
+        The number of seconds until this deadline expires.
+        """
+        return max(0.0, self.__expires_at - timer())
+
+    @property
+    def cancelled(self):  # type: () -> bool
+        return self.__cancelled
+
+    @property
+    def expired(self):  # type: () -> bool
+        return not self.__cancelled and self.remaining == 0.0
+
+    def cancel(self):  # type: () -> None
+        """
+        Cancels this deadline, after which it will never expire.
+        """
+        if not self.__cancelled:
+            logger.debug("cancelled deadline")
+        self.__cancelled = True
+
+    def check(self):  # type: () -> None
+        """
+        Raises:
+            TimeoutException: if this deadline has expired.
+        """
+        if self.expired:
+            logger.debug("deadline expired (%.2f seconds)", self.__seconds)
+            raise TimeoutException
+
+    def wait(self,
+             event,         # type: threading.Event
+             timeout=None   # type: Optional[float]
+             ):             # type: (...) -> bool
+        """
+        Blocks until either a given event is set, an optional timeout elapses,
+        or this deadline expires.
+
+        Returns:
+            True if the event was set, or False if the timeout elapsed.
+
+        Raises:
+            TimeoutException: if this deadline expired before the event was
+                set.
+        """
+        self.check()
+        limit = timeout
+        if not self.__cancelled:
+            limit = self.remaining if timeout is None \
+                else min(timeout, self.remaining)
+        if event.wait(limit):
+            return True
+        self.check()
+        return False
+
+    def sleep(self, seconds):  # type: (float) -> None
+        """
+        Sleeps for a given number of seconds, or until this deadline expires.
+
+        Raises:
+            TimeoutException: if this deadline expired.
+        """
+        self.wait(threading.Event(), seconds)
+
+
+class SimulationDeadline(Deadline):
+    """
+    A deadline that is measured in the simulation time of a vehicle, as
+    reported by a given `SimulationClock`, rather than in wall-clock time.
+    Since the simulation may stall (e.g., if the SITL hangs or crashes), the
+    deadline also expires once simulation time has failed to advance for a
+    given number of wall-clock seconds. A simulation that is merely slow
+    (i.e., slower than real time) never causes the deadline to expire early.
+    """
+    # the maximum number of wall-clock seconds between checks of the clock
+    # while waiting
+    POLL_INTERVAL = 0.5
+    # the minimum estimate of the time remaining before expiry, which stops
+    # waiters from spinning while the clock catches up
+    MIN_REMAINING = 0.01
+
+    def __init__(self,
+                 seconds,           # type: float
+                 clock,             # type: SimulationClock
+                 stall_limit=10.0   # type: float
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            seconds: the length of the deadline, in simulated seconds.
+            clock: the clock that measures the simulation time.
+            stall_limit: the number of wall-clock seconds for which the
+                simulation time may fail to advance before the deadline
+                expires, regardless of the simulation time.
+        """
+        super(SimulationDeadline, self).__init__(stall_limit)
+        self.__seconds = seconds
+        self.__stall_limit = stall_limit
+        self.__clock = clock
+        self.__started_at = clock.time or 0.0
+
+    @property
+    def seconds(self):  # type: () -> float
+        """
+        The length of this deadline, measured in simulated seconds.
+        """
+        return self.__seconds
+
+    @property
+    def elapsed(self):  # type: () -> float
+        """
+        The number of simulated seconds that have passed since this deadline
+        was created.
+        """
+        now = self.__clock.time
+        if now is None:
+            return 0.0
+        return max(0.0, now - self.__started_at)
+
+    @property
+    def stalled(self):  # type: () -> bool
+        """
+        Whether the simulation time has failed to advance for longer than
+        the stall limit of this deadline.
+        """
+        return self.__clock.stalled_for >= self.__stall_limit
+
+    @property
+    def remaining(self):  # type: () -> float
+        """
+        An estimate of the number of wall-clock seconds until this deadline
+        expires, according to the current rate of the simulation.
+        """
+        wall_remaining = max(0.0,
+                             self.__stall_limit - self.__clock.stalled_for)
+        sim_remaining = max(0.0, self.__seconds - self.elapsed)
+        rate = self.__clock.rate
+        if rate > 0.0:
+            wall_remaining = min(wall_remaining, sim_remaining / rate)
+        return max(self.MIN_REMAINING, wall_remaining)
+
+    @property
+    def expired(self):  # type: () -> bool
+        if self.cancelled:
+            return False
+        return self.elapsed >= self.__seconds or self.stalled
+
+    def check(self):  # type: () -> None
+        """
+        Raises:
+            TimeoutException: if this deadline has expired.
+        """
+        if self.expired:
+            if self.stalled:
+                logger.debug("simulation deadline expired: simulation stalled for %.2f seconds",
+                             self.__clock.stalled_for)
+            else:
+                logger.debug("simulation deadline expired (%.2f of %.2f simulated seconds)",
+                             self.elapsed, self.__seconds)
+            raise TimeoutException
+
+    def wait(self,
+             event,         # type: threading.Event
+             timeout=None   # type: Optional[float]
+             ):             # type: (...) -> bool
+        self.check()
+        if self.cancelled:
+            return event.wait(timeout)
+        time_end = None if timeout is None else timer() + timeout
+        while True:
+            limit = min(self.POLL_INTERVAL, self.remaining)
+            if time_end is not None:
+                limit = min(limit, time_end - timer())
+            if event.wait(max(limit, 0.0)):
+                return True
+            self.check()
+            if time_end is not None and timer() >= time_end:
+                return False
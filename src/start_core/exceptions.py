@@ -39,3 +39,31 @@ class UnexpectedTestOutcome(STARTException):
     A scenario produced an unexpected test result (i.e., the test failed when
     it should have passed, or passed when it should have failed).
     """
+
+class NoFreeInstanceException(STARTException):
+    """
+    All of the SITL instance numbers (and their associated ports) that may be
+    allocated on this machine are currently in use.
+    """
+
+class MissionUploadException(STARTException):
+    """
+    The vehicle rejected the mission that it was sent.
+    """
+
+class AttackServerException(STARTException):
+    """
+    The attack server failed to start, or failed to respond to the harness.
+    """
+
+class PatchBuildException(STARTException):
+    """
+    A patch could not be applied to a scenario, or the SITL failed to build
+    once it had been applied.
+    """
+
+class SnapshotException(STARTException):
+    """
+    A snapshot of a SITL could not be captured or restored (e.g., because
+    CRIU is not available on this machine).
+    """
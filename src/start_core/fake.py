@@ -0,0 +1,496 @@
+"""
+This module provides a fake vehicle that speaks enough of the MAVLink
+protocol to stand in for an ArduPilot SITL when measuring the overheads of
+the test harness. The vehicle sends its telemetry over UDP to a number of
+outputs, in the same way as MAVProxy's `--out` option, and responds to
+arming, mode changes, parameter requests, and the mission protocol.
+
+Once a mission has been started, the vehicle flies in a straight line
+between the locations of its mission items at a given speed, announcing
+each item that it reaches via STATUSTEXT, followed by "Mission Complete".
+
+The fake vehicle may be run in-process, or as a separate process:
+
+    python -m start_core.fake --vehicle ArduCopter --instance 0
+"""
+__all__ = ['FakeVehicle']
+
+from typing import Any, Dict, List, Optional, Tuple
+from timeit import default_timer as timer
+import argparse
+import math
+import select
+import socket
+import threading
+import time
+import logging
+
+from pymavlink import mavutil
+
+from .ports import Ports
+from .protocol import MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_RETURN_TO_LAUNCH, \
+    MAV_CMD_NAV_LAND, MAV_CMD_DO_SET_HOME, MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN, \
+    MAV_CMD_MISSION_START, MAV_CMD_COMPONENT_ARM_DISARM, \
+    MAV_MODE_FLAG_SAFETY_ARMED, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, \
+    MAV_MISSION_ACCEPTED, MAV_MISSION_INVALID_SEQUENCE, GLOBAL_FRAMES, \
+    MissionItem, from_int_item, int_item
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+mavlink = mavutil.mavlink
+
+MAV_CMD_NAV_TAKEOFF = 22
+MAV_CMD_DO_SET_MODE = 176
+MAV_RESULT_ACCEPTED = 0
+MAV_RESULT_UNSUPPORTED = 3
+MAV_AUTOPILOT_ARDUPILOTMEGA = 3
+MAV_STATE_STANDBY = 3
+MAV_STATE_ACTIVE = 4
+MAV_PARAM_TYPE_REAL32 = 9
+MAV_SEVERITY_INFO = 6
+
+# the EKF_STATUS_REPORT flags for a healthy EKF with an absolute position
+EKF_FLAGS_HEALTHY = 1 | 2 | 4 | 8 | 16 | 32 | 512
+
+# the MAV_TYPE that is reported by each vehicle
+MAV_TYPE = {
+    'APMrover2': 10,
+    'ArduCopter': 2,
+    'ArduPlane': 1
+}
+
+# the (mostly arbitrary) parameters that are held by the vehicle
+PARAMETERS = {
+    'SYSID_THISMAV': 1.0,
+    'SYSID_MYGCS': 255.0,
+    'ARMING_CHECK': 1.0,
+    'SIM_SPEEDUP': 1.0,
+    'WPNAV_SPEED': 500.0
+}  # type: Dict[str, float]
+
+EARTH_RADIUS = 6378137.0
+
+
+class FakeVehicle(object):
+    """
+    A fake vehicle that is driven by a background thread. May be used as a
+    context manager, in which case the vehicle is started upon entering the
+    context and stopped upon leaving it.
+    """
+    def __init__(self,
+                 outputs,               # type: List[Tuple[str, int]]
+                 vehicle='ArduCopter',  # type: str
+                 home=(-35.362938, 149.165085, 584.0, 270.0),  # type: Tuple[float, float, float, float]
+                 rate_position=10.0,    # type: float
+                 rate_heartbeat=1.0,    # type: float
+                 speed=50.0             # type: float
+                 ):                     # type: (...) -> None
+        """
+        Parameters:
+            outputs: the addresses to which telemetry should be sent.
+            vehicle: the vehicle that should be imitated.
+            home: the initial home location of the vehicle.
+            rate_position: the number of times per second at which the
+                position and attitude of the vehicle should be sent.
+            rate_heartbeat: the number of times per second at which
+                HEARTBEAT (and GPS and EKF status) messages should be sent.
+            speed: the ground speed of the vehicle in metres per second.
+        """
+        self.__outputs = list(outputs)
+        self.__vehicle = vehicle
+        self.__mav_type = MAV_TYPE[vehicle]
+        self.__interval_position = 1.0 / rate_position
+        self.__interval_heartbeat = 1.0 / rate_heartbeat
+        self.__speed = speed
+        self.__mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+        self.__mav.robust_parsing = True
+
+        (lat, lon, alt, _) = home
+        self.__home = (lat, lon, alt)
+        self.__position = (lat, lon, alt)
+        self.__parameters = dict(PARAMETERS)
+        self.__armed = False
+        self.__custom_mode = 0
+        self.__booted_at = timer()
+
+        self.__mission = []  # type: List[MissionItem]
+        self.__upload = None  # type: Optional[List[MissionItem]]
+        self.__upload_count = 0
+        self.__current = None  # type: Optional[int]
+        self.__target = None  # type: Optional[Tuple[float, float, float]]
+
+        self.__socket = None  # type: Optional[socket.socket]
+        self.__thread = None  # type: Optional[threading.Thread]
+        self.__stopped = threading.Event()
+
+        self.num_uploads = 0
+        self.mission_started_at = None  # type: Optional[float]
+        self.mission_completed_at = None  # type: Optional[float]
+
+    def __enter__(self):  # type: () -> FakeVehicle
+        self.start()
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.stop()
+
+    @property
+    def armed(self):  # type: () -> bool
+        return self.__armed
+
+    @property
+    def mission(self):  # type: () -> List[MissionItem]
+        """
+        The items of the mission that is held by the vehicle.
+        """
+        return list(self.__mission)
+
+    def start(self):  # type: () -> None
+        """
+        Begins sending telemetry and responding to messages.
+        """
+        logger.debug("starting fake vehicle")
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.bind(('127.0.0.1', 0))
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+        logger.debug("started fake vehicle")
+
+    def stop(self):  # type: () -> None
+        """
+        Stops the vehicle.
+        """
+        logger.debug("stopping fake vehicle")
+        self.__stopped.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        if self.__socket:
+            self.__socket.close()
+            self.__socket = None
+        logger.debug("stopped fake vehicle")
+
+    @property
+    def __time_boot_ms(self):  # type: () -> int
+        return int((timer() - self.__booted_at) * 1000)
+
+    def __send(self, message):  # type: (Any) -> None
+        # unlike MAVLink.send, pack doesn't advance the sequence number
+        buff = message.pack(self.__mav)
+        self.__mav.seq = (self.__mav.seq + 1) % 256
+        for address in self.__outputs:
+            try:
+                self.__socket.sendto(buff, address)
+            except socket.error:
+                pass
+
+    def __run(self):  # type: () -> None
+        time_heartbeat = 0.0
+        time_position = 0.0
+        time_moved = timer()
+        while not self.__stopped.is_set():
+            now = timer()
+            if now >= time_heartbeat:
+                self.__send_heartbeat()
+                time_heartbeat = now + self.__interval_heartbeat
+            if now >= time_position:
+                self.__send_position()
+                time_position = now + self.__interval_position
+
+            self.__move(now - time_moved)
+            time_moved = now
+
+            timeout = min(time_heartbeat, time_position) - timer()
+            if self.__target is not None:
+                timeout = min(timeout, 0.01)
+            (ready, _, _) = select.select([self.__socket], [], [],
+                                          max(timeout, 0.0))
+            if not ready:
+                continue
+            try:
+                data = self.__socket.recv(65535)
+            except socket.error:
+                continue
+            for message in self.__mav.parse_buffer(data) or []:
+                self.__handle(message)
+
+    def __send_heartbeat(self):  # type: () -> None
+        base_mode = MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+        if self.__armed:
+            base_mode |= MAV_MODE_FLAG_SAFETY_ARMED
+        status = MAV_STATE_ACTIVE if self.__armed else MAV_STATE_STANDBY
+        self.__send(self.__mav.heartbeat_encode(
+            self.__mav_type, MAV_AUTOPILOT_ARDUPILOTMEGA, base_mode,
+            self.__custom_mode, status, 3))
+
+        (lat, lon, alt) = self.__position
+        self.__send(self.__mav.gps_raw_int_encode(
+            self.__time_boot_ms * 1000, 3,
+            int(lat * 1e7), int(lon * 1e7), int(alt * 1000),
+            100, 100, 0, 0, 10))
+        self.__send(self.__mav.ekf_status_report_encode(
+            EKF_FLAGS_HEALTHY, 0.0, 0.0, 0.0, 0.0, 0.0))
+        self.__send(self.__mav.system_time_encode(
+            int(time.time() * 1e6), self.__time_boot_ms))
+
+    def __send_position(self):  # type: () -> None
+        (lat, lon, alt) = self.__position
+        t = self.__time_boot_ms
+        self.__send(self.__mav.global_position_int_encode(
+            t, int(lat * 1e7), int(lon * 1e7), int(alt * 1000),
+            int((alt - self.__home[2]) * 1000), 0, 0, 0, 0))
+        self.__send(self.__mav.attitude_encode(t, 0.0, 0.0, 0.0,
+                                               0.0, 0.0, 0.0))
+
+    def __send_text(self, text):  # type: (str) -> None
+        logger.debug("fake vehicle says: %s", text)
+        self.__send(self.__mav.statustext_encode(MAV_SEVERITY_INFO,
+                                                 text.encode('ascii')))
+
+    def __send_parameter(self, name):  # type: (str) -> None
+        names = sorted(self.__parameters)
+        self.__send(self.__mav.param_value_encode(
+            name.encode('ascii'), self.__parameters[name],
+            MAV_PARAM_TYPE_REAL32, len(names), names.index(name)))
+
+    def __ack(self, command, result):  # type: (int, int) -> None
+        self.__send(self.__mav.command_ack_encode(command, result))
+
+    def __handle(self, message):  # type: (Any) -> None
+        name = message.get_type()
+        handler = getattr(self, '_FakeVehicle__on_' + name.lower(), None)
+        if handler:
+            handler(message)
+
+    def __on_param_request_list(self, message):  # type: (Any) -> None
+        for name in sorted(self.__parameters):
+            self.__send_parameter(name)
+
+    def __on_param_request_read(self, message):  # type: (Any) -> None
+        names = sorted(self.__parameters)
+        name = _decode(message.param_id)
+        if message.param_index >= 0 and message.param_index < len(names):
+            name = names[message.param_index]
+        if name in self.__parameters:
+            self.__send_parameter(name)
+
+    def __on_param_set(self, message):  # type: (Any) -> None
+        name = _decode(message.param_id)
+        if name in self.__parameters:
+            self.__parameters[name] = message.param_value
+            self.__send_parameter(name)
+
+    def __on_set_mode(self, message):  # type: (Any) -> None
+        self.__custom_mode = message.custom_mode
+        self.__send_heartbeat()
+
+    def __on_command_long(self, message):  # type: (Any) -> None
+        command = message.command
+        result = MAV_RESULT_ACCEPTED
+        if command == MAV_CMD_COMPONENT_ARM_DISARM:
+            self.__armed = message.param1 == 1
+            if not self.__armed:
+                self.__target = None
+        elif command == MAV_CMD_DO_SET_MODE:
+            self.__custom_mode = int(message.param2)
+        elif command == MAV_CMD_MISSION_START:
+            first = max(1, int(message.param1))
+            if self.__armed and first < len(self.__mission):
+                self.mission_started_at = timer()
+                self.mission_completed_at = None
+                self.__begin(first)
+            else:
+                result = MAV_RESULT_UNSUPPORTED
+        elif command == MAV_CMD_DO_SET_HOME:
+            self.__home = (message.param5, message.param6, message.param7)
+        elif command == MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN:
+            self.__ack(command, result)
+            self.__reboot()
+            return
+        self.__ack(command, result)
+        if command in (MAV_CMD_COMPONENT_ARM_DISARM, MAV_CMD_DO_SET_MODE):
+            self.__send_heartbeat()
+
+    def __reboot(self):  # type: () -> None
+        logger.debug("rebooting fake vehicle")
+        self.__booted_at = timer()
+        self.__armed = False
+        self.__custom_mode = 0
+        self.__current = None
+        self.__target = None
+        self.__position = self.__home
+
+    # mission protocol
+    def __on_mission_count(self, message):  # type: (Any) -> None
+        self.__upload = []
+        self.__upload_count = message.count
+        if message.count == 0:
+            self.__finish_upload()
+        else:
+            self.__send(self.__mav.mission_request_encode(255, 0, 0))
+
+    def __on_mission_item(self, message):  # type: (Any) -> None
+        item = (message.seq, message.frame, message.command,
+                message.current, message.autocontinue,
+                message.param1, message.param2, message.param3,
+                message.param4, message.x, message.y, message.z)
+        self.__receive_item(item)
+
+    def __on_mission_item_int(self, message):  # type: (Any) -> None
+        item = (message.seq, message.frame, message.command,
+                message.current, message.autocontinue,
+                message.param1, message.param2, message.param3,
+                message.param4, message.x, message.y, message.z)
+        self.__receive_item(from_int_item(item))
+
+    def __receive_item(self, item):  # type: (MissionItem) -> None
+        if self.__upload is None:
+            return
+        if item[0] != len(self.__upload):
+            self.__send(self.__mav.mission_ack_encode(
+                255, 0, MAV_MISSION_INVALID_SEQUENCE))
+            return
+        self.__upload.append(item)
+        if len(self.__upload) == self.__upload_count:
+            self.__finish_upload()
+        else:
+            self.__send(self.__mav.mission_request_encode(
+                255, 0, len(self.__upload)))
+
+    def __finish_upload(self):  # type: () -> None
+        self.__mission = self.__upload
+        self.__upload = None
+        self.num_uploads += 1
+        self.__send(self.__mav.mission_ack_encode(255, 0,
+                                                  MAV_MISSION_ACCEPTED))
+
+    def __on_mission_request_list(self, message):  # type: (Any) -> None
+        self.__send(self.__mav.mission_count_encode(255, 0,
+                                                    len(self.__mission)))
+
+    def __on_mission_request(self, message):  # type: (Any) -> None
+        if message.seq < len(self.__mission):
+            item = self.__mission[message.seq]
+            self.__send(self.__mav.mission_item_encode(255, 0, *item))
+
+    def __on_mission_request_int(self, message):  # type: (Any) -> None
+        if message.seq < len(self.__mission):
+            item = int_item(self.__mission[message.seq])
+            self.__send(self.__mav.mission_item_int_encode(255, 0, *item))
+
+    def __on_mission_clear_all(self, message):  # type: (Any) -> None
+        self.__mission = []
+        self.__send(self.__mav.mission_ack_encode(255, 0,
+                                                  MAV_MISSION_ACCEPTED))
+
+    # mission execution
+    def __begin(self, seq):  # type: (int) -> None
+        """
+        Begins executing the mission item with a given index.
+        """
+        while seq < len(self.__mission):
+            self.__current = seq
+            self.__send(self.__mav.mission_current_encode(seq))
+            (_, frame, cmd, _, _, _, _, _, _, x, y, z) = self.__mission[seq]
+            (lat, lon, alt) = self.__position
+            if cmd == MAV_CMD_NAV_RETURN_TO_LAUNCH:
+                self.__target = self.__home
+                return
+            if cmd in (MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_TAKEOFF,
+                       MAV_CMD_NAV_LAND):
+                if frame in GLOBAL_FRAMES and (x != 0.0 or y != 0.0):
+                    (lat, lon) = (x, y)
+                if cmd != MAV_CMD_NAV_LAND:
+                    alt = self.__home[2] + z
+                self.__target = (lat, lon, alt)
+                return
+            # non-navigation commands complete immediately
+            self.__send_text("Reached command #{}".format(seq))
+            seq += 1
+        self.__complete()
+
+    def __complete(self):  # type: () -> None
+        self.__current = None
+        self.__target = None
+        self.mission_completed_at = timer()
+        # report the final position first, so that it isn't stale (by up to
+        # one position interval) when the completion is announced
+        self.__send_position()
+        self.__send_text("Mission Complete")
+
+    def __move(self, dt):  # type: (float) -> None
+        if self.__target is None or dt <= 0:
+            return
+        (lat, lon, alt) = self.__position
+        (lat_t, lon_t, alt_t) = self.__target
+        north = math.radians(lat_t - lat) * EARTH_RADIUS
+        east = math.radians(lon_t - lon) * EARTH_RADIUS * \
+            math.cos(math.radians(lat))
+        up = alt_t - alt
+        dist = math.sqrt(north * north + east * east + up * up)
+        step = self.__speed * dt
+        if step < dist:
+            f = step / dist
+            self.__position = (lat + f * (lat_t - lat),
+                               lon + f * (lon_t - lon),
+                               alt + f * up)
+            return
+
+        self.__position = self.__target
+        seq = self.__current
+        cmd = self.__mission[seq][2]
+        if cmd == MAV_CMD_NAV_WAYPOINT:
+            self.__send_text("Reached waypoint #{}".format(seq))
+        else:
+            self.__send_text("Reached command #{}".format(seq))
+        self.__begin(seq + 1)
+
+
+def _decode(value):  # type: (Any) -> str
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'ignore')
+    return value.rstrip('\0')
+
+
+def main():  # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vehicle', default='ArduCopter',
+                        choices=sorted(MAV_TYPE))
+    parser.add_argument('--instance', type=int, default=0,
+                        help='send telemetry to the ports of this instance')
+    parser.add_argument('--out', action='append', default=[],
+                        help='an additional HOST:PORT to send telemetry to')
+    parser.add_argument('--home', default=None,
+                        help='the home location, given as LAT,LON,ALT,HEADING')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='position messages per second')
+    parser.add_argument('--speed', type=float, default=50.0,
+                        help='ground speed in metres per second')
+    args = parser.parse_args()
+
+    ports = Ports(args.instance)
+    outputs = [('127.0.0.1', ports.harness), ('127.0.0.1', ports.attacker)]
+    for out in args.out:
+        (host, port) = out.rsplit(':', 1)
+        outputs.append((host, int(port)))
+    kwargs = {}  # type: Dict[str, Any]
+    if args.home:
+        kwargs['home'] = tuple(float(v) for v in args.home.split(','))
+
+    vehicle = FakeVehicle(outputs, args.vehicle,
+                          rate_position=args.rate, speed=args.speed, **kwargs)
+    vehicle.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        vehicle.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+A fake attack server that speaks the same line-based protocol as a START
+attack server (START, CHECK, EXIT, and optionally READY and a pushed
+SUCCESS) without attacking anything. Accepts the same arguments as a real
+attack script, so it may be used as the script of an `Attack`:
+
+    Attack(script=start_core.fake_attack.__file__,
+           flags='--ready,--push,--success-after=5',
+           latitude=0.0, longitude=0.0, radius=0.0)
+
+A slow or stuck attack server may be imitated with `--reply-delay`.
+
+This module deliberately depends on nothing but the standard library, since
+it is executed as a standalone script.
+"""
+from __future__ import print_function
+
+import argparse
+import select
+import socket
+import sys
+import time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--ready', action='store_true',
+                        help='send READY once a connection is accepted')
+    parser.add_argument('--success-after', type=float, default=-1.0,
+                        help='report a successful attack this many seconds '
+                             'after START (never, if negative)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='wait this many seconds before listening')
+    parser.add_argument('--push', action='store_true',
+                        help='send SUCCESS as soon as the attack succeeds')
+    parser.add_argument('--reply-delay', type=float, default=0.0,
+                        help='wait this many seconds before replying to '
+                             'CHECK (never reply, if negative)')
+    # the remaining arguments of a real attack script are accepted and ignored
+    (args, _) = parser.parse_known_args(argv)
+    return args
+
+
+def serve(args):  # type: (argparse.Namespace) -> None
+    time.sleep(args.delay)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('0.0.0.0', args.port))
+    server.listen(1)
+    (conn, _) = server.accept()
+    server.close()
+
+    def send(line):
+        conn.sendall((line + "\n").encode('ascii'))
+
+    if args.ready:
+        send("READY")
+
+    started_at = None
+    pushed = False
+    replies = []  # the times at which pending CHECKs should be answered
+    buff = b''
+    while True:
+        now = time.time()
+        succeeded = started_at is not None and args.success_after >= 0 and \
+            now - started_at >= args.success_after
+        if succeeded and args.push and not pushed:
+            send("SUCCESS")
+            pushed = True
+        while replies and replies[0] <= now:
+            replies.pop(0)
+            send("YES" if succeeded else "NO")
+
+        timeout = 0.05
+        if replies:
+            timeout = min(timeout, max(replies[0] - now, 0.0))
+        (ready, _, _) = select.select([conn], [], [], timeout)
+        if not ready:
+            continue
+        data = conn.recv(4096)
+        if not data:
+            break
+        buff += data
+        while b'\n' in buff:
+            (line, buff) = buff.split(b'\n', 1)
+            line = line.strip()
+            if line == b'START':
+                started_at = time.time()
+            elif line == b'CHECK':
+                if args.reply_delay >= 0:
+                    replies.append(time.time() + args.reply_delay)
+            elif line == b'EXIT':
+                conn.close()
+                return
+    conn.close()
+
+
+if __name__ == '__main__':
+    serve(parse_args(sys.argv[1:]))
@@ -0,0 +1,178 @@
+"""
+This module provides vectorised geodesy functions that operate upon entire
+trajectories, given as NumPy arrays of latitudes and longitudes (in degrees)
+and, optionally, altitudes (in metres). These functions are intended for
+checks over recorded telemetry traces (see `telemetry.load`), for which the
+per-location functions in `helper` would be too slow.
+
+Ground distances may be computed using either a fast equirectangular
+approximation, which is accurate over the distances covered by a mission,
+or the haversine formula. Requires NumPy.
+"""
+__all__ = ['EQUIRECTANGULAR', 'HAVERSINE', 'to_local', 'distances',
+           'path_length', 'closest_approach', 'within_radius',
+           'segment_distances', 'leg_deviations']
+
+from typing import Optional, Sequence, Tuple
+
+import numpy
+
+EARTH_RADIUS = 6378137.0
+
+EQUIRECTANGULAR = 'equirectangular'
+HAVERSINE = 'haversine'
+
+
+def to_local(lat,   # type: numpy.ndarray
+             lon,   # type: numpy.ndarray
+             lat0,  # type: float
+             lon0   # type: float
+             ):     # type: (...) -> Tuple[numpy.ndarray, numpy.ndarray]
+    """
+    Projects locations onto a plane that is tangent to the Earth at a given
+    origin, using an equirectangular projection.
+
+    Returns:
+        a tuple of the form `(east, north)`, giving the offset of each
+        location from the origin in metres.
+    """
+    lat = numpy.asarray(lat, dtype=numpy.float64)
+    lon = numpy.asarray(lon, dtype=numpy.float64)
+    north = numpy.radians(lat - lat0) * EARTH_RADIUS
+    east = numpy.radians(lon - lon0) * EARTH_RADIUS * \
+        numpy.cos(numpy.radians(lat0))
+    return (east, north)
+
+
+def distances(lat_x,                    # type: numpy.ndarray
+              lon_x,                    # type: numpy.ndarray
+              lat_y,                    # type: numpy.ndarray
+              lon_y,                    # type: numpy.ndarray
+              method=EQUIRECTANGULAR    # type: str
+              ):                        # type: (...) -> numpy.ndarray
+    """
+    Computes the ground distance, in metres, between each pair of locations.
+    Arguments are broadcast against one another, allowing the distance from
+    every point in a trajectory to a single location to be computed at once.
+    """
+    lat_x = numpy.radians(numpy.asarray(lat_x, dtype=numpy.float64))
+    lon_x = numpy.radians(numpy.asarray(lon_x, dtype=numpy.float64))
+    lat_y = numpy.radians(numpy.asarray(lat_y, dtype=numpy.float64))
+    lon_y = numpy.radians(numpy.asarray(lon_y, dtype=numpy.float64))
+    d_lat = lat_y - lat_x
+    d_lon = lon_y - lon_x
+
+    if method == EQUIRECTANGULAR:
+        x = d_lon * numpy.cos(0.5 * (lat_x + lat_y))
+        return EARTH_RADIUS * numpy.hypot(x, d_lat)
+    if method == HAVERSINE:
+        a = numpy.sin(0.5 * d_lat) ** 2 + \
+            numpy.cos(lat_x) * numpy.cos(lat_y) * numpy.sin(0.5 * d_lon) ** 2
+        return 2.0 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+    raise ValueError("unknown distance method: {}".format(method))
+
+
+def path_length(lat,                    # type: numpy.ndarray
+                lon,                    # type: numpy.ndarray
+                alt=None,               # type: Optional[numpy.ndarray]
+                method=EQUIRECTANGULAR  # type: str
+                ):                      # type: (...) -> float
+    """
+    Computes the length, in metres, of a trajectory. If altitudes are
+    provided, changes in altitude contribute to the length of the path.
+    """
+    lat = numpy.asarray(lat, dtype=numpy.float64)
+    lon = numpy.asarray(lon, dtype=numpy.float64)
+    if lat.size < 2:
+        return 0.0
+    steps = distances(lat[:-1], lon[:-1], lat[1:], lon[1:], method)
+    if alt is not None:
+        steps = numpy.hypot(steps, numpy.diff(numpy.asarray(alt, dtype=numpy.float64)))
+    return float(steps.sum())
+
+
+def closest_approach(lat,                       # type: numpy.ndarray
+                     lon,                       # type: numpy.ndarray
+                     lat_target,                # type: float
+                     lon_target,                # type: float
+                     method=EQUIRECTANGULAR     # type: str
+                     ):                         # type: (...) -> Tuple[int, float]
+    """
+    Determines the point at which a trajectory came closest to a given
+    location (e.g., the centre of the area affected by an attack).
+
+    Returns:
+        a tuple of the form `(index, distance)`, giving the index of the
+        closest point within the trajectory and its distance in metres.
+
+    Raises:
+        ValueError: if the trajectory is empty.
+    """
+    dists = distances(lat, lon, lat_target, lon_target, method)
+    if dists.size == 0:
+        raise ValueError("cannot compute closest approach of empty trajectory")
+    i = int(numpy.argmin(dists))
+    return (i, float(dists[i]))
+
+
+def within_radius(lat,                      # type: numpy.ndarray
+                  lon,                      # type: numpy.ndarray
+                  lat_centre,               # type: float
+                  lon_centre,               # type: float
+                  radius,                   # type: float
+                  method=EQUIRECTANGULAR    # type: str
+                  ):                        # type: (...) -> numpy.ndarray
+    """
+    Returns a boolean mask that indicates which points of a trajectory lie
+    within a given radius, in metres, of a given location.
+    """
+    return distances(lat, lon, lat_centre, lon_centre, method) <= radius
+
+
+def segment_distances(lat,      # type: numpy.ndarray
+                      lon,      # type: numpy.ndarray
+                      lat_a,    # type: float
+                      lon_a,    # type: float
+                      lat_b,    # type: float
+                      lon_b     # type: float
+                      ):        # type: (...) -> numpy.ndarray
+    """
+    Computes the ground distance, in metres, from each point of a trajectory
+    to the closest point on the segment (i.e., mission leg) between two given
+    locations. Distances are measured on a plane that is tangent to the Earth
+    at the start of the segment.
+    """
+    (x, y) = to_local(lat, lon, lat_a, lon_a)
+    (bx, by) = to_local(lat_b, lon_b, lat_a, lon_a)
+    length_sq = float(bx * bx + by * by)
+    if length_sq == 0.0:
+        return numpy.hypot(x, y)
+    t = numpy.clip((x * bx + y * by) / length_sq, 0.0, 1.0)
+    return numpy.hypot(x - t * bx, y - t * by)
+
+
+def leg_deviations(lat,         # type: numpy.ndarray
+                   lon,         # type: numpy.ndarray
+                   legs_lat,    # type: Sequence[float]
+                   legs_lon     # type: Sequence[float]
+                   ):           # type: (...) -> numpy.ndarray
+    """
+    Computes the distance, in metres, from each point of a trajectory to the
+    nearest leg of a mission, where the legs are given by consecutive pairs
+    of waypoints. The maximum deviation of a trajectory from its mission is
+    given by the maximum of the returned array.
+
+    Raises:
+        ValueError: if fewer than two waypoints are given.
+    """
+    if len(legs_lat) < 2 or len(legs_lat) != len(legs_lon):
+        raise ValueError("at least two waypoints are required")
+    lat = numpy.asarray(lat, dtype=numpy.float64)
+    lon = numpy.asarray(lon, dtype=numpy.float64)
+    deviations = numpy.full(lat.shape, numpy.inf)
+    for i in range(len(legs_lat) - 1):
+        d = segment_distances(lat, lon,
+                              legs_lat[i], legs_lon[i],
+                              legs_lat[i + 1], legs_lon[i + 1])
+        numpy.minimum(deviations, d, out=deviations)
+    return deviations
@@ -1,11 +1,16 @@
-__all__ = ['DEVNULL', 'observe', 'distance', 'get_location_metres']
+__all__ = ['DEVNULL', 'Location', 'observe', 'wait_until', 'distance',
+           'get_location_metres']
 
+from typing import Callable, List, Optional
+from timeit import default_timer as timer
 import math
 import os
 import subprocess
+import threading
 
-import dronekit
-from pymavlink import mavutil
+import attr
+
+from .deadline import Deadline
 
 try:
     DEVNULL = subprocess.DEVNULL
@@ -13,6 +18,18 @@ except AttributeError:
     DEVNULL = open(os.devnull, 'w')
 
 
+@attr.s(frozen=True)
+class Location(object):
+    """
+    Describes a global position, given as a latitude and longitude in degrees,
+    and an altitude in metres. May be used in place of a Dronekit
+    `LocationGlobal` by the functions in this module.
+    """
+    lat = attr.ib(type=float)
+    lon = attr.ib(type=float)
+    alt = attr.ib(type=float)
+
+
 def observe(vehicle):
     """
     Produces a snapshot of the current state of the vehicle.
@@ -30,6 +47,57 @@ def observe(vehicle):
     return snap
 
 
+def wait_until(conn,           # type: dronekit.Vehicle
+               condition,      # type: Callable[[], bool]
+               attributes,     # type: List[str]
+               deadline,       # type: Deadline
+               timeout=None,   # type: Optional[float]
+               messages=None   # type: Optional[List[str]]
+               ):              # type: (...) -> bool
+    """
+    Blocks until a given condition over the state of a vehicle holds. Rather
+    than polling, the condition is re-evaluated whenever one of the given
+    attributes of the vehicle changes, or one of the given types of message
+    is received from the vehicle.
+
+    Returns:
+        True if the condition holds, or False if the timeout elapsed first.
+
+    Raises:
+        TimeoutException: if the deadline expired first.
+    """
+    if messages is None:
+        messages = []
+    changed = threading.Event()
+
+    def on_attribute(vehicle, name, value):
+        changed.set()
+
+    def on_message(vehicle, name, message):
+        changed.set()
+
+    for name in attributes:
+        conn.add_attribute_listener(name, on_attribute)
+    for name in messages:
+        conn.add_message_listener(name, on_message)
+    try:
+        time_end = None if timeout is None else timer() + timeout
+        while not condition():
+            remaining = None
+            if time_end is not None:
+                remaining = time_end - timer()
+                if remaining <= 0:
+                    return False
+            deadline.wait(changed, remaining)
+            changed.clear()
+        return True
+    finally:
+        for name in attributes:
+            conn.remove_attribute_listener(name, on_attribute)
+        for name in messages:
+            conn.remove_message_listener(name, on_message)
+
+
 def distance(loc_x, loc_y):
     """
     Returns the ground distance in metres between two `LocationGlobal` or `LocationGlobalRelative` objects.
@@ -61,4 +129,5 @@ def get_location_metres(original_location, dNorth, dEast):
 
     newlat = original_location.lat + (dLat * 180/math.pi)
     newlon = original_location.lon + (dLon * 180/math.pi)
+    import dronekit
     return dronekit.LocationGlobal(newlat, newlon,original_location.alt)
@@ -0,0 +1,119 @@
+"""
+This module provides hooks for exporting the outcomes of tests, and the
+timings of their phases, to external monitoring systems. A hook is given
+each outcome produced by `test.execute`, together with a set of labels that
+describe the test (e.g., its mission and vehicle).
+"""
+__all__ = ['OutcomeHook', 'JSONLinesHook', 'PrometheusHook']
+
+from typing import Dict, Tuple
+import os
+import json
+import tempfile
+import threading
+import logging
+
+from .outcome import TestOutcome
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+class OutcomeHook(object):
+    """
+    The base class for hooks that are notified of each test outcome. By
+    default, outcomes are ignored.
+    """
+    def record(self,
+               outcome,     # type: TestOutcome
+               labels       # type: Dict[str, str]
+               ):           # type: (...) -> None
+        """
+        Records the outcome of a test with a given set of labels.
+        """
+        pass
+
+
+class JSONLinesHook(OutcomeHook):
+    """
+    Appends each outcome, as a single line of JSON, to a given file.
+    """
+    def __init__(self, filename):  # type: (str) -> None
+        self.__filename = filename
+        self.__lock = threading.Lock()
+
+    def record(self, outcome, labels):
+        entry = outcome.to_dict()
+        entry['labels'] = labels
+        line = json.dumps(entry, sort_keys=True)
+        with self.__lock:
+            with open(self.__filename, 'a') as f:
+                f.write(line + '\n')
+
+
+def _escape(value):  # type: (str) -> str
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(labels):  # type: (Tuple[Tuple[str, str], ...]) -> str
+    return ','.join('{}="{}"'.format(k, _escape(v)) for (k, v) in labels)
+
+
+class PrometheusHook(OutcomeHook):
+    """
+    Maintains a file, in the format read by the textfile collector of the
+    Prometheus node exporter, that summarises all of the outcomes recorded
+    by this hook. The file is replaced atomically after each outcome.
+    """
+    def __init__(self,
+                 filename,          # type: str
+                 prefix='start'     # type: str
+                 ):                 # type: (...) -> None
+        self.__filename = filename
+        self.__prefix = prefix
+        self.__lock = threading.Lock()
+        self.__tests = {}  # type: Dict[Tuple[Tuple[str, str], ...], int]
+        self.__phase_sum = {}  # type: Dict[Tuple[Tuple[str, str], ...], float]
+        self.__phase_count = {}  # type: Dict[Tuple[Tuple[str, str], ...], int]
+
+    def record(self, outcome, labels):
+        base = tuple(sorted(labels.items()))
+        key = base + (('cached', str(outcome.cached).lower()),
+                      ('passed', str(outcome.passed).lower()))
+        with self.__lock:
+            self.__tests[key] = self.__tests.get(key, 0) + 1
+            for (phase, seconds) in outcome.timings.items():
+                key = base + (('phase', phase),)
+                self.__phase_sum[key] = self.__phase_sum.get(key, 0.0) + seconds
+                self.__phase_count[key] = self.__phase_count.get(key, 0) + 1
+            self.__write()
+
+    def __write(self):  # type: () -> None
+        prefix = self.__prefix
+        lines = [
+            '# HELP {}_tests_total Number of executed tests.'.format(prefix),
+            '# TYPE {}_tests_total counter'.format(prefix)
+        ]
+        for (key, count) in sorted(self.__tests.items()):
+            lines.append('{}_tests_total{{{}}} {}'.format(
+                prefix, _labels(key), count))
+        lines += [
+            '# HELP {}_phase_seconds Time spent in each test phase.'.format(prefix),
+            '# TYPE {}_phase_seconds summary'.format(prefix)
+        ]
+        for (key, total) in sorted(self.__phase_sum.items()):
+            lines.append('{}_phase_seconds_sum{{{}}} {!r}'.format(
+                prefix, _labels(key), total))
+            lines.append('{}_phase_seconds_count{{{}}} {}'.format(
+                prefix, _labels(key), self.__phase_count[key]))
+
+        directory = os.path.dirname(os.path.abspath(self.__filename))
+        (fd, fn_tmp) = tempfile.mkstemp(prefix='.prom', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.rename(fn_tmp, self.__filename)
+        except Exception:
+            os.remove(fn_tmp)
+            raise
@@ -4,38 +4,264 @@ FIXME inconsistency in storage of home location
 from __future__ import print_function
 __all__ = ['Mission']
 
-from typing import List, Tuple
-from timeit import default_timer as timer
-import time
-import signal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import multiprocessing
+import threading
+import functools
 import logging
+import array
+import glob
+import os
 
-import dronekit
 import attr
 
-from .exceptions import TimeoutException
-from .helper import distance, observe
+from .exceptions import TimeoutException, MissionUploadException
+from .deadline import Deadline, SimulationDeadline
+from .simtime import SimulationClock
+from .termination import TerminationRule, Monitor, VehicleState, \
+    default_rules
+from .telemetry import TelemetryRecorder
+from .outcome import TestOutcome, Timings
+from .helper import Location, distance, observe, wait_until
+from .protocol import MAV_MISSION_ACCEPTED, MAV_MISSION_INVALID_SEQUENCE, \
+    MissionItem, is_waypoint_text, is_completion_text, mission_items, \
+    int_item, from_int_item, fingerprint
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
+# (frame, command, p1, p2, p3, p4, x, y, z)
+CommandTuple = Tuple[int, int, float, float, float, float, float, float, float]
 
-def parse_command(s):
+
+# the number of fields used to store each command within a packed table
+NUM_COMMAND_FIELDS = 9
+
+
+def parse_command_tuple(s):  # type: (str) -> CommandTuple
     """
-    Parses a line from a mission file into its corresponding Command
-    object in Dronekit.
+    Parses a line from a mission file into a tuple of the form
+    `(frame, command, p1, p2, p3, p4, x, y, z)`.
     """
     args = s.split()
-    arg_index = int(args[0])
-    arg_currentwp = 0 # int(args[1])
     arg_frame = int(args[2])
     arg_cmd = int(args[3])
-    arg_autocontinue = 0 # not supported by dronekit
     (p1, p2, p3, p4, x, y, z) = [float(x) for x in args[4:11]]
-    cmd = dronekit.Command(
-        0, 0, 0, arg_frame, arg_cmd, arg_currentwp, arg_autocontinue,
+    return (arg_frame, arg_cmd, p1, p2, p3, p4, x, y, z)
+
+
+def parse_command(s):
+    """
+    Parses a line from a mission file into its corresponding Command
+    object in Dronekit.
+    """
+    return command_object(parse_command_tuple(s))
+
+
+def command_object(command):  # type: (CommandTuple) -> dronekit.Command
+    """
+    Builds the Dronekit Command for a command tuple.
+    """
+    import dronekit
+    (frame, cmd, p1, p2, p3, p4, x, y, z) = command
+    arg_currentwp = 0
+    arg_autocontinue = 0 # not supported by dronekit
+    return dronekit.Command(
+        0, 0, 0, frame, cmd, arg_currentwp, arg_autocontinue,
         p1, p2, p3, p4, x, y, z)
-    return cmd
+
+
+def pack_commands(commands):  # type: (Iterable[CommandTuple]) -> array.array
+    """
+    Packs a sequence of command tuples into a flat table of doubles, in
+    which each command occupies `NUM_COMMAND_FIELDS` consecutive entries.
+    """
+    table = array.array('d')
+    for command in commands:
+        table.extend(command)
+    return table
+
+
+def as_command_table(commands):  # type: (Any) -> array.array
+    """
+    Converts a sequence of Dronekit Command objects or command tuples into a
+    packed table. Packed tables are returned unchanged.
+    """
+    if isinstance(commands, array.array):
+        return commands
+    return pack_commands(command_tuple(c) if hasattr(c, 'command') else c
+                         for c in commands)
+
+
+def read_command_table(fn):  # type: (str) -> array.array
+    """
+    Reads the commands within a given mission file into a packed table.
+    The header line of the file is skipped.
+    """
+    with open(fn, 'r') as f:
+        next(f, None)
+        lines = (l.strip() for l in f)
+        return pack_commands(parse_command_tuple(l) for l in lines if l)
+
+
+def command_tuple(command):  # type: (dronekit.Command) -> CommandTuple
+    """
+    Describes a Dronekit Command as a tuple of the form
+    `(frame, command, p1, p2, p3, p4, x, y, z)`.
+    """
+    return (command.frame, command.command,
+            command.param1, command.param2, command.param3, command.param4,
+            command.x, command.y, command.z)
+
+
+def vehicle_mode(conn,   # type: dronekit.Vehicle
+                 name    # type: str
+                 ):      # type: (...) -> dronekit.VehicleMode
+    """
+    Constructs a flight mode that may be assigned to the mode of a given
+    vehicle connection.
+    """
+    from .client import MAVLinkClient, VehicleMode
+    if isinstance(conn, MAVLinkClient):
+        return VehicleMode(name)
+    import dronekit
+    return dronekit.VehicleMode(name)
+
+
+def mission_count(conn,      # type: dronekit.Vehicle
+                  deadline   # type: Deadline
+                  ):         # type: (...) -> int
+    """
+    Determines the number of items in the mission held by a vehicle.
+    """
+    count = [None]  # type: List[Optional[int]]
+    received = threading.Event()
+
+    def on_count(_, name, message):
+        count[0] = message.count
+        received.set()
+
+    message = conn.message_factory.mission_request_list_encode(0, 0)
+    conn.add_message_listener('MISSION_COUNT', on_count)
+    try:
+        conn.send_mavlink(message)
+        while not deadline.wait(received, Mission.TIMEOUT_COMMAND):
+            logger.debug("resending mission request list")
+            conn.send_mavlink(message)
+    finally:
+        conn.remove_message_listener('MISSION_COUNT', on_count)
+    logger.debug("vehicle's mission contains %d items", count[0])
+    return count[0]
+
+
+def download_commands(conn,     # type: dronekit.Vehicle
+                      count,    # type: int
+                      deadline  # type: Deadline
+                      ):        # type: (...) -> List[CommandTuple]
+    """
+    Reads the commands of the mission held by a vehicle, excluding the home
+    location. Rather than waiting for each item before requesting the next,
+    all items are requested at once.
+
+    Parameters:
+        count: the number of items in the mission held by the vehicle.
+    """
+    factory = conn.message_factory
+    items = {}  # type: Dict[int, MissionItem]
+    received = threading.Event()
+
+    def on_item(_, name, message):
+        if message.seq >= count:
+            return
+        item = (message.seq, message.frame, message.command,
+                message.current, message.autocontinue,
+                message.param1, message.param2, message.param3,
+                message.param4, message.x, message.y, message.z)
+        items[message.seq] = from_int_item(item)
+        if len(items) == count:
+            received.set()
+
+    conn.add_message_listener('MISSION_ITEM_INT', on_item)
+    try:
+        while count > 0:
+            for seq in range(count):
+                if seq not in items:
+                    request = factory.mission_request_int_encode(0, 0, seq)
+                    conn.send_mavlink(request)
+            if deadline.wait(received, Mission.TIMEOUT_COMMAND):
+                break
+            logger.debug("re-requesting missing mission items")
+    finally:
+        conn.remove_message_listener('MISSION_ITEM_INT', on_item)
+    conn.send_mavlink(factory.mission_ack_encode(0, 0, MAV_MISSION_ACCEPTED))
+
+    commands = []  # type: List[CommandTuple]
+    for seq in range(1, count):
+        (_, frame, cmd, _, _, p1, p2, p3, p4, x, y, z) = items[seq]
+        commands.append((frame, cmd, p1, p2, p3, p4, x, y, z))
+    return commands
+
+
+def upload_items(conn,      # type: dronekit.Vehicle
+                 items,     # type: List[MissionItem]
+                 deadline   # type: Deadline
+                 ):         # type: (...) -> None
+    """
+    Uploads a list of mission items to a vehicle as MISSION_ITEM_INT
+    messages. Rather than waiting for the vehicle to request each item in
+    turn, all of the items are sent in a single batch upon the first
+    request; items are only resent if the vehicle requests them again.
+
+    Raises:
+        MissionUploadException: if the vehicle rejects the mission.
+    """
+    factory = conn.message_factory
+    messages = [factory.mission_item_int_encode(0, 0, *int_item(item))
+                for item in items]
+    num_requests = [0] * len(items)
+    started = [False]
+    acknowledged = threading.Event()
+    result = [None]  # type: List[Optional[int]]
+
+    def on_request(_, name, message):
+        seq = message.seq
+        if seq >= len(items):
+            return
+        num_requests[seq] += 1
+        if not started[0]:
+            started[0] = True
+            for m in messages[seq:]:
+                conn.send_mavlink(m)
+        elif num_requests[seq] > 1 or seq == 0:
+            conn.send_mavlink(messages[seq])
+
+    def on_ack(_, name, message):
+        # items that arrive before they are requested are rejected, but the
+        # vehicle continues to request the items that it needs
+        if message.type == MAV_MISSION_INVALID_SEQUENCE:
+            return
+        result[0] = message.type
+        acknowledged.set()
+
+    kinds = ['MISSION_REQUEST', 'MISSION_REQUEST_INT']
+    for kind in kinds:
+        conn.add_message_listener(kind, on_request)
+    conn.add_message_listener('MISSION_ACK', on_ack)
+    try:
+        message = factory.mission_count_encode(0, 0, len(items))
+        conn.send_mavlink(message)
+        while not deadline.wait(acknowledged, Mission.TIMEOUT_COMMAND):
+            if not started[0]:
+                logger.debug("resending mission count")
+                conn.send_mavlink(message)
+    finally:
+        for kind in kinds:
+            conn.remove_message_listener(kind, on_request)
+        conn.remove_message_listener('MISSION_ACK', on_ack)
+
+    if result[0] != MAV_MISSION_ACCEPTED:
+        msg = "vehicle rejected mission (MAV_MISSION_RESULT: {})"
+        raise MissionUploadException(msg.format(result[0]))
 
 
 @attr.s(frozen=True)
@@ -44,28 +270,31 @@ class Oracle(object):
     Describes the expected outcome of a mission execution.
     """
     num_waypoints_visited = attr.ib(type=int)
-    end_position = attr.ib(type=dronekit.LocationGlobal)
+    end_position = attr.ib(type=Location)
     max_distance = attr.ib(type=float)
 
     @staticmethod
-    def build(conn,                 # type: dronekit.Vehicle
-              vehicle,              # type: str
-              home,                 # type: Tuple[float, float, float, float]
-              enable_workaround     # type: bool
-              ):                    # type: (...) -> Oracle
+    def from_commands(commands,             # type: List[CommandTuple]
+                      vehicle,              # type: str
+                      home,                 # type: Tuple[float, float, float, float]
+                      enable_workaround     # type: bool
+                      ):                    # type: (...) -> Oracle
+        """
+        Computes the oracle for a mission, given as a sequence of command
+        tuples.
+        """
         num_wps = 0
-        home_loc = dronekit.LocationGlobal(home[0], home[1], home[2])
+        home_loc = Location(home[0], home[1], home[2])
         end_position = home_loc
+        on_ground = True
 
-        for command in conn.commands:
+        for (_, command_id, _, _, _, _, x, y, z) in commands:
             # assumption: all commands use the same frame of reference
             # TODO add assertion
-            command_id = command.command
 
             # TODO tweak logic for copter/plane/rover
             if command_id == 16: # MAV_CMD_NAV_WAYPOINT
-                end_position = \
-                    dronekit.LocationGlobal(command.x, command.y, command.z)
+                end_position = Location(x, y, z)
                 on_ground = False
 
             elif command_id == 20: # MAV_CMD_NAV_RETURN_TO_LAUNCH:
@@ -93,69 +322,283 @@ class Oracle(object):
         logger.debug("generated oracle: %s", oracle)
         return oracle
 
+    def judge(self,
+              actual_num_wps_visited,   # type: int
+              pos_last,                 # type: dronekit.LocationGlobal
+              check_wps                 # type: bool
+              ):                        # type: (...) -> TestOutcome
+        """
+        Determines whether a mission execution, which visited a given number
+        of waypoints before finishing at a given position, satisfies this
+        oracle.
+
+        Returns:
+            the outcome of the execution, which may be unpacked as a tuple of
+            the form `(passed, reason)`.
+        """
+        logger.debug("visited %d waypoints (expected >= %d waypoints)",
+                      actual_num_wps_visited,
+                      self.num_waypoints_visited)
+
+        if check_wps:
+            logger.debug("checking waypoints against oracle")
+        else:
+            logger.debug("ignoring visited waypoints")
+
+        sat_wps = actual_num_wps_visited >= self.num_waypoints_visited
+        if not sat_wps:
+            logger.debug("vehicle failed to visit the minimum required number of WPs (%d vs. %d)",
+                         actual_num_wps_visited, self.num_waypoints_visited)
+
+        dist = distance(self.end_position, pos_last)
+        logger.debug("distance to expected end position: %.3f metres", dist)
+        outcome = functools.partial(
+            TestOutcome,
+            num_waypoints_visited=actual_num_wps_visited,
+            num_waypoints_expected=self.num_waypoints_visited,
+            distance=dist)
+
+        if check_wps and not sat_wps:
+            return outcome(False, "vehicle didn't visit all of the WPs")
+
+        if dist <= self.max_distance:
+            logger.debug("vehicle successfully executed the mission")
+            return outcome(True, None)
+        else:
+            logger.debug("distance to expected end position exceeded maximum (%.3f metres)",
+                         self.max_distance)
+            return outcome(False, "vehicle was too far away from expected end position")
+
 
 # @attr.s(frozen=True)
-@attr.s()
+@attr.s(init=False)
 class Mission(object):
     """
     Describes a mission that may be assigned to an ArduPilot vehicle.
+
+    The commands of a mission are held in a packed table (see
+    `pack_commands`), built with the standard library rather than NumPy so
+    that the core of the package needs no numerical dependencies. For
+    compatibility, a list of Dronekit Command objects (or command tuples)
+    may still be given in place of the table, and is packed on
+    construction. The third field is now named `table`, but the table may
+    still be given by its former name, `commands`, when constructing or
+    evolving a mission.
     """
     filename = attr.ib(type=str)
     vehicle = attr.ib(type=str)  # FIXME use Enum?
-    commands = attr.ib(type=List[dronekit.Command])
+    table = attr.ib(type=array.array, converter=as_command_table)
     home = attr.ib(type=Tuple[float, float, float, float])
 
+    # the number of seconds to wait for the vehicle to act upon a command
+    # before resending it
+    TIMEOUT_COMMAND = 1.0
+
+    # the maximum number of seconds between checks of the termination rules
+    # during the execution of a mission
+    INTERVAL_MONITOR = 0.25
+
+    # the fields upon which the fingerprint and oracles of a mission depend
+    CACHED_FIELDS = ('table', 'vehicle', 'home')
+
     @staticmethod
     def from_file(home,     # type: Tuple[float, float, float, float]
                   vehicle,  # type: str
                   fn        # type: str
                   ):        # type: (...) -> Mission
-        cmds = []
-        with open(fn, 'r') as f:
-            lines = [l.strip() for l in f]
-            for line in lines[1:]:
-                cmd = parse_command(line)
-                cmds.append(cmd)
-        return Mission(fn, vehicle, cmds, home)
+        return Mission(fn, vehicle, read_command_table(fn), home)
+
+    @staticmethod
+    def from_commands(filename,  # type: str
+                      vehicle,   # type: str
+                      commands,  # type: Iterable[Any]
+                      home       # type: Tuple[float, float, float, float]
+                      ):         # type: (...) -> Mission
+        """
+        Constructs a mission from a sequence of Dronekit Command objects or
+        command tuples.
+        """
+        return Mission(filename, vehicle, as_command_table(commands), home)
+
+    @staticmethod
+    def from_files(home,            # type: Tuple[float, float, float, float]
+                   vehicle,         # type: str
+                   filenames,       # type: List[str]
+                   processes=None   # type: Optional[int]
+                   ):               # type: (...) -> List[Mission]
+        """
+        Loads a number of mission files in parallel.
+
+        Parameters:
+            processes: the number of worker processes that should be used to
+                parse the files. Defaults to the number of CPUs.
+        """
+        filenames = list(filenames)
+        logger.debug("loading %d mission files", len(filenames))
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        chunksize = max(1, len(filenames) // (8 * processes))
+        pool = multiprocessing.Pool(processes)
+        try:
+            tables = pool.map(read_command_table, filenames, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+        logger.debug("loaded %d mission files", len(filenames))
+        return [Mission(fn, vehicle, table, home)
+                for (fn, table) in zip(filenames, tables)]
+
+    @staticmethod
+    def from_directory(home,            # type: Tuple[float, float, float, float]
+                       vehicle,         # type: str
+                       directory,       # type: str
+                       pattern='*',     # type: str
+                       processes=None   # type: Optional[int]
+                       ):               # type: (...) -> List[Mission]
+        """
+        Loads, in parallel, all of the mission files within a given directory
+        whose names match a given pattern. Missions are returned in the order
+        of their filenames.
+        """
+        filenames = glob.glob(os.path.join(directory, pattern))
+        filenames = sorted(fn for fn in filenames if os.path.isfile(fn))
+        return Mission.from_files(home, vehicle, filenames, processes)
+
+    def __init__(self,
+                 filename,      # type: str
+                 vehicle,       # type: str
+                 table=None,    # type: Optional[Any]
+                 home=None,     # type: Optional[Tuple[float, float, float, float]]
+                 commands=None  # type: Optional[Any]
+                 ):             # type: (...) -> None
+        # "commands" is the deprecated name of the table, and takes
+        # precedence so that attr.evolve(mission, commands=...) works
+        if commands is not None:
+            table = commands
+        if table is None:
+            raise TypeError("missing required argument: 'table'")
+        if home is None:
+            raise TypeError("missing required argument: 'home'")
+        self.filename = filename
+        self.vehicle = vehicle
+        self.table = table
+        self.home = home
+
+    def __setattr__(self, name, value):  # type: (str, Any) -> None
+        # the fingerprint and oracles are computed from the fields of the
+        # mission, and so must be discarded whenever those fields change
+        if name == 'table':
+            value = as_command_table(value)
+        if name in Mission.CACHED_FIELDS:
+            self.__dict__.pop('_Mission__fingerprint', None)
+            self.__dict__.pop('_Mission__oracles', None)
+        object.__setattr__(self, name, value)
 
     def __len__(self):
         """
         The length of the mission is given its number of commands.
         """
-        return len(self.commands)
+        return len(self.table) // NUM_COMMAND_FIELDS
+
+    @property
+    def command_tuples(self):  # type: () -> List[CommandTuple]
+        """
+        The commands for this mission, given as tuples of the form
+        `(frame, command, p1, p2, p3, p4, x, y, z)`.
+        """
+        table = self.table
+        commands = []  # type: List[CommandTuple]
+        for i in range(0, len(table), NUM_COMMAND_FIELDS):
+            (frame, cmd, p1, p2, p3, p4, x, y, z) = \
+                table[i:i + NUM_COMMAND_FIELDS]
+            commands.append((int(frame), int(cmd), p1, p2, p3, p4, x, y, z))
+        return commands
+
+    @property
+    def commands(self):  # type: () -> List[dronekit.Command]
+        """
+        The commands for this mission, given as Dronekit Command objects.
+        These objects are created afresh upon each access.
+        """
+        return [command_object(c) for c in self.command_tuples]
+
+    @property
+    def fingerprint(self):  # type: () -> str
+        """
+        A fingerprint of the commands for this mission, which may be compared
+        to the fingerprint of the mission held by a vehicle. Computed once
+        per mission.
+        """
+        cached = self.__dict__.get('_Mission__fingerprint')
+        if cached is None:
+            cached = fingerprint(self.command_tuples)
+            self.__fingerprint = cached
+        return cached
+
+    @property
+    def oracle(self):  # type: () -> Oracle
+        """
+        The oracle for this mission, computed with the workaround enabled
+        (the default for `execute`). Prior versions set this attribute when
+        the mission was issued; it is now available without a vehicle. Use
+        `oracle_for` to control the workaround.
+        """
+        return self.oracle_for(True)
+
+    def oracle_for(self, enable_workaround):  # type: (bool) -> Oracle
+        """
+        Computes the oracle for this mission without the need for a vehicle.
+        Oracles are memoized on the mission itself for each workaround
+        setting, and are recomputed if the commands, vehicle or home location
+        of the mission are changed.
+        """
+        oracles = self.__dict__.setdefault('_Mission__oracles', {})
+        oracle = oracles.get(enable_workaround)
+        if oracle is None:
+            logger.debug("computing oracle for mission: %s", self.filename)
+            oracle = Oracle.from_commands(self.command_tuples,
+                                          self.vehicle,
+                                          self.home,
+                                          enable_workaround)
+            oracles[enable_workaround] = oracle
+        return oracle
 
     def issue(self,
-              conn,                 # type: dronekit.Vehicle
-              enable_workaround     # type: bool
-              ):                    # type: (...) -> None
+              conn,                     # type: dronekit.Vehicle
+              enable_workaround=None,   # type: Optional[bool]
+              timeout=30                # type: float
+              ):                        # type: (...) -> None
         """
         Issues (but does not trigger) a mission, provided as a list of commands,
         to a given vehicle.
-        Blocks until the mission has been downloaded onto the vehicle.
+        Blocks until the mission has been downloaded onto the vehicle. If the
+        vehicle already holds an identical mission, the mission is not sent.
+
+        Parameters:
+            enable_workaround: deprecated and ignored; retained so that
+                existing positional callers continue to work. The oracle for
+                the mission is now obtained from `oracle_for`.
+
+        Raises:
+            TimeoutException: if the mission isn't downloaded onto the vehicle
+                within the given number of seconds.
+            MissionUploadException: if the vehicle rejects the mission.
         """
-        vcmds = conn.commands
-        logger.debug("clearing vehicle's command list")
-        vcmds.clear()
-        logger.debug("cleared vehicle's command list")
-        logger.debug("adding commands to vehicle's command list")
-        for command in self.commands:
-            vcmds.add(command)
-            logger.debug("added command to list: %s", command)
-        logger.debug("added all commands to vehicle's command list")
-
-        # FIXME lift into constructor
-        logger.debug("computing oracle for mission")
-        self.oracle = Oracle.build(conn,
-                                   self.vehicle,
-                                   self.home,
-                                   enable_workaround)
-        logger.debug("computed oracle for mission")
-
-        logger.debug("uploading mission to vehicle")
-        vcmds.upload()
-        logger.debug("triggered upload")
-        vcmds.wait_ready()
-        logger.debug("finished uploading mission to vehicle")
+        with Deadline(timeout) as deadline:
+            # the vehicle's mission includes the home location
+            logger.debug("checking vehicle's current mission")
+            count = mission_count(conn, deadline)
+            if count == len(self) + 1:
+                current = download_commands(conn, count, deadline)
+                if fingerprint(current) == self.fingerprint:
+                    logger.debug("vehicle already holds mission: skipping upload")
+                    return
+
+            logger.debug("uploading mission to vehicle")
+            upload_items(conn,
+                         mission_items(self.command_tuples, self.home),
+                         deadline)
+            logger.debug("finished uploading mission to vehicle")
 
     def execute(self,
                 time_limit,         # type: int
@@ -163,54 +606,118 @@ class Mission(object):
                 speedup,            # type: int
                 timeout_heartbeat,  # type: int
                 check_wps,          # type: bool
-                enable_workaround   # type: bool
-                ):                  # type: (...) -> List[bool, str]
+                enable_workaround,  # type: bool
+                recorder=None,      # type: Optional[TelemetryRecorder]
+                timings=None,       # type: Optional[Timings]
+                rules=None          # type: Optional[List[TerminationRule]]
+                ):                  # type: (...) -> TestOutcome
         """
         Executes this mission on a given vehicle.
 
         Parameters:
-            time_limit: the number of seconds that the vehicle should be given
-                to finish executing the mission before aborting the mission.
+            time_limit: the number of simulated seconds that the vehicle
+                should be given to finish executing the mission before
+                aborting the mission. Simulation time is measured by the boot
+                time that the vehicle reports, and so doesn't depend on the
+                speed-up that the simulation actually achieves. The mission
+                is also aborted if the simulation stalls, i.e., if the boot
+                time reported by the vehicle fails to advance for the stall
+                limit of the deadline (ten wall-clock seconds).
             vehicle: the vehicle that should execute the mission.
-            speedup: the speed-up factor used by the simulation.
+            speedup: the speed-up factor requested of the simulation.
+            recorder: an optional recorder that should be used to record the
+                telemetry produced by the vehicle during the execution.
+            timings: an optional record to which the timings of each phase of
+                the execution (i.e., armable, arm, issue, mode, and flight)
+                should be added.
+            rules: the rules that are used to abort the execution as soon
+                as it can no longer succeed. If left unspecified, a fresh set
+                of default rules is used; an empty list disables early
+                termination.
+
+        Returns:
+            the outcome of the execution, which may be unpacked as a tuple of
+            the form `(passed, reason)`. The outcome also records the
+            simulated duration of the execution and the speed-up that was
+            achieved.
 
         Raises:
-            TimeoutError: if the mission doesn't finish executing within the
-                given time limit.
+            TimeoutException: if the mission doesn't finish executing within
+                the given time limit.
         """
-        # modify the time limit according to the simulator speed-up
-        if speedup > 1:
-            logger.debug("adjusting time limit due to speedup > 1")
-            time_limit_old = time_limit
-            time_limit = int(time_limit / speedup) + 10
-            logger.debug("adjusted time limit: %d seconds -> %d seconds",
-                          time_limit_old, time_limit)
-        logger.debug("using wall-clock time limit: %d seconds", time_limit)
-
-        def timeout_handler(signum, frame):
-            raise TimeoutException
-        logger.debug("adding timeout signal handler")
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(time_limit)
-        logger.debug("added timeout signal handler")
-
+        if timings is None:
+            timings = Timings()
+        if rules is None:
+            rules = default_rules()
+        clock = SimulationClock(rate=speedup)
+        clock.attach(conn)
+        if recorder:
+            recorder.attach(conn)
+        try:
+            with SimulationDeadline(time_limit, clock) as deadline:
+                outcome = self.__execute(deadline,
+                                         conn,
+                                         timeout_heartbeat,
+                                         check_wps,
+                                         enable_workaround,
+                                         timings,
+                                         rules)
+            logger.debug("mission took %.2f simulated seconds (speed-up: %s)",
+                         deadline.elapsed, clock.average_rate)
+            return attr.evolve(outcome,
+                               simulated_time=deadline.elapsed,
+                               speedup_achieved=clock.average_rate)
+        finally:
+            clock.detach()
+            if recorder:
+                recorder.detach()
+
+    def __execute(self,
+                  deadline,             # type: Deadline
+                  conn,                 # type: dronekit.Vehicle
+                  timeout_heartbeat,    # type: int
+                  check_wps,            # type: bool
+                  enable_workaround,    # type: bool
+                  timings,              # type: Timings
+                  rules                 # type: List[TerminationRule]
+                  ):                    # type: (...) -> TestOutcome
         logger.debug("waiting for vehicle to become armable")
-        while not conn.is_armable:
-            time.sleep(0.2)
+        with timings.phase('armable'):
+            wait_until(conn,
+                       lambda: conn.is_armable,
+                       ['mode', 'gps_0', 'ekf_ok'],
+                       deadline,
+                       messages=['HEARTBEAT'])
         logger.debug("vehicle is armable")
 
+        # the arming command is resent whenever it goes unanswered
         logger.debug("attempting to arm vehicle")
-        conn.armed = True
-        while not conn.armed:
-            time.sleep(0.1)
+        with timings.phase('arm'):
             conn.armed = True
+            while not wait_until(conn,
+                                 lambda: conn.armed,
+                                 ['armed'],
+                                 deadline,
+                                 timeout=self.TIMEOUT_COMMAND):
+                logger.debug("resending arming command")
+                conn.armed = True
         logger.debug("vehicle is armed")
 
-        self.issue(conn, enable_workaround)
+        with timings.phase('issue'):
+            self.issue(conn, timeout=deadline.remaining)
 
         logger.debug("switching vehicle mode to AUTO")
-        conn.mode = dronekit.VehicleMode("AUTO")
+        with timings.phase('mode'):
+            conn.mode = vehicle_mode(conn, "AUTO")
+            while not wait_until(conn,
+                                 lambda: conn.mode.name == 'AUTO',
+                                 ['mode'],
+                                 deadline,
+                                 timeout=self.TIMEOUT_COMMAND):
+                logger.debug("resending mode change command")
+                conn.mode = vehicle_mode(conn, "AUTO")
         logger.debug("switched vehicle mode to AUTO")
+        timings.start('flight')
         logger.debug("sending mission start message to vehicle")
         message = conn.message_factory.command_long_encode(
             0, 0, 300, 0, 1, len(self) + 1, 0, 0, 0, 0, 4)
@@ -218,85 +725,97 @@ class Mission(object):
         logger.debug("sent mission start message to vehicle")
 
         # monitor the mission
-        mission_complete = [False]
+        oracle = self.oracle_for(enable_workaround)
+        # set whenever the mission completes, the monitored state changes,
+        # or a rule asks to be checked (e.g., the attack server reported a
+        # successful attack)
+        wake = threading.Event()
+        monitor = Monitor(rules, self, oracle, wake.set)
+        time_started = deadline.elapsed
+        mission_complete = threading.Event()
         actual_num_wps_visited = [0]
         is_copter = self.vehicle == 'ArduCopter'
-        pos_last = conn.location.global_frame
+        pos_last = [conn.location.global_frame]
         logger.debug("Vehicle is expected to visit at least %d WPs",
-                     self.oracle.num_waypoints_visited)
+                     oracle.num_waypoints_visited)
 
         try:
             def on_waypoint(self, name, message):
                 text = message.text
                 logger.debug("received STATUSTEXT from vehicle: %s", text)
-                if text.startswith("Reached waypoint #") or \
-                   text.startswith("Reached command #") or \
-                   text.startswith("Skipping invalid cmd"):
+                if is_waypoint_text(text):
                     actual_num_wps_visited[0] += 1
                     logger.debug("incremented number of visited waypoints")
 
-                if text.startswith("Reached destination") or \
-                   text.startswith("Mission Complete") or \
-                   (text.startswith("Disarming motors") and is_copter):
+                if is_completion_text(text, is_copter):
                     logger.debug("message indicates end of mission")
                     actual_num_wps_visited[0] += 1
-                    pos_last = conn.location.global_frame
-                    mission_complete[0] = True
+                    pos_last[0] = conn.location.global_frame
+                    mission_complete.set()
+                    wake.set()
                     logger.debug("marked mission as complete")
                     logger.debug("incremented number of visited waypoints")
 
+            def on_change(vehicle, name, value):
+                wake.set()
+
             logger.debug("attempting to attach STATUSTEXT listener")
             conn.add_message_listener('STATUSTEXT', on_waypoint)
             logger.debug("attached STATUSTEXT listener")
+            conn.add_attribute_listener('mode', on_change)
+            conn.add_attribute_listener('armed', on_change)
 
             # wait until the last waypoint is reached, the time limit has
-            # expired, or the attack was successful
+            # expired, or a termination rule decides that the mission can no
+            # longer succeed (e.g., because the attack was successful)
+            # we wake whenever the mission completes, the mode or armed state
+            # changes, the state should next be checked, or at the moment that
+            # the vehicle's heartbeat would time out
             logger.debug("waiting for mission to terminate")
-            while not mission_complete[0]:
-                if conn.last_heartbeat > timeout_heartbeat:
+            while not mission_complete.is_set():
+                time_to_heartbeat_loss = timeout_heartbeat - conn.last_heartbeat
+                if time_to_heartbeat_loss <= 0:
                     logger.debug("vehicle became unresponsive (heartbeat timeout: %.2f seconds)",
                                  timeout_heartbeat)
-                    return (False, "vehicle became unresponsive.")
-
-                # lat = vehicle.location.global_frame.lat
-                # lon = vehicle.location.global_frame.lon
-                # alt = vehicle.location.global_frame.alt
-                # print("Pos: {:.6f}, {:.6f}, {:.3f}".format(lat, lon, alt))
-                time.sleep(0.2)
+                    return TestOutcome(
+                        False, "vehicle became unresponsive.",
+                        num_waypoints_visited=actual_num_wps_visited[0],
+                        num_waypoints_expected=oracle.num_waypoints_visited,
+                        cacheable=False)
+
+                pos = conn.location.global_frame
+                state = VehicleState(time=deadline.elapsed - time_started,
+                                     mode=conn.mode.name,
+                                     armed=conn.armed,
+                                     position=Location(pos.lat, pos.lon, pos.alt),
+                                     num_waypoints_visited=actual_num_wps_visited[0])
+                abort = monitor.check(state)
+                if abort:
+                    (rule, reason) = abort
+                    return TestOutcome(
+                        False, reason,
+                        num_waypoints_visited=actual_num_wps_visited[0],
+                        num_waypoints_expected=oracle.num_waypoints_visited,
+                        terminated_by=rule,
+                        cacheable=monitor.conclusive)
+
+                deadline.wait(wake, min(time_to_heartbeat_loss,
+                                        self.INTERVAL_MONITOR))
+                wake.clear()
 
             logger.debug("mission has terminated")
-            actual_num_wps_visited = actual_num_wps_visited[0]
-            logger.debug("visited %d waypoints (expected >= %d waypoints)",
-                          actual_num_wps_visited,
-                          self.oracle.num_waypoints_visited)
-
-            if check_wps:
-                logger.debug("checking waypoints against oracle")
-            else:
-                logger.debug("ignoring visited waypoints")
-
-            sat_wps = actual_num_wps_visited >= self.oracle.num_waypoints_visited
-            if not sat_wps:
-                logger.debug("vehicle failed to visit the minimum required number of WPs (%d vs. %d)",
-                             actual_num_wps_visited, self.oracle.num_waypoints_visited)
-
-            if check_wps and not sat_wps:
-                return (False, "vehicle didn't visit all of the WPs")
-
+            timings.stop('flight')
             state = observe(conn)
             logger.debug("final state of vehicle: %s", state)
-            dist = distance(self.oracle.end_position, pos_last)
-            logger.debug("distance to expected end position: %.3f metres", dist)
-
-            if dist <= self.oracle.max_distance:
-                logger.debug("vehicle successfully executed the mission")
-                return (True, None)
-            else:
-                logger.debug("distance to expected end position exceeded maximum (%.3f metres)",
-                             self.oracle.max_distance)
-                return (False, "vehicle was too far away from expected end position")
+            return oracle.judge(actual_num_wps_visited[0],
+                                pos_last[0],
+                                check_wps)
 
         finally:
+            timings.stop('flight')
+            monitor.close()
             logger.debug("removing STATUSTEXT listener")
             conn.remove_message_listener('STATUSTEXT', on_waypoint)
             logger.debug("removed STATUSTEXT listener")
+            conn.remove_attribute_listener('mode', on_change)
+            conn.remove_attribute_listener('armed', on_change)
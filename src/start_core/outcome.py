@@ -0,0 +1,147 @@
+"""
+This module provides structured descriptions of the outcome of a test,
+together with the timings of each phase of its execution.
+"""
+__all__ = ['TestOutcome', 'Timings']
+
+from typing import Dict, Iterator, List, Optional
+from timeit import default_timer as timer
+import contextlib
+import threading
+import logging
+
+import attr
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+class Timings(object):
+    """
+    Records the wall-clock duration of each phase of a test execution, using
+    a monotonic clock. Phases are reported in the order in which they were
+    started; a phase that is entered more than once accumulates its time.
+    """
+    def __init__(self):  # type: () -> None
+        self.__order = []  # type: List[str]
+        self.__durations = {}  # type: Dict[str, float]
+        self.__started = {}  # type: Dict[str, float]
+        self.__lock = threading.Lock()
+
+    def start(self, name):  # type: (str) -> None
+        """
+        Marks the start of a given phase.
+        """
+        with self.__lock:
+            if name not in self.__durations:
+                self.__order.append(name)
+                self.__durations[name] = 0.0
+            self.__started[name] = timer()
+
+    def stop(self, name):  # type: (str) -> None
+        """
+        Marks the end of a given phase. Has no effect if the phase isn't in
+        progress.
+        """
+        with self.__lock:
+            started = self.__started.pop(name, None)
+            if started is not None:
+                self.__durations[name] += timer() - started
+        if started is not None:
+            logger.debug("phase '%s' took %.3f seconds",
+                         name, self.__durations[name])
+
+    @contextlib.contextmanager
+    def phase(self, name):  # type: (str) -> Iterator[None]
+        """
+        Records the time spent within a context as a given phase.
+        """
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def as_dict(self):  # type: () -> Dict[str, float]
+        """
+        Returns the duration of each completed phase, in seconds. Phases that
+        are still in progress are stopped.
+        """
+        for name in list(self.__started):
+            self.stop(name)
+        with self.__lock:
+            return {name: self.__durations[name] for name in self.__order}
+
+    @property
+    def phases(self):  # type: () -> List[str]
+        """
+        The names of the recorded phases, in the order they were started.
+        """
+        with self.__lock:
+            return list(self.__order)
+
+
+@attr.s(frozen=True, cmp=False)
+class TestOutcome(object):
+    """
+    Describes the outcome of a test. For compatibility with code that
+    expects a `(passed, reason)` tuple, outcomes may be unpacked, indexed,
+    and compared in the same way as that tuple (e.g., an outcome is equal to
+    `(True, None)` if its test passed). Outcomes are equal to one another if
+    all of their attributes are equal.
+
+    Outcomes that are caused by a failure of the test infrastructure (e.g., a
+    timeout, or an unresponsive vehicle or attack server) rather than by the
+    behaviour of the vehicle are marked as not `cacheable`, and so are never
+    recorded by a result cache.
+    """
+    passed = attr.ib(type=bool)
+    reason = attr.ib(type=Optional[str])
+    timings = attr.ib(type=Dict[str, float], factory=dict)
+    num_waypoints_visited = attr.ib(type=Optional[int], default=None)
+    num_waypoints_expected = attr.ib(type=Optional[int], default=None)
+    distance = attr.ib(type=Optional[float], default=None)
+    simulated_time = attr.ib(type=Optional[float], default=None)
+    speedup_achieved = attr.ib(type=Optional[float], default=None)
+    # the name of the termination rule, if any, that aborted the execution
+    terminated_by = attr.ib(type=Optional[str], default=None)
+    cached = attr.ib(type=bool, default=False)
+    cacheable = attr.ib(type=bool, default=True)
+
+    def __iter__(self):
+        return iter((self.passed, self.reason))
+
+    def __len__(self):  # type: () -> int
+        return 2
+
+    def __getitem__(self, index):
+        return (self.passed, self.reason)[index]
+
+    def __eq__(self, other):  # type: (object) -> bool
+        if isinstance(other, tuple):
+            return (self.passed, self.reason) == other
+        if isinstance(other, TestOutcome):
+            return attr.astuple(self) == attr.astuple(other)
+        return NotImplemented
+
+    def __ne__(self, other):  # type: (object) -> bool
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):  # type: () -> int
+        return hash((self.passed, self.reason))
+
+    @property
+    def duration(self):  # type: () -> float
+        """
+        The total time spent across all phases of the test, in seconds.
+        """
+        return sum(self.timings.values())
+
+    def to_dict(self):  # type: () -> Dict[str, object]
+        """
+        Produces a JSON-serialisable description of this outcome.
+        """
+        return attr.asdict(self)
@@ -0,0 +1,138 @@
+"""
+This module provides a pool of worker processes that may be used to execute
+several tests at once on a single machine. Each test is run on its own SITL
+instance, using an instance number (and set of ports) that is reserved for
+the pool.
+"""
+__all__ = ['TestPool']
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import multiprocessing
+import logging
+
+import attr
+
+from .sitl import SITL
+from .mission import Mission
+from .attack import Attack
+from .ports import PortAllocator
+from . import test
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+def _execute(instances,  # type: multiprocessing.Queue
+             sitl,       # type: SITL
+             mission,    # type: Mission
+             attack,     # type: Optional[Attack]
+             kwargs      # type: Dict[str, Any]
+             ):          # type: (...) -> Tuple[bool, str]
+    """
+    Executes a single test inside a worker process, using an instance number
+    borrowed from the pool for the duration of the test.
+    """
+    instance = instances.get()
+    try:
+        sitl = attr.evolve(sitl, instance=instance)
+        logger.debug("executing test on SITL instance %d", instance)
+        return test.execute(sitl, mission, attack, **kwargs)
+    finally:
+        instances.put(instance)
+
+
+class TestPool(object):
+    """
+    Executes tests concurrently using a fixed number of worker processes.
+    """
+    def __init__(self,
+                 num_workers=None,  # type: Optional[int]
+                 allocator=None     # type: Optional[PortAllocator]
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            num_workers: the number of tests that may be executed at once. If
+                left unspecified, one worker per CPU will be used.
+            allocator: the allocator that should be used to reserve SITL
+                instances for the pool.
+
+        Raises:
+            NoFreeInstanceException: if there are too few free SITL instances
+                to provide one to each worker.
+        """
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if allocator is None:
+            allocator = PortAllocator()
+        self.__allocator = allocator
+        self.__ports = []
+        try:
+            for _ in range(num_workers):
+                self.__ports.append(allocator.acquire())
+        except Exception:
+            self.__release()
+            raise
+
+        self.__manager = multiprocessing.Manager()
+        self.__instances = self.__manager.Queue()
+        for ports in self.__ports:
+            self.__instances.put(ports.instance)
+
+        logger.debug("launching test pool with %d workers", num_workers)
+        self.__pool = multiprocessing.Pool(num_workers)
+        logger.debug("launched test pool")
+
+    def __enter__(self):  # type: () -> TestPool
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.close()
+
+    def __release(self):  # type: () -> None
+        for ports in self.__ports:
+            self.__allocator.release(ports)
+        self.__ports = []
+
+    def submit(self,
+               sitl,         # type: SITL
+               mission,      # type: Mission
+               attack=None,  # type: Optional[Attack]
+               **kwargs      # type: Any
+               ):            # type: (...) -> multiprocessing.pool.AsyncResult
+        """
+        Schedules a test for execution. Accepts the same arguments as
+        `test.execute`.
+
+        Returns:
+            a handle to the eventual `(passed, reason)` outcome of the test.
+        """
+        args = (self.__instances, sitl, mission, attack, kwargs)
+        return self.__pool.apply_async(_execute, args)
+
+    def map(self,
+            sitl,       # type: SITL
+            jobs,       # type: Iterable[Tuple[Mission, Optional[Attack]]]
+            **kwargs    # type: Any
+            ):          # type: (...) -> List[Tuple[bool, str]]
+        """
+        Executes a number of `(mission, attack)` tests against a given SITL,
+        blocking until all tests have finished.
+
+        Returns:
+            the outcome of each test, in the same order as the given jobs.
+        """
+        handles = [self.submit(sitl, mission, attack, **kwargs)
+                   for (mission, attack) in jobs]
+        return [h.get() for h in handles]
+
+    def close(self):  # type: () -> None
+        """
+        Waits for all scheduled tests to finish before shutting down the pool
+        and releasing its SITL instances.
+        """
+        logger.debug("closing test pool")
+        self.__pool.close()
+        self.__pool.join()
+        self.__manager.shutdown()
+        self.__release()
+        logger.debug("closed test pool")
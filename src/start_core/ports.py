@@ -0,0 +1,142 @@
+"""
+This module is responsible for allocating SITL instance numbers, and their
+associated network ports, so that several SITL instances may be run on the
+same machine without colliding with one another.
+"""
+__all__ = ['Ports', 'PortAllocator']
+
+from typing import List, Set
+import socket
+import threading
+import contextlib
+import logging
+
+import attr
+
+from .exceptions import NoFreeInstanceException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+@attr.s(frozen=True)
+class Ports(object):
+    """
+    Describes the network ports that are used by a given SITL instance. The
+    ports are derived from the instance number in the same way as
+    sim_vehicle.py's `-I` option.
+    """
+    instance = attr.ib(type=int)
+
+    @property
+    def sitl(self):  # type: () -> int
+        """
+        The TCP port on which the SITL binary serves MAVLink.
+        """
+        return 5760 + 10 * self.instance
+
+    @property
+    def harness(self):  # type: () -> int
+        """
+        The UDP port to which MAVProxy forwards MAVLink for the test harness.
+        """
+        return 14550 + 10 * self.instance
+
+    @property
+    def attacker(self):  # type: () -> int
+        """
+        The UDP port to which MAVProxy forwards MAVLink for the attacker.
+        """
+        return 14551 + 10 * self.instance
+
+    @property
+    def outputs(self):  # type: () -> List[int]
+        """
+        The additional UDP ports to which MAVProxy forwards MAVLink.
+        """
+        return [14552 + 10 * self.instance, 14553 + 10 * self.instance]
+
+    @property
+    def attack_server(self):  # type: () -> int
+        """
+        The TCP port on which the attack server listens for commands.
+        """
+        return 14300 + self.instance
+
+    def is_free(self):  # type: () -> bool
+        """
+        Determines whether all of the ports used by this instance are
+        currently available on the local machine.
+        """
+        tcp = [self.sitl, self.attack_server]
+        udp = [self.harness, self.attacker] + self.outputs
+        ports = [(socket.SOCK_STREAM, p) for p in tcp] + \
+                [(socket.SOCK_DGRAM, p) for p in udp]
+        for (kind, port) in ports:
+            sock = socket.socket(socket.AF_INET, kind)
+            try:
+                sock.bind(('127.0.0.1', port))
+            except socket.error:
+                logger.debug("port %d is in use", port)
+                return False
+            finally:
+                sock.close()
+        return True
+
+
+class PortAllocator(object):
+    """
+    Hands out SITL instance numbers, and their associated ports, ensuring that
+    no two live instances on this machine share a port. Instances whose ports
+    are in use by another process are skipped. Thread-safe.
+    """
+    def __init__(self,
+                 first_instance=0,  # type: int
+                 num_instances=64   # type: int
+                 ):                 # type: (...) -> None
+        assert first_instance >= 0
+        assert num_instances > 0
+        assert first_instance + num_instances <= 250, \
+            "attack server ports would overlap with MAVLink ports"
+        self.__instances = range(first_instance,
+                                 first_instance + num_instances)
+        self.__in_use = set()  # type: Set[int]
+        self.__lock = threading.Lock()
+
+    def acquire(self):  # type: () -> Ports
+        """
+        Allocates an unused instance number.
+
+        Raises:
+            NoFreeInstanceException: if there are no free instances.
+        """
+        with self.__lock:
+            for instance in self.__instances:
+                if instance in self.__in_use:
+                    continue
+                ports = Ports(instance)
+                if not ports.is_free():
+                    continue
+                self.__in_use.add(instance)
+                logger.debug("allocated SITL instance: %d", instance)
+                return ports
+        raise NoFreeInstanceException("all SITL instances are in use")
+
+    def release(self, ports):  # type: (Ports) -> None
+        """
+        Returns a previously allocated instance number to the allocator.
+        """
+        with self.__lock:
+            self.__in_use.discard(ports.instance)
+        logger.debug("released SITL instance: %d", ports.instance)
+
+    @contextlib.contextmanager
+    def allocate(self):  # type: () -> Ports
+        """
+        Allocates an instance number for the duration of a context.
+        """
+        ports = self.acquire()
+        try:
+            yield ports
+        finally:
+            self.release(ports)
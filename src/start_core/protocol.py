@@ -0,0 +1,130 @@
+"""
+This module provides constants and helper functions for the parts of the
+MAVLink protocol that are used by the test harness, independently of any
+particular MAVLink client.
+"""
+__all__ = ['MAV_CMD_NAV_WAYPOINT', 'MAV_CMD_NAV_RETURN_TO_LAUNCH',
+           'MAV_CMD_NAV_LAND', 'MAV_CMD_DO_SET_HOME',
+           'MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN', 'MAV_CMD_MISSION_START',
+           'MAV_CMD_COMPONENT_ARM_DISARM', 'MAGIC_FORCE_DISARM',
+           'MAV_MODE_FLAG_SAFETY_ARMED', 'MAV_MODE_FLAG_CUSTOM_MODE_ENABLED',
+           'MAV_MISSION_ACCEPTED',
+           'MODE_AUTO', 'is_waypoint_text', 'is_completion_text',
+           'mission_items', 'int_item', 'from_int_item', 'fingerprint']
+
+from typing import Iterable, List, Tuple
+import struct
+import hashlib
+
+MAV_CMD_NAV_WAYPOINT = 16
+MAV_CMD_NAV_RETURN_TO_LAUNCH = 20
+MAV_CMD_NAV_LAND = 21
+MAV_CMD_DO_SET_HOME = 179
+MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN = 246
+MAV_CMD_MISSION_START = 300
+MAV_CMD_COMPONENT_ARM_DISARM = 400
+
+# passed as the second parameter of MAV_CMD_COMPONENT_ARM_DISARM to allow the
+# vehicle to be disarmed in flight
+MAGIC_FORCE_DISARM = 21196
+
+MAV_MODE_FLAG_SAFETY_ARMED = 128
+MAV_MODE_FLAG_CUSTOM_MODE_ENABLED = 1
+
+MAV_MISSION_ACCEPTED = 0
+MAV_MISSION_INVALID_SEQUENCE = 13
+
+# frames whose x and y coordinates are given as a latitude and longitude
+GLOBAL_FRAMES = [0, 3, 5, 6, 10, 11]
+
+# the custom flight mode number of the AUTO mode for each vehicle
+MODE_AUTO = {
+    'APMrover2': 10,
+    'ArduCopter': 3,
+    'ArduPlane': 10
+}
+
+# a mission item is given by a tuple of the form
+# (seq, frame, command, current, autocontinue, p1, p2, p3, p4, x, y, z)
+MissionItem = Tuple[int, int, int, int, int,
+                    float, float, float, float, float, float, float]
+
+
+def is_waypoint_text(text):  # type: (str) -> bool
+    """
+    Determines whether a STATUSTEXT message indicates that the vehicle has
+    visited a waypoint.
+    """
+    return text.startswith("Reached waypoint #") or \
+        text.startswith("Reached command #") or \
+        text.startswith("Skipping invalid cmd")
+
+
+def is_completion_text(text,        # type: str
+                       is_copter    # type: bool
+                       ):           # type: (...) -> bool
+    """
+    Determines whether a STATUSTEXT message indicates that the vehicle has
+    finished executing its mission.
+    """
+    return text.startswith("Reached destination") or \
+        text.startswith("Mission Complete") or \
+        (text.startswith("Disarming motors") and is_copter)
+
+
+def mission_items(commands,  # type: List[Tuple[int, int, float, float, float, float, float, float, float]]
+                  home       # type: Tuple[float, float, float, float]
+                  ):         # type: (...) -> List[MissionItem]
+    """
+    Transforms a list of `(frame, command, p1, p2, p3, p4, x, y, z)` command
+    tuples into the list of items that should be uploaded to the vehicle.
+    As with Dronekit, the first item is the home location, which is
+    overwritten by the vehicle.
+    """
+    (lat, lon, alt, _) = home
+    items = [(0, 0, MAV_CMD_NAV_WAYPOINT, 0, 1,
+              0.0, 0.0, 0.0, 0.0, lat, lon, alt)]
+    for (seq, command) in enumerate(commands, 1):
+        (frame, cmd, p1, p2, p3, p4, x, y, z) = command
+        items.append((seq, frame, cmd, 0, 1, p1, p2, p3, p4, x, y, z))
+    return items
+
+
+def int_item(item):  # type: (MissionItem) -> Tuple
+    """
+    Converts a mission item into the form used by MISSION_ITEM_INT, in which
+    x and y are given as scaled integers.
+    """
+    (seq, frame, cmd, current, autocontinue, p1, p2, p3, p4, x, y, z) = item
+    scale = 1e7 if frame in GLOBAL_FRAMES else 1e4
+    return (seq, frame, cmd, current, autocontinue, p1, p2, p3, p4,
+            int(round(x * scale)), int(round(y * scale)), z)
+
+
+def from_int_item(item):  # type: (Tuple) -> MissionItem
+    """
+    Converts a mission item in the form used by MISSION_ITEM_INT into the
+    form used by MISSION_ITEM.
+    """
+    (seq, frame, cmd, current, autocontinue, p1, p2, p3, p4, x, y, z) = item
+    scale = 1e7 if frame in GLOBAL_FRAMES else 1e4
+    return (seq, frame, cmd, current, autocontinue, p1, p2, p3, p4,
+            x / scale, y / scale, z)
+
+
+def fingerprint(commands):  # type: (Iterable[Tuple]) -> str
+    """
+    Computes a fingerprint for a sequence of `(frame, command, p1, p2, p3,
+    p4, x, y, z)` command tuples. Each command is first reduced to the
+    precision with which it is sent via MISSION_ITEM_INT (i.e., 32-bit floats
+    and scaled integers), so that a mission that is read back from a vehicle
+    has the same fingerprint as the mission that was sent to it.
+    """
+    h = hashlib.sha1()
+    for command in commands:
+        (frame, cmd, p1, p2, p3, p4, x, y, z) = command
+        (_, _, _, _, _, p1, p2, p3, p4, x, y, z) = \
+            int_item((0, frame, cmd, 0, 0, p1, p2, p3, p4, x, y, z))
+        h.update(struct.pack('<HH4fiif',
+                             int(frame), int(cmd), p1, p2, p3, p4, x, y, z))
+    return h.hexdigest()
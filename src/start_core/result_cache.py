@@ -0,0 +1,242 @@
+"""
+This module implements a persistent cache of test outcomes, backed by an
+SQLite database. Outcomes are keyed by a hash of the SITL binary under test
+and of the inputs to the test (i.e., the mission, attack, speed-up factor,
+timeouts, launch prefix, oracle settings and whether early termination is
+enabled), allowing a test of a byte-identical binary to be answered without
+launching the simulator. Although missions are timed in simulation time, the
+liveness and connection timeouts and the stall limit are measured in
+wall-clock time, and so outcomes obtained at different speed-ups are kept
+apart.
+
+For each key, the cache keeps a history of the most recent outcomes. A
+cached outcome is only used once enough consistent samples have been
+observed; tests whose recorded outcomes disagree (i.e., flaky tests) are
+always re-executed.
+"""
+__all__ = ['ResultCache']
+
+from typing import Dict, Optional, Tuple
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import logging
+
+import attr
+
+from .sitl import SITL
+from .mission import Mission
+from .attack import Attack
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS outcomes_by_key ON outcomes (key, id);
+CREATE INDEX IF NOT EXISTS entries_by_use ON entries (last_used);
+"""
+
+
+def _hash_file(fn):  # type: (str) -> str
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Provides a persistent, size-bounded cache of test outcomes. Safe to
+    share between threads and processes.
+    """
+    def __init__(self,
+                 filename,              # type: str
+                 history=5,             # type: int
+                 min_samples=2,         # type: int
+                 max_entries=100000     # type: int
+                 ):                     # type: (...) -> None
+        """
+        Parameters:
+            filename: the SQLite database in which outcomes are stored.
+            history: the number of most recent outcomes that are kept for
+                each key.
+            min_samples: the number of consistent outcomes that must be
+                observed for a key before its outcome is reused. Flaky tests
+                can only be detected if at least two samples are required.
+            max_entries: the maximum number of keys that may be held by the
+                cache before its least recently used keys are evicted.
+        """
+        assert 1 <= min_samples <= history
+        self.__filename = os.path.abspath(filename)
+        self.__history = history
+        self.__min_samples = min_samples
+        self.__max_entries = max_entries
+        self.__local = threading.local()
+
+        # binary hashes, indexed by (filename, inode, size, mtime)
+        self.__binary_hashes = {}  # type: Dict[Tuple[str, int, int, float], str]
+        self.__lock = threading.Lock()
+
+        with self.__connection() as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def filename(self):  # type: () -> str
+        return self.__filename
+
+    def __connection(self):  # type: () -> sqlite3.Connection
+        """
+        Returns the connection to the database for the calling thread and
+        process.
+        """
+        pid = os.getpid()
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None or self.__local.pid != pid:
+            conn = sqlite3.connect(self.__filename, timeout=60)
+            self.__local.conn = conn
+            self.__local.pid = pid
+        return conn
+
+    def __hash_binary(self, fn):  # type: (str) -> str
+        """
+        Computes the hash of a given binary. Hashes are memoized until the
+        binary is modified.
+        """
+        stat = os.stat(fn)
+        stamp = (fn, stat.st_ino, stat.st_size, stat.st_mtime)
+        with self.__lock:
+            digest = self.__binary_hashes.get(stamp)
+        if digest is None:
+            logger.debug("hashing SITL binary: %s", fn)
+            digest = _hash_file(fn)
+            with self.__lock:
+                self.__binary_hashes[stamp] = digest
+        return digest
+
+    def key(self,
+            sitl,               # type: SITL
+            mission,            # type: Mission
+            attack,             # type: Optional[Attack]
+            speedup,            # type: int
+            check_wps,          # type: bool
+            enable_workaround,  # type: bool
+            early_termination,  # type: bool
+            timeout_mission,    # type: int
+            timeout_liveness,   # type: int
+            timeout_connection, # type: int
+            prefix              # type: Optional[str]
+            ):                  # type: (...) -> str
+        """
+        Computes the key for a test of a given SITL. Every input that may
+        change the outcome of the test, including its timeouts and the
+        prefix with which the SITL is launched, is part of the key. Since
+        early termination changes the reasons given for failures, outcomes
+        obtained with and without it are kept apart.
+        """
+        inputs = {
+            'binary': self.__hash_binary(sitl.binary),
+            'vehicle': sitl.vehicle,
+            'home': list(mission.home),
+            'mission': mission.fingerprint,
+            'attack': None,
+            'speedup': speedup,
+            'check_wps': check_wps,
+            'enable_workaround': enable_workaround,
+            'early_termination': early_termination,
+            'timeout_mission': timeout_mission,
+            'timeout_liveness': timeout_liveness,
+            'timeout_connection': timeout_connection,
+            'prefix': prefix or ''
+        }
+        if attack:
+            inputs['attack'] = attr.asdict(attack)
+            inputs['attack_script'] = _hash_file(attack.script)
+        encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def lookup(self, key):  # type: (str) -> Optional[Tuple[bool, str]]
+        """
+        Retrieves the cached outcome for a given key.
+
+        Returns:
+            the most recent outcome for the given key, or None if there are
+            too few recorded outcomes or if the recorded outcomes disagree.
+        """
+        conn = self.__connection()
+        with conn:
+            rows = conn.execute(
+                "SELECT passed, reason FROM outcomes WHERE key = ? "
+                "ORDER BY id DESC LIMIT ?", (key, self.__history)).fetchall()
+            if rows:
+                conn.execute("UPDATE entries SET last_used = julianday('now') "
+                             "WHERE key = ?", (key,))
+
+        if len(rows) < self.__min_samples:
+            logger.debug("result cache miss: %s (%d samples)", key, len(rows))
+            return None
+        if len(set(passed for (passed, _) in rows)) > 1:
+            logger.debug("result cache miss: %s (flaky)", key)
+            return None
+        (passed, reason) = rows[0]
+        logger.debug("result cache hit: %s", key)
+        return (bool(passed), reason)
+
+    def record(self,
+               key,     # type: str
+               outcome  # type: Tuple[bool, str]
+               ):       # type: (...) -> None
+        """
+        Records the outcome of a test for a given key, discarding the oldest
+        outcomes for that key and the least recently used keys as necessary.
+        """
+        (passed, reason) = outcome
+        conn = self.__connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, last_used) "
+                         "VALUES (?, julianday('now'))", (key,))
+            conn.execute("INSERT INTO outcomes (key, passed, reason) "
+                         "VALUES (?, ?, ?)", (key, int(passed), reason))
+            conn.execute(
+                "DELETE FROM outcomes WHERE key = ? AND id NOT IN "
+                "(SELECT id FROM outcomes WHERE key = ? "
+                "ORDER BY id DESC LIMIT ?)", (key, key, self.__history))
+            self.__evict(conn)
+        logger.debug("recorded outcome in result cache: %s -> %s",
+                     key, outcome)
+
+    def __evict(self, conn):  # type: (sqlite3.Connection) -> None
+        (num_entries,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        excess = num_entries - self.__max_entries
+        if excess <= 0:
+            return
+        logger.debug("evicting %d entries from result cache", excess)
+        conn.execute(
+            "DELETE FROM outcomes WHERE key IN "
+            "(SELECT key FROM entries ORDER BY last_used ASC LIMIT ?)",
+            (excess,))
+        conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY last_used ASC LIMIT ?)",
+            (excess,))
+
+    def clear(self):  # type: () -> None
+        """
+        Removes all outcomes from the cache.
+        """
+        conn = self.__connection()
+        with conn:
+            conn.execute("DELETE FROM outcomes")
+            conn.execute("DELETE FROM entries")
@@ -0,0 +1,320 @@
+"""
+This module provides a lightweight MAVLink router that may be used in place
+of MAVProxy. The router connects to the TCP port on which the SITL binary
+serves MAVLink, and forwards each message from the SITL, as a UDP datagram,
+to each of a number of endpoints (e.g., the test harness and the attacker).
+Messages that are received from an endpoint are forwarded to the SITL.
+
+Messages are routed without being decoded: only their frame headers are
+read, so that each endpoint may be restricted to (or prevented from
+receiving) certain types of message.
+"""
+__all__ = ['Endpoint', 'MAVLinkRouter']
+
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+import errno
+import select
+import socket
+import struct
+import threading
+import logging
+
+import attr
+
+from .exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+MAGIC_V1 = 0xFE
+MAGIC_V2 = 0xFD
+MAVLINK_IFLAG_SIGNED = 0x01
+SIGNATURE_LENGTH = 13
+
+# socket errors that indicate that an operation should be retried later
+TRANSIENT_ERRORS = frozenset([errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR])
+
+# the maximum number of bytes from endpoints that may be waiting to be sent
+# to the SITL; datagrams that arrive while the buffer is full are dropped
+MAX_PENDING = 1 << 20
+
+
+def _message_ids(names):  # type: (Optional[Iterable[str]]) -> Optional[FrozenSet[int]]
+    if names is None:
+        return None
+    from pymavlink import mavutil
+    mavlink = mavutil.mavlink
+    return frozenset(getattr(mavlink, 'MAVLINK_MSG_ID_{}'.format(name))
+                     for name in names)
+
+
+def split_frames(buff):  # type: (bytes) -> Tuple[List[Tuple[int, bytes]], bytes]
+    """
+    Splits a stream of MAVLink v1 and v2 frames into individual frames.
+    Bytes that don't belong to a frame are discarded.
+
+    Returns:
+        a tuple of the form `(frames, rest)`, where `frames` is a list of
+        `(message id, frame)` tuples, and `rest` holds the bytes of an
+        incomplete frame at the end of the stream.
+    """
+    frames = []  # type: List[Tuple[int, bytes]]
+    i = 0
+    size = len(buff)
+    while i < size:
+        magic = ord(buff[i:i + 1])
+        if magic == MAGIC_V1:
+            if size - i < 6:
+                break
+            length = 6 + ord(buff[i + 1:i + 2]) + 2
+            if size - i < length:
+                break
+            msgid = ord(buff[i + 5:i + 6])
+        elif magic == MAGIC_V2:
+            if size - i < 10:
+                break
+            length = 10 + ord(buff[i + 1:i + 2]) + 2
+            if ord(buff[i + 2:i + 3]) & MAVLINK_IFLAG_SIGNED:
+                length += SIGNATURE_LENGTH
+            if size - i < length:
+                break
+            (lo, hi) = struct.unpack('<HB', buff[i + 7:i + 10])
+            msgid = lo | (hi << 16)
+        else:
+            i += 1
+            continue
+        frames.append((msgid, buff[i:i + length]))
+        i += length
+    return (frames, buff[i:])
+
+
+@attr.s(frozen=True)
+class Endpoint(object):
+    """
+    Describes a UDP endpoint to which MAVLink messages are forwarded. If
+    `include` is given, only messages of those types are forwarded; any
+    messages whose types are listed in `exclude` are not forwarded.
+    """
+    host = attr.ib(type=str)
+    port = attr.ib(type=int)
+    include = attr.ib(type=Optional[FrozenSet[str]], default=None,
+                      converter=attr.converters.optional(frozenset))
+    exclude = attr.ib(type=FrozenSet[str], default=frozenset(),
+                      converter=frozenset)
+
+    @property
+    def address(self):  # type: () -> Tuple[str, int]
+        return (self.host, self.port)
+
+
+class _Output(object):
+    """
+    Holds the socket and message filter for an endpoint.
+    """
+    def __init__(self, endpoint):  # type: (Endpoint) -> None
+        self.endpoint = endpoint
+        self.address = endpoint.address
+        self.include = _message_ids(endpoint.include)
+        self.exclude = _message_ids(endpoint.exclude) or frozenset()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.setblocking(False)
+
+    def accepts(self, msgid):  # type: (int) -> bool
+        if self.include is not None and msgid not in self.include:
+            return False
+        return msgid not in self.exclude
+
+
+class MAVLinkRouter(object):
+    """
+    Routes MAVLink between a SITL and a number of UDP endpoints on a
+    background thread. If the connection to the SITL is lost (e.g., because
+    the vehicle rebooted), the router reconnects to it.
+
+    Messages from endpoints are buffered until the connection to the SITL
+    is writable, so that a partial write never splits a frame in the stream.
+    """
+    def __init__(self,
+                 master,        # type: Tuple[str, int]
+                 endpoints      # type: List[Endpoint]
+                 ):             # type: (...) -> None
+        """
+        Parameters:
+            master: the address of the TCP port on which the SITL serves
+                MAVLink.
+            endpoints: the endpoints to which messages should be forwarded.
+        """
+        self.__master = master
+        self.__endpoints = endpoints
+        self.__outputs = []  # type: List[_Output]
+        self.__connection = None  # type: Optional[socket.socket]
+        self.__pending = b''
+        self.__connected = threading.Event()
+        self.__stopped = threading.Event()
+        self.__thread = None  # type: Optional[threading.Thread]
+        self.__num_forwarded = 0
+        self.__num_filtered = 0
+
+    def __enter__(self):  # type: () -> MAVLinkRouter
+        self.start()
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.stop()
+
+    @property
+    def num_forwarded(self):  # type: () -> int
+        """
+        The number of messages that have been forwarded to endpoints.
+        """
+        return self.__num_forwarded
+
+    @property
+    def num_filtered(self):  # type: () -> int
+        """
+        The number of messages that were withheld from endpoints by filters.
+        """
+        return self.__num_filtered
+
+    def start(self):  # type: () -> None
+        """
+        Begins routing messages. The router connects to the SITL as soon as
+        it begins listening.
+        """
+        logger.debug("starting MAVLink router for SITL at %s:%d",
+                     *self.__master)
+        self.__stopped.clear()
+        self.__outputs = [_Output(e) for e in self.__endpoints]
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):  # type: () -> None
+        """
+        Stops routing messages, and closes all connections.
+        """
+        logger.debug("stopping MAVLink router")
+        self.__stopped.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        self.__disconnect()
+        for output in self.__outputs:
+            output.socket.close()
+        self.__outputs = []
+        logger.debug("stopped MAVLink router (forwarded: %d, filtered: %d)",
+                     self.__num_forwarded, self.__num_filtered)
+
+    def wait_connected(self, timeout):  # type: (float) -> None
+        """
+        Blocks until the router has connected to the SITL.
+
+        Raises:
+            TimeoutException: if the router failed to connect in time.
+        """
+        if not self.__connected.wait(timeout):
+            raise TimeoutException
+
+    def __connect(self):  # type: () -> bool
+        """
+        Attempts to connect to the SITL.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(0.5)
+        try:
+            sock.connect(self.__master)
+        except socket.error:
+            sock.close()
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        self.__connection = sock
+        self.__connected.set()
+        logger.debug("MAVLink router connected to SITL at %s:%d",
+                     *self.__master)
+        return True
+
+    def __disconnect(self):  # type: () -> None
+        self.__connected.clear()
+        self.__pending = b''
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    def __run(self):  # type: () -> None
+        buff = b''
+        delay = 0.01
+        sockets = {o.socket: o for o in self.__outputs}  # type: Dict[socket.socket, _Output]
+        while not self.__stopped.is_set():
+            if not self.__connection:
+                if not self.__connect():
+                    self.__stopped.wait(delay)
+                    delay = min(delay * 2, 0.5)
+                    continue
+                delay = 0.01
+                buff = b''
+
+            readable = [self.__connection] + list(sockets)
+            writable = [self.__connection] if self.__pending else []
+            try:
+                (ready, ready_write, _) = \
+                    select.select(readable, writable, [], 0.1)
+            except (select.error, ValueError):
+                continue
+
+            if ready_write and not self.__send():
+                logger.debug("MAVLink router lost connection to SITL")
+                self.__disconnect()
+                continue
+
+            for sock in ready:
+                if sock is self.__connection:
+                    try:
+                        data = sock.recv(65536)
+                    except socket.error as err:
+                        if err.errno in TRANSIENT_ERRORS:
+                            continue
+                        data = b''
+                    if not data:
+                        logger.debug("MAVLink router lost connection to SITL")
+                        self.__disconnect()
+                        break
+                    (frames, buff) = split_frames(buff + data)
+                    self.__forward(frames)
+                else:
+                    try:
+                        (data, _) = sock.recvfrom(65536)
+                    except socket.error:
+                        continue
+                    if len(self.__pending) + len(data) > MAX_PENDING:
+                        logger.debug("MAVLink router dropped message to SITL: buffer is full")
+                        continue
+                    self.__pending += data
+
+    def __send(self):  # type: () -> bool
+        """
+        Sends as many of the buffered bytes to the SITL as its connection
+        will accept without blocking.
+
+        Returns:
+            False if the connection to the SITL was lost.
+        """
+        try:
+            sent = self.__connection.send(self.__pending)
+        except socket.error as err:
+            return err.errno in TRANSIENT_ERRORS
+        self.__pending = self.__pending[sent:]
+        return True
+
+    def __forward(self, frames):  # type: (List[Tuple[int, bytes]]) -> None
+        for output in self.__outputs:
+            for (msgid, frame) in frames:
+                if not output.accepts(msgid):
+                    self.__num_filtered += 1
+                    continue
+                try:
+                    output.socket.sendto(frame, output.address)
+                    self.__num_forwarded += 1
+                except socket.error:
+                    pass
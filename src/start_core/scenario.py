@@ -1,5 +1,6 @@
 __all__ = ['Scenario']
 
+from typing import Any, Dict, Iterable, Iterator, Optional
 import os
 import logging
 import shutil
@@ -13,6 +14,8 @@ import configparser
 from .mission import Mission
 from .attack import Attack
 from .sitl import SITL
+from .build_cache import BuildCache
+from .batch import BatchBuilder, BuildResult
 from .exceptions import FileNotFoundException, UnsupportedRevisionException
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
@@ -35,6 +38,13 @@ SUPPORTED_REVISIONS = [
     'b622fe1'
 ]
 
+# the waf target that builds the SITL binary for each vehicle
+WAF_TARGETS = {
+    'APMrover2': 'rover',
+    'ArduCopter': 'copter',
+    'ArduPlane': 'arduplane'
+}
+
 BRANCH_TO_REVISION = {
     'Sept-demo-cca9a6e-April-21': 'cca9a6e',
     'Sept-demo-c99cc46-May-18': 'c99cc46',
@@ -51,6 +61,19 @@ BRANCH_TO_REVISION = {
 }
 
 
+def read_config(fn):  # type: (str) -> configparser.SafeConfigParser
+    """
+    Parses a given scenario configuration file, using the default
+    configuration to provide any missing options.
+    """
+    cfg = configparser.SafeConfigParser()
+    fn_cfg = os.path.join(os.path.dirname(__file__),
+                          'config/scenario.default.config')
+    cfg.read(fn_cfg)
+    cfg.read(fn)
+    return cfg
+
+
 @attr.s(frozen=True)
 class Scenario(object):
     """
@@ -75,12 +98,7 @@ class Scenario(object):
             msg = "failed to read configuration file: {}".format(fn)
             raise FileNotFoundException(msg)
 
-        cfg = configparser.SafeConfigParser()
-        fn_cfg = os.path.join(os.path.dirname(__file__),
-                              'config/scenario.default.config')
-        cfg.read(fn_cfg)
-        cfg.read(fn)
-        return Scenario.from_config(fn, cfg)
+        return Scenario.from_config(fn, read_config(fn))
 
     @staticmethod
     def from_config(fn,  # type: str
@@ -90,9 +108,20 @@ class Scenario(object):
         Constructs a scenario description from a parsed configuration read from
         a given file.
         """
+        return Scenario.from_description(Scenario.describe(fn, cfg))
+
+    @staticmethod
+    def describe(fn,  # type: str
+                 cfg  # type: configparser.SafeConfigParser
+                 ):   # type: (...) -> Dict[str, Any]
+        """
+        Validates a parsed configuration read from a given file, and produces
+        a JSON-serialisable description of its scenario, from which the
+        scenario may later be constructed without reading the configuration
+        file. The mission and attack for the scenario are not loaded.
+        """
         dir_cfg = os.path.dirname(fn)
         dir_source = os.path.join(dir_cfg, cfg.get("General", "ardupilot"))
-        fn_mission = os.path.join(dir_cfg, cfg.get("Mission", "mission"))
         fn_diff = os.path.join(dir_cfg, cfg.get("General", "vulnerability"))
 
         revision = cfg.get("General", "revision")
@@ -105,11 +134,6 @@ class Scenario(object):
 
         fn_attack = cfg.get('Attack', 'attack')
         fn_attack = os.path.join(dir_cfg, fn_attack)
-        attack = Attack(script=fn_attack,
-                        flags=cfg.get('Attack', 'script_flags'),
-                        longitude=cfg.getfloat('Attack', 'longitude'),
-                        latitude=cfg.getfloat('Attack', 'latitude'),
-                        radius=cfg.getfloat('Attack', 'radius'))
 
         vehicle = cfg.get('General', 'vehicle')
         assert vehicle in ['APMrover2', 'ArduCopter', 'ArduPlane']
@@ -125,40 +149,124 @@ class Scenario(object):
 
         fn_mission = cfg.get('Mission', 'mission')
         fn_mission = os.path.join(dir_cfg, fn_mission)
-        mission = Mission.from_file(home, vehicle, fn_mission)
-
-        logging.debug("building SITL for scenario")
-        name_binary = ({
-            'APMrover2': 'ardurover',
-            'ArduCopter': 'arducopter',
-            'ArduPlane': 'arduplane'
-        })[vehicle]
         fn_harness = os.path.join(dir_source, 'Tools/autotest/sim_vehicle.py')
-        sitl = SITL(fn_harness, vehicle, home)
-        logging.debug("built SITL for scenario: %s", sitl)
 
         if not os.path.isfile(fn_diff):
             msg = "failed to locate vulnerability file: {}".format(fn_diff)
             raise FileNotFoundException(msg)
 
-        return Scenario(filename=fn,
-                        name=cfg.get('General', 'name'),
-                        directory=dir_cfg,
+        return {'filename': fn,
+                'name': cfg.get('General', 'name'),
+                'directory': dir_cfg,
+                'revision': revision,
+                'vehicle': vehicle,
+                'home': list(home),
+                'fn_harness': fn_harness,
+                'fn_mission': fn_mission,
+                'fn_diff': fn_diff,
+                'fn_attack': fn_attack,
+                'attack_flags': cfg.get('Attack', 'script_flags'),
+                'attack_longitude': cfg.getfloat('Attack', 'longitude'),
+                'attack_latitude': cfg.getfloat('Attack', 'latitude'),
+                'attack_radius': cfg.getfloat('Attack', 'radius')}
+
+    @staticmethod
+    def from_description(desc):  # type: (Dict[str, Any]) -> Scenario
+        """
+        Constructs a scenario from a description produced by `describe`,
+        loading its mission.
+        """
+        home = tuple(desc['home'])
+        vehicle = desc['vehicle']
+        attack = Attack(script=desc['fn_attack'],
+                        flags=desc['attack_flags'],
+                        longitude=desc['attack_longitude'],
+                        latitude=desc['attack_latitude'],
+                        radius=desc['attack_radius'])
+        mission = Mission.from_file(home, vehicle, desc['fn_mission'])
+
+        logging.debug("building SITL for scenario")
+        sitl = SITL(desc['fn_harness'], vehicle, home)
+        logging.debug("built SITL for scenario: %s", sitl)
+
+        return Scenario(filename=desc['filename'],
+                        name=desc['name'],
+                        directory=desc['directory'],
                         sitl=sitl,
                         mission=mission,
                         attack=attack,
-                        diff_fn=fn_diff,
-                        revision=revision)
+                        diff_fn=desc['fn_diff'],
+                        revision=desc['revision'])
+
+    @property
+    def waf_target(self):  # type: () -> str
+        """
+        The waf target that builds the SITL binary for this scenario.
+        """
+        return WAF_TARGETS[self.mission.vehicle]
+
+    def _prepare_in(self, dir_ctx):  # type: (str) -> None
+        """
+        Prepares the source code within a given build context, which holds a
+        copy of the ArduPilot repository, by checking out the revision for
+        this scenario and injecting its vulnerability.
+        """
+        cmd = ' && '.join([
+            'git checkout {}'.format(self.revision),
+            'git submodule update --init --recursive'
+        ])
+        logger.debug("preparing base version: %s", cmd)
+        subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
+        logger.debug("prepared base version")
+
+        logger.debug("injecting vulnerability: %s", cmd)
+        cmd = "patch -p1 -i '{}'".format(self.diff_fn)
+        subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
+        logger.debug("injected vulnerability")
+
+    def _build_in(self,
+                  dir_ctx,          # type: str
+                  filename_patch    # type: Optional[str]
+                  ):                # type: (...) -> None
+        """
+        Prepares the source code within a given build context, which holds a
+        copy of the ArduPilot repository, before optionally applying a patch,
+        and building its SITL binary.
+        """
+        self._prepare_in(dir_ctx)
+
+        if filename_patch:
+            cmd = "patch -p1 -i '{}'".format(filename_patch)
+            logger.debug("applying patch: %s", cmd)
+            subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
+            logger.debug("applied patch")
+
+        cmd = ' && '.join([
+            "./waf configure --no-submodule-update",
+            "./waf {}".format(self.waf_target)
+        ])
+        logger.debug("building binary: %s", cmd)
+        subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
+        logger.debug("built binary")
 
     @contextmanager
     def build(self,
               dir_ardupilot,        # type: str
-              filename_patch=None   # type: Optional[str]
+              filename_patch=None,  # type: Optional[str]
+              cache=None            # type: Optional[BuildCache]
               ):                    # type: (...) -> SITL
         """
         Copies the source code for this scenario to a temporary directory
         before optionally applying a patch, and building its SITL binary.
 
+        Parameters:
+            dir_ardupilot: the ArduPilot repository.
+            filename_patch: an optional patch that should be applied.
+            cache: an optional build cache. If the SITL for this scenario and
+                patch has already been built, the cached SITL will be
+                returned without building anything; otherwise, the SITL will
+                be built and added to the cache.
+
         Returns:
             a SITL object that provides access to the binary
         """
@@ -166,6 +274,22 @@ class Scenario(object):
         if filename_patch:
             logger.debug("applying patch: %s", filename_patch)
 
+        key = None  # type: Optional[str]
+        if cache:
+            key = BuildCache.key(self.revision,
+                                 self.diff_fn,
+                                 filename_patch,
+                                 self.mission.vehicle)
+            with cache.open(key) as dir_cached:
+                if dir_cached:
+                    logger.debug("using cached build: %s", dir_cached)
+                    fn_harness = os.path.join(dir_cached,
+                                              'Tools/autotest/sim_vehicle.py')
+                    yield SITL(fn_harness,
+                               self.mission.vehicle,
+                               self.mission.home)
+                    return
+
         dir_ctx = tempfile.mkdtemp()
         try:
             logger.debug("using temporary build context: %s", dir_ctx)
@@ -174,37 +298,9 @@ class Scenario(object):
             shutil.copytree(dir_ardupilot, dir_ctx, symlinks=True)
             logger.debug("copied files to build context")
 
-            cmd = ' && '.join([
-                'git checkout {}'.format(self.revision),
-                'git submodule update --init --recursive'
-            ])
-            logger.debug("preparing base version: %s", cmd)
-            subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
-            logger.debug("prepared base version")
-
-            logger.debug("injecting vulnerability: %s", cmd)
-            cmd = "patch -p1 -i '{}'".format(self.diff_fn)
-            subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
-            logger.debug("injected vulnerability")
-
-            if filename_patch:
-                cmd = "patch -p1 -i '{}'".format(filename_patch)
-                logger.debug("applying patch: %s", cmd)
-                subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
-                logger.debug("applied patch")
-
-            cmd = ({
-                'APMrover2': 'rover',
-                'ArduCopter': 'copter',
-                'ArduPlane': 'arduplane'
-            })[self.mission.vehicle]
-            cmd = ' && '.join([
-                "./waf configure --no-submodule-update",
-                "./waf {}".format(cmd)
-            ])
-            logger.debug("building binary: %s", cmd)
-            subprocess.check_call(cmd, shell=True, cwd=dir_ctx)
-            logger.debug("built binary")
+            self._build_in(dir_ctx, filename_patch)
+            if cache:
+                cache.store(key, dir_ctx, self.mission.vehicle)
 
             fn_harness = os.path.join(dir_ctx, 'Tools/autotest/sim_vehicle.py')
             sitl = SITL(fn_harness, self.mission.vehicle, self.mission.home)
@@ -213,3 +309,32 @@ class Scenario(object):
             logger.debug("destroying temporary build context: %s", dir_ctx)
             shutil.rmtree(dir_ctx, ignore_errors=True)
             logger.debug("destroyed temporary build context: %s", dir_ctx)
+
+    @contextmanager
+    def build_many(self,
+                   dir_ardupilot,       # type: str
+                   filenames_patches,   # type: Iterable[str]
+                   workers=None,        # type: Optional[int]
+                   cache=None           # type: Optional[BuildCache]
+                   ):                   # type: (...) -> Iterator[Iterator[BuildResult]]
+        """
+        Builds the SITL for each of a given set of patches to this scenario
+        in parallel. Rather than building each patch from scratch, the base
+        version of the scenario is checked out and built once, and each
+        patch is then incrementally built on top of it (see `BatchBuilder`).
+
+        Parameters:
+            dir_ardupilot: the ArduPilot repository.
+            filenames_patches: the patches that should be built.
+            workers: the number of patches that may be built at once.
+            cache: an optional build cache, used in the same way as `build`.
+
+        Returns:
+            an iterator over the result of building each patch, which
+            provides either a SITL or a build failure. Results are produced
+            as soon as each patch has been built, and the SITLs that they
+            provide may only be used within this context.
+        """
+        logger.debug("building patches for scenario: %s", self.name)
+        with BatchBuilder(self, dir_ardupilot, workers, cache) as builder:
+            yield builder.build(filenames_patches)
@@ -0,0 +1,234 @@
+"""
+This module is used to measure time from the perspective of the simulated
+vehicle, rather than the host. The SITL does not necessarily achieve the
+speed-up that it is asked for (e.g., when the host is oversubscribed), so
+simulation time is read from the boot time that the vehicle reports in its
+MAVLink messages. The rate at which simulation time passes is used to pick
+the highest speed-up that an instance can sustain.
+"""
+__all__ = ['SimulationClock', 'SpeedupController']
+
+from typing import Any, Optional
+from timeit import default_timer as timer
+import threading
+import logging
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+class SimulationClock(object):
+    """
+    Tracks the simulation time of a vehicle, and estimates the rate at which
+    simulation time passes relative to wall-clock time (i.e., the achieved
+    speed-up). Simulation time is measured from the first observation, and
+    continues to increase across reboots of the vehicle.
+    """
+    # the messages that carry the boot time of the vehicle
+    MESSAGES = ['SYSTEM_TIME', 'ATTITUDE', 'GLOBAL_POSITION_INT']
+
+    # boot times that go backwards by more than this number of milliseconds
+    # indicate a reboot rather than messages arriving out of order
+    REBOOT_THRESHOLD_MS = 1000
+
+    def __init__(self,
+                 rate=1.0,      # type: float
+                 smoothing=0.3, # type: float
+                 window=0.5     # type: float
+                 ):             # type: (...) -> None
+        """
+        Parameters:
+            rate: the expected speed-up, used until it can be measured.
+            smoothing: the weight given to each new measurement of the rate.
+            window: the minimum number of wall-clock seconds over which each
+                measurement of the rate is taken.
+        """
+        self.__lock = threading.Lock()
+        self.__rate = float(rate)
+        self.__smoothing = smoothing
+        self.__window = window
+        self.__conn = None
+        self.__last_boot_ms = None  # type: Optional[int]
+        self.__elapsed_ms = 0
+        self.__started_at = None  # type: Optional[float]
+        self.__sample_at = None  # type: Optional[float]
+        self.__sample_ms = 0
+        # the wall-clock time at which simulation time last advanced
+        self.__advanced_at = timer()
+
+    @property
+    def time(self):  # type: () -> Optional[float]
+        """
+        The number of simulated seconds that have passed since the first
+        observation, or None if nothing has been observed.
+        """
+        if self.__last_boot_ms is None:
+            return None
+        return self.__elapsed_ms / 1000.0
+
+    @property
+    def rate(self):  # type: () -> float
+        """
+        A smoothed estimate of the number of simulated seconds that currently
+        pass per wall-clock second.
+        """
+        return self.__rate
+
+    @property
+    def stalled_for(self):  # type: () -> float
+        """
+        The number of wall-clock seconds since simulation time last advanced
+        (or, if nothing has been observed, since this clock was created).
+        """
+        return max(0.0, timer() - self.__advanced_at)
+
+    @property
+    def average_rate(self):  # type: () -> Optional[float]
+        """
+        The mean number of simulated seconds that have passed per wall-clock
+        second since the first observation, or None if too little time has
+        passed to tell.
+        """
+        with self.__lock:
+            if self.__started_at is None:
+                return None
+            duration = timer() - self.__started_at
+            if duration < self.__window:
+                return None
+            return self.__elapsed_ms / 1000.0 / duration
+
+    def observe(self, time_boot_ms):  # type: (int) -> None
+        """
+        Records a boot time reported by the vehicle.
+        """
+        now = timer()
+        with self.__lock:
+            last = self.__last_boot_ms
+            if last is None:
+                self.__started_at = now
+                self.__sample_at = now
+            elif time_boot_ms > last:
+                self.__elapsed_ms += time_boot_ms - last
+            elif time_boot_ms < last - self.REBOOT_THRESHOLD_MS:
+                logger.debug("vehicle appears to have rebooted")
+                self.__elapsed_ms += time_boot_ms
+            else:
+                return
+            self.__last_boot_ms = time_boot_ms
+            self.__advanced_at = now
+
+            duration = now - self.__sample_at
+            if duration >= self.__window:
+                sample = (self.__elapsed_ms - self.__sample_ms) / 1000.0 / duration
+                self.__rate += self.__smoothing * (sample - self.__rate)
+                self.__sample_at = now
+                self.__sample_ms = self.__elapsed_ms
+
+    def on_message(self, message):  # type: (Any) -> None
+        """
+        Records the boot time carried by a given MAVLink message.
+        """
+        self.observe(message.time_boot_ms)
+
+    def attach(self, conn):  # type: (dronekit.Vehicle) -> None
+        """
+        Begins observing the boot time reported by a given vehicle.
+        """
+        self.__conn = conn
+        for name in self.MESSAGES:
+            conn.add_message_listener(name, self.__on_message)
+
+    def detach(self):  # type: () -> None
+        """
+        Stops observing the vehicle, if any, that this clock is attached to.
+        """
+        if self.__conn is None:
+            return
+        for name in self.MESSAGES:
+            self.__conn.remove_message_listener(name, self.__on_message)
+        self.__conn = None
+
+    def __on_message(self, vehicle, name, message):
+        self.on_message(message)
+
+
+class SpeedupController(object):
+    """
+    Picks the highest speed-up that a SITL instance can sustain under the
+    current load on its host. After each test, the controller is told the
+    speed-up that was requested and the speed-up that was achieved; it
+    increases the speed-up for as long as the achieved speed-up keeps up with
+    the requested one, and falls back to the achieved speed-up when it
+    doesn't. Since simulation-time deadlines make verdicts independent of the
+    achieved speed-up, running too fast only costs throughput.
+
+    A controller may be shared by concurrent tests on the same host.
+    """
+    def __init__(self,
+                 initial=1,         # type: int
+                 minimum=1,         # type: int
+                 maximum=50,        # type: int
+                 step=1,            # type: int
+                 efficiency=0.8,    # type: float
+                 patience=5         # type: int
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            initial: the speed-up that should be used for the first test.
+            minimum: the lowest speed-up that may be used.
+            maximum: the highest speed-up that may be used.
+            step: the amount by which the speed-up is increased after a test
+                that kept up with its requested speed-up.
+            efficiency: the fraction of the requested speed-up that must be
+                achieved for the requested speed-up to be sustainable.
+            patience: the number of consecutive sustained tests after which
+                a speed-up that previously couldn't be sustained is retried.
+        """
+        assert minimum >= 1
+        assert minimum <= initial <= maximum
+        self.__lock = threading.Lock()
+        self.__speedup = initial
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__step = step
+        self.__efficiency = efficiency
+        self.__patience = patience
+        self.__ceiling = None  # type: Optional[int]
+        self.__sustained = 0
+
+    @property
+    def speedup(self):  # type: () -> int
+        """
+        The speed-up that should be used for the next test.
+        """
+        return self.__speedup
+
+    def record(self,
+               requested,   # type: int
+               achieved     # type: Optional[float]
+               ):           # type: (...) -> None
+        """
+        Records the speed-up that was achieved by a test that requested a
+        given speed-up. Tests whose achieved speed-up is unknown are ignored.
+        """
+        if achieved is None:
+            return
+        with self.__lock:
+            old = self.__speedup
+            if achieved < self.__efficiency * requested:
+                self.__ceiling = requested
+                self.__sustained = 0
+                self.__speedup = max(self.__minimum,
+                                     min(old, int(achieved)))
+            elif requested >= old:
+                self.__sustained += 1
+                if self.__ceiling is not None and \
+                   self.__sustained >= self.__patience:
+                    self.__ceiling = None
+                limit = self.__maximum
+                if self.__ceiling is not None:
+                    limit = min(limit, self.__ceiling - 1)
+                self.__speedup = max(old, min(limit, old + self.__step))
+        if self.__speedup != old:
+            logger.debug("changed speed-up from %d to %d (requested: %d, achieved: %.2f)",
+                         old, self.__speedup, requested, achieved)
@@ -4,10 +4,13 @@ SITL for the ArduPilot.
 """
 __all__ = ['SITL']
 
-from typing import Tuple
+from typing import List, Optional, Tuple
 import subprocess
 import os
+import shlex
+import shutil
 import signal
+import tempfile
 import contextlib
 import logging
 
@@ -17,24 +20,92 @@ import configparser
 from .mission import Mission
 from .exceptions import FileNotFoundException
 from .helper import DEVNULL
+from .ports import Ports
+from .outcome import Timings
+from .router import Endpoint, MAVLinkRouter
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
 
+# the name of the SITL binary that is built for each vehicle
+BINARY_NAMES = {
+    'APMrover2': 'ardurover',
+    'ArduCopter': 'arducopter',
+    'ArduPlane': 'arduplane'
+}
+
+# the simulation model and default parameters that sim_vehicle.py uses for
+# the default frame of each vehicle
+MODELS = {
+    'APMrover2': 'rover',
+    'ArduCopter': '+',
+    'ArduPlane': 'plane'
+}
+DEFAULT_PARAMS = {
+    'APMrover2': 'rover.parm',
+    'ArduCopter': 'copter.parm',
+    'ArduPlane': 'plane.parm'
+}
+
+
 @attr.s(frozen=True)
 class SITL(object):
     fn_harness = attr.ib(type=str)
     vehicle = attr.ib(type=str)
     home = attr.ib(type=Tuple[float, float, float, float])
+    instance = attr.ib(type=int, default=0)
+
+    @property
+    def dir_source(self):  # type: () -> str
+        """
+        The root of the ArduPilot source tree (or build bundle) for this SITL.
+        """
+        dir_harness = os.path.dirname(os.path.abspath(self.fn_harness))
+        return os.path.dirname(os.path.dirname(dir_harness))
+
+    @property
+    def binary(self):  # type: () -> str
+        """
+        The location of the built SITL binary.
+        """
+        return os.path.join(self.dir_source, 'build/sitl/bin',
+                            BINARY_NAMES[self.vehicle])
+
+    @property
+    def fn_defaults(self):  # type: () -> str
+        """
+        The location of the default parameters for the simulated vehicle.
+        """
+        return os.path.join(self.dir_source, 'Tools/autotest/default_params',
+                            DEFAULT_PARAMS[self.vehicle])
+
+    @property
+    def ports(self):  # type: () -> Ports
+        return Ports(self.instance)
 
     @property
     def url(self):  # type: () -> str
-        return 'udp:127.0.0.1:14550'
+        return 'udp:127.0.0.1:{}'.format(self.ports.harness)
+
+    @property
+    def url_attacker(self):  # type: () -> str
+        return 'udp:127.0.0.1:{}'.format(self.ports.attacker)
+
+    @property
+    def endpoints(self):  # type: () -> List[Endpoint]
+        """
+        The endpoints to which MAVLink messages from this SITL are forwarded
+        when it is launched without MAVProxy.
+        """
+        ports = self.ports
+        addresses = [ports.harness, ports.attacker] + list(ports.outputs)
+        return [Endpoint('127.0.0.1', port) for port in addresses]
 
     def command(self,
                 prefix=None,    # type: Optional[str]
-                speedup=1       # type: int
+                speedup=1,      # type: int
+                mavproxy=True   # type: bool
                 ):              # type: (...) -> str
         """
         Computes the command that should be used to launch the SITL.
@@ -43,40 +114,193 @@ class SITL(object):
             prefix: an optional prefix that should be attached to the command.
             speedup: the speedup factor that should be applied to the simulator
                 clock.
+            mavproxy: if False, the SITL is launched without MAVProxy.
         """
         if prefix is None:
             prefix = ''
+        if mavproxy:
+            # don't attach to STDIN!
+            mavproxy_args = ['--daemon']
+            for port in self.ports.outputs:
+                mavproxy_args += ['--out', '127.0.0.1:{}'.format(port)]
+            mavproxy_opt = "--mavproxy-args '{}'".format(' '.join(mavproxy_args))
+        else:
+            mavproxy_opt = "--no-mavproxy"
         cmd = [
             prefix,
-            self.fn_harness,
-            "--mavproxy-args '--daemon --out 127.0.0.1:14552 --out 127.0.0.1:14553'", # don't attach to STDIN!
+            os.path.abspath(self.fn_harness),
+            mavproxy_opt,
             "-l", "{},{},{},{}".format(*self.home),
             "-v", self.vehicle,
+            "-I", str(self.instance),
             "-w",
             "--speedup={}".format(speedup),
             "--no-rebuild "
         ]
         return ' '.join(cmd).lstrip()
 
+    def binary_command(self,
+                       prefix=None, # type: Optional[str]
+                       speedup=1    # type: int
+                       ):           # type: (...) -> List[str]
+        """
+        Computes the arguments that should be used to launch the SITL binary
+        directly, without going through sim_vehicle.py. The binary serves
+        MAVLink on the TCP port for its instance.
+
+        Parameters:
+            prefix: an optional prefix that should be attached to the command.
+            speedup: the speedup factor that should be applied to the simulator
+                clock.
+
+        Raises:
+            FileNotFoundException: if the SITL binary has not been built.
+        """
+        if not os.path.isfile(self.binary):
+            msg = "failed to locate SITL binary: {}".format(self.binary)
+            raise FileNotFoundException(msg)
+        args = shlex.split(prefix) if prefix else []
+        args += [
+            self.binary,
+            "-S",
+            "-I{}".format(self.instance),
+            "-w",
+            "--home", "{},{},{},{}".format(*self.home),
+            "--model", MODELS[self.vehicle],
+            "--speedup", str(speedup),
+            "--defaults", self.fn_defaults
+        ]
+        return args
+
+    def connect(self,
+                timeout=10,         # type: int
+                timings=None,       # type: Optional[Timings]
+                lightweight=False   # type: bool
+                ):                  # type: (...) -> dronekit.Vehicle
+        """
+        Connects to the vehicle simulated by this SITL, and blocks until the
+        vehicle is ready.
+
+        Parameters:
+            timeout: the number of seconds to wait for the vehicle to respond
+                and to become ready.
+            timings: an optional record to which the time taken to connect
+                and to wait for the vehicle to be ready should be added.
+            lightweight: if True, a `MAVLinkClient` is used in place of a
+                Dronekit vehicle. The client is ready as soon as the position
+                of the vehicle is known, rather than once all of its
+                parameters have been downloaded.
+        """
+        if timings is None:
+            timings = Timings()
+        if lightweight:
+            return self.__connect_lightweight(timeout, timings)
+        # NOTE dronekit is broken!
+        #      it always tries to connect to 127.0.0.1:5760
+        import dronekit
+        logger.debug("trying to connect to vehicle [%s]", self.url)
+        with timings.phase('connect'):
+            vehicle = dronekit.connect(self.url,
+                                       wait_ready=False,
+                                       heartbeat_timeout=timeout)
+        logger.debug("established connection with vehicle.")
+        logger.debug("waiting for vehicle to be ready.")
+        try:
+            with timings.phase('wait_ready'):
+                vehicle.wait_ready(True, timeout=timeout)
+        except Exception:
+            vehicle.close()
+            raise
+        logger.debug("vehicle is ready for mission.")
+        return vehicle
+
+    def __connect_lightweight(self,
+                              timeout,  # type: int
+                              timings   # type: Timings
+                              ):        # type: (...) -> MAVLinkClient
+        from .client import MAVLinkClient
+        logger.debug("trying to connect to vehicle [%s] via lightweight client",
+                     self.url)
+        with timings.phase('connect'):
+            vehicle = MAVLinkClient(self.url, heartbeat_timeout=timeout)
+        logger.debug("established connection with vehicle.")
+        try:
+            with timings.phase('wait_ready'):
+                vehicle.wait_ready(timeout=timeout)
+        except Exception:
+            vehicle.close()
+            raise
+        logger.debug("vehicle is ready for mission.")
+        return vehicle
+
     @contextlib.contextmanager
     def launch(self,
-               prefix=None, # type: Optional[str]
-               speedup=1    # type: int
-               ):           # type: (...) -> None
-        command = self.command(prefix, speedup)
+               prefix=None,             # type: Optional[str]
+               speedup=1,               # type: int
+               mavproxy=True,           # type: bool
+               endpoints=None,          # type: Optional[List[Endpoint]]
+               direct=False,            # type: bool
+               timeout_connection=10    # type: float
+               ):                       # type: (...) -> None
+        """
+        Launches the SITL for the duration of the context.
+
+        Parameters:
+            prefix: an optional prefix that should be attached to the command.
+            speedup: the speedup factor that should be applied to the simulator
+                clock.
+            mavproxy: if False, the SITL is launched without MAVProxy, and
+                its messages are instead forwarded by an in-process
+                `MAVLinkRouter`.
+            endpoints: the endpoints to which the router should forward
+                messages. Defaults to `endpoints`. Ignored if MAVProxy is
+                used.
+            direct: if True, the SITL binary is launched directly rather
+                than through sim_vehicle.py, which avoids starting a Python
+                interpreter (and MAVProxy) for each launch. Since MAVProxy
+                is never used in this mode, `mavproxy` is ignored.
+            timeout_connection: the number of seconds to wait for the router
+                to connect to the SITL. Ignored if MAVProxy is used.
+
+        Raises:
+            TimeoutException: if the router failed to connect to the SITL
+                within the given number of seconds.
+        """
+        if direct:
+            mavproxy = False
+            command = self.binary_command(prefix, speedup)
+        else:
+            command = self.command(prefix, speedup, mavproxy)
         process = None  # type: Optional[subprocess.Popen]
+        router = None  # type: Optional[MAVLinkRouter]
+        # each instance writes its EEPROM and logs to its working directory,
+        # so concurrent instances must not share one
+        dir_run = tempfile.mkdtemp(prefix='sitl')
         try:
             logger.debug("launching SITL via command: %s", command)
             process = subprocess.Popen(command,
-                                       shell=True,
+                                       shell=not direct,
+                                       cwd=dir_run,
                                        stdin=DEVNULL,
                                        stdout=DEVNULL,
                                        stderr=DEVNULL,
                                        preexec_fn=os.setsid)
             logger.debug("launched SITL")
+            if not mavproxy:
+                if endpoints is None:
+                    endpoints = self.endpoints
+                router = MAVLinkRouter(('127.0.0.1', self.ports.sitl),
+                                       endpoints)
+                router.start()
+                logger.debug("waiting for router to connect to SITL")
+                router.wait_connected(timeout_connection)
+                logger.debug("router connected to SITL")
             yield
         finally:
+            if router:
+                router.stop()
             if process:
                 logger.debug("sending SIGTERM to SITL process [%d]", process.pid)
                 os.killpg(process.pid, signal.SIGTERM)
                 logger.debug("sent SIGTERM to SITL process [%d]", process.pid)
+            shutil.rmtree(dir_run, ignore_errors=True)
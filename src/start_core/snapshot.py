@@ -0,0 +1,336 @@
+"""
+This module is used to skip the boot of the SITL, and the wait for its
+vehicle to become armable (i.e., for its EKF to converge and its GPS to
+lock), when a test is executed. A freshly booted SITL is launched once for
+each binary, home location, instance and speed-up; once its vehicle is
+armable, the process is checkpointed with CRIU. Each test then restores
+the SITL from that checkpoint rather than booting it from scratch.
+
+CRIU restores processes with their original PIDs, and so two restorations
+of the same snapshot cannot be alive at once. Since each snapshot belongs to
+a single SITL instance (whose ports are reserved for one test at a time),
+this does not restrict concurrency between instances.
+"""
+__all__ = ['Snapshot', 'SnapshotStore']
+
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import errno
+import json
+import shutil
+import signal
+import hashlib
+import tempfile
+import threading
+import time
+import subprocess
+import contextlib
+import logging
+
+import attr
+
+from .sitl import SITL
+from .router import MAVLinkRouter
+from .helper import DEVNULL
+from .deadline import Deadline
+from .exceptions import SnapshotException, TimeoutException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+@attr.s(frozen=True)
+class Snapshot(object):
+    """
+    Describes a checkpoint of an armable SITL.
+    """
+    # the directory that holds the CRIU images
+    dir_images = attr.ib(type=str)
+    # a pristine copy of the working directory (i.e., EEPROM and logs) of
+    # the SITL at the time of the checkpoint
+    dir_pristine = attr.ib(type=str)
+    # the working directory of the SITL, which must be at the same location
+    # whenever the SITL is restored
+    dir_run = attr.ib(type=str)
+    pid = attr.ib(type=int)
+
+
+class SnapshotStore(object):
+    """
+    Captures and restores snapshots of armable SITLs. Snapshots are captured
+    on demand, upon the first restoration of a given SITL, and are kept on
+    disk until the store is cleared. Thread-safe.
+    """
+    def __init__(self,
+                 directory=None,        # type: Optional[str]
+                 criu='criu',           # type: str
+                 timeout_armable=120    # type: float
+                 ):                     # type: (...) -> None
+        """
+        Parameters:
+            directory: the directory in which snapshots should be stored. If
+                unspecified, a temporary directory is used.
+            criu: the CRIU executable.
+            timeout_armable: the number of seconds to wait for a freshly
+                booted SITL to become armable before giving up on capturing
+                its snapshot.
+
+        Raises:
+            SnapshotException: if CRIU is not available on this machine.
+        """
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='start-snapshots')
+        self.__directory = os.path.abspath(directory)
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+        self.__criu = criu
+        self.__timeout_armable = timeout_armable
+        self.__lock = threading.Lock()
+        self.__snapshots = {}  # type: Dict[str, Snapshot]
+        # a lock for each key, so that a snapshot is only captured once, and
+        # the capture of one snapshot doesn't block the restoration of others
+        self.__key_locks = {}  # type: Dict[str, threading.Lock]
+        # binary hashes, indexed by (filename, inode, size, mtime)
+        self.__binary_hashes = {}  # type: Dict[Tuple[str, int, int, float], str]
+        self.__check()
+
+    @property
+    def directory(self):  # type: () -> str
+        return self.__directory
+
+    def __check(self):  # type: () -> None
+        try:
+            code = subprocess.call([self.__criu, 'check'],
+                                   stdout=DEVNULL,
+                                   stderr=DEVNULL)
+        except OSError:
+            msg = "failed to find CRIU executable: {}".format(self.__criu)
+            raise SnapshotException(msg)
+        if code != 0:
+            msg = "CRIU is unable to checkpoint processes on this machine"
+            raise SnapshotException(msg)
+
+    def __hash_binary(self, fn):  # type: (str) -> str
+        """
+        Computes the hash of a given binary. Hashes are memoized until the
+        binary is modified.
+        """
+        stat = os.stat(fn)
+        stamp = (fn, stat.st_ino, stat.st_size, stat.st_mtime)
+        with self.__lock:
+            digest = self.__binary_hashes.get(stamp)
+        if digest is None:
+            logger.debug("hashing SITL binary: %s", fn)
+            h = hashlib.sha256()
+            with open(fn, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            digest = h.hexdigest()
+            with self.__lock:
+                self.__binary_hashes[stamp] = digest
+        return digest
+
+    def key(self,
+            sitl,       # type: SITL
+            speedup     # type: int
+            ):          # type: (...) -> str
+        """
+        Computes the key for the snapshot of a given SITL from the contents
+        of its binary and the arguments with which it is launched.
+        """
+        args = [self.__hash_binary(sitl.binary),
+                sitl.vehicle, list(sitl.home), sitl.instance, speedup]
+        encoded = json.dumps(args).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def snapshot(self,
+                 sitl,      # type: SITL
+                 speedup    # type: int
+                 ):         # type: (...) -> Snapshot
+        """
+        Returns the snapshot for a given SITL, capturing it if necessary.
+
+        Raises:
+            SnapshotException: if the snapshot could not be captured.
+        """
+        key = self.key(sitl, speedup)
+        with self.__lock:
+            lock = self.__key_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self.__lock:
+                snapshot = self.__snapshots.get(key)
+            if snapshot is None:
+                snapshot = self.__capture(key, sitl, speedup)
+                with self.__lock:
+                    self.__snapshots[key] = snapshot
+            return snapshot
+
+    def clear(self):  # type: () -> None
+        """
+        Destroys all snapshots held by this store.
+        """
+        with self.__lock:
+            snapshots = list(self.__snapshots.values())
+            self.__snapshots = {}
+        for snapshot in snapshots:
+            shutil.rmtree(os.path.dirname(snapshot.dir_images),
+                          ignore_errors=True)
+
+    def __capture(self,
+                  key,      # type: str
+                  sitl,     # type: SITL
+                  speedup   # type: int
+                  ):        # type: (...) -> Snapshot
+        from .client import MAVLinkClient
+
+        dir_snapshot = os.path.join(self.__directory, key)
+        shutil.rmtree(dir_snapshot, ignore_errors=True)
+        snapshot = Snapshot(dir_images=os.path.join(dir_snapshot, 'images'),
+                            dir_pristine=os.path.join(dir_snapshot, 'pristine'),
+                            dir_run=os.path.join(dir_snapshot, 'run'),
+                            pid=0)
+        os.makedirs(snapshot.dir_images)
+        os.makedirs(snapshot.dir_run)
+
+        command = sitl.binary_command(None, speedup)
+        logger.debug("launching SITL for snapshot via command: %s", command)
+        process = subprocess.Popen(command,
+                                   cwd=snapshot.dir_run,
+                                   stdin=DEVNULL,
+                                   stdout=DEVNULL,
+                                   stderr=DEVNULL,
+                                   preexec_fn=os.setsid)
+        dumped = False
+        try:
+            deadline = Deadline(self.__timeout_armable)
+            with MAVLinkRouter(('127.0.0.1', sitl.ports.sitl), sitl.endpoints):
+                client = MAVLinkClient(sitl.url,
+                                       heartbeat_timeout=deadline.remaining)
+                try:
+                    client.wait_ready(timeout=deadline.remaining)
+                    logger.debug("waiting for vehicle to become armable")
+                    while not client.is_armable:
+                        deadline.sleep(0.1)
+                finally:
+                    client.close()
+
+            # the router has closed its connection, and so the SITL only
+            # holds its listening socket
+            logger.debug("checkpointing SITL process [%d]", process.pid)
+            self.__criu_call(['dump',
+                              '--tree', str(process.pid),
+                              '--images-dir', snapshot.dir_images,
+                              '--tcp-established'])
+            dumped = True
+            process.wait()
+            shutil.copytree(snapshot.dir_run, snapshot.dir_pristine)
+        except TimeoutException:
+            msg = "SITL failed to become armable within {} seconds"
+            msg = msg.format(self.__timeout_armable)
+            raise SnapshotException(msg)
+        finally:
+            if not dumped:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait()
+                shutil.rmtree(dir_snapshot, ignore_errors=True)
+        logger.debug("captured snapshot of SITL: %s", dir_snapshot)
+        return attr.evolve(snapshot, pid=process.pid)
+
+    def __criu_call(self, args):  # type: (List[str]) -> None
+        command = [self.__criu] + args
+        logger.debug("calling CRIU: %s", ' '.join(command))
+        try:
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as err:
+            msg = "CRIU failed (exit code {}): {}"
+            msg = msg.format(err.returncode, err.output)
+            raise SnapshotException(msg)
+
+    @contextlib.contextmanager
+    def restore(self,
+                sitl,       # type: SITL
+                speedup=1   # type: int
+                ):          # type: (...) -> Iterator[None]
+        """
+        Restores a given SITL from its snapshot for the duration of the
+        context, and forwards its messages to its endpoints. The snapshot is
+        captured first if necessary.
+
+        Raises:
+            SnapshotException: if the snapshot could not be captured or
+                restored.
+        """
+        snapshot = self.snapshot(sitl, speedup)
+        shutil.rmtree(snapshot.dir_run, ignore_errors=True)
+        shutil.copytree(snapshot.dir_pristine, snapshot.dir_run)
+        logger.debug("restoring SITL from snapshot [%d]", snapshot.pid)
+        self.__criu_call(['restore',
+                          '--restore-detached',
+                          '--images-dir', snapshot.dir_images,
+                          '--tcp-close'])
+        try:
+            with MAVLinkRouter(('127.0.0.1', sitl.ports.sitl), sitl.endpoints):
+                yield
+        finally:
+            logger.debug("sending SIGTERM to restored SITL process [%d]",
+                         snapshot.pid)
+            try:
+                os.killpg(snapshot.pid, signal.SIGTERM)
+            except OSError:
+                logger.exception("failed to kill restored SITL process [%d]",
+                                 snapshot.pid)
+            # the PID must be free before the snapshot is restored again
+            _wait_for_exit(snapshot.pid)
+
+
+def _wait_for_exit(pid, timeout=5.0):  # type: (int, float) -> None
+    """
+    Blocks until a given process, which needn't be a child of this process,
+    has exited, or kills it if it outlives a given number of seconds. If the
+    process is a child of this process (e.g., because this process is PID 1
+    and has inherited it), it is reaped once it has exited.
+
+    Raises:
+        SnapshotException: if the process is still alive once the given
+            number of seconds have passed since it was killed.
+    """
+    killed = False
+    deadline = Deadline(timeout)
+    while True:
+        if not _is_alive(pid):
+            return
+        if deadline.expired:
+            if killed:
+                raise SnapshotException(
+                    "restored SITL process [{}] failed to exit".format(pid))
+            logger.debug("killing restored SITL process [%d]", pid)
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError as err:
+                if err.errno != errno.ESRCH:
+                    raise
+            killed = True
+            deadline = Deadline(timeout)
+        time.sleep(0.05)
+
+
+def _is_alive(pid):  # type: (int) -> bool
+    """
+    Determines whether a given process is alive, reaping it if it is a
+    child of this process that has exited.
+    """
+    try:
+        (reaped, _) = os.waitpid(pid, os.WNOHANG)
+        if reaped == pid:
+            return False
+    except OSError as err:
+        # the process isn't a child of this process
+        if err.errno != errno.ECHILD:
+            raise
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        if err.errno == errno.ESRCH:
+            return False
+        raise
+    return True
@@ -0,0 +1,257 @@
+"""
+This module provides a recorder that captures the telemetry produced by a
+vehicle during a single mission execution, and a compact, columnar on-disk
+format for the recorded traces.
+
+A trace file begins with a single line containing a JSON header, padded with
+spaces so that the data that follows it is aligned to 64 bytes. The header
+describes each recorded stream: its columns, its number of rows, and the
+offset (relative to the start of the file) of its data. The data for each
+stream is stored column by column as little-endian 64-bit floats, allowing
+each column to be mapped directly into memory (e.g., via `numpy.memmap`)
+without being copied or parsed.
+"""
+__all__ = ['TelemetryRecorder', 'read_header', 'load']
+
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from timeit import default_timer as timer
+import collections
+import array
+import json
+import sys
+import logging
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+MAGIC = 'STARTTLM'
+VERSION = 1
+ALIGNMENT = 64
+
+# the columns that are recorded for each (rate-limited) MAVLink message
+STREAMS = {
+    'GLOBAL_POSITION_INT': ['time', 'time_boot_ms', 'lat', 'lon', 'alt',
+                            'relative_alt', 'vx', 'vy', 'vz', 'hdg'],
+    'ATTITUDE': ['time', 'time_boot_ms', 'roll', 'pitch', 'yaw',
+                 'rollspeed', 'pitchspeed', 'yawspeed'],
+    'HEARTBEAT': ['time', 'base_mode', 'custom_mode', 'system_status']
+}  # type: Dict[str, List[str]]
+
+
+def _position_row(t, m):  # type: (float, Any) -> Tuple[float, ...]
+    return (t, m.time_boot_ms, m.lat / 1.0e7, m.lon / 1.0e7, m.alt / 1000.0,
+            m.relative_alt / 1000.0, m.vx / 100.0, m.vy / 100.0,
+            m.vz / 100.0, m.hdg / 100.0)
+
+
+def _attitude_row(t, m):  # type: (float, Any) -> Tuple[float, ...]
+    return (t, m.time_boot_ms, m.roll, m.pitch, m.yaw,
+            m.rollspeed, m.pitchspeed, m.yawspeed)
+
+
+def _heartbeat_row(t, m):  # type: (float, Any) -> Tuple[float, ...]
+    return (t, m.base_mode, m.custom_mode, m.system_status)
+
+
+ROWS = {
+    'GLOBAL_POSITION_INT': _position_row,
+    'ATTITUDE': _attitude_row,
+    'HEARTBEAT': _heartbeat_row
+}
+
+
+class _RingBuffer(object):
+    """
+    A preallocated, fixed-capacity buffer of rows, stored column by column.
+    Once full, each new row overwrites the oldest row.
+    """
+    def __init__(self, columns, capacity):  # type: (List[str], int) -> None
+        self.columns = columns
+        self.capacity = capacity
+        self.__data = [array.array('d', [0.0]) * capacity for _ in columns]
+        self.__next = 0
+        self.__size = 0
+
+    def __len__(self):  # type: () -> int
+        return self.__size
+
+    def append(self, row):  # type: (Tuple[float, ...]) -> None
+        i = self.__next
+        for (column, value) in zip(self.__data, row):
+            column[i] = value
+        self.__next = (i + 1) % self.capacity
+        self.__size = min(self.__size + 1, self.capacity)
+
+    def column(self, i):  # type: (int) -> array.array
+        """
+        Returns the contents of a given column, from oldest to newest.
+        """
+        data = self.__data[i]
+        if self.__size < self.capacity:
+            return data[:self.__size]
+        return data[self.__next:] + data[:self.__next]
+
+
+class TelemetryRecorder(object):
+    """
+    Records GLOBAL_POSITION_INT, ATTITUDE, HEARTBEAT and STATUSTEXT messages
+    from a vehicle into bounded ring buffers. Positions and attitudes are
+    recorded at no more than a given rate; heartbeats and status texts are
+    always recorded.
+    """
+    def __init__(self,
+                 rate=10.0,         # type: float
+                 capacity=36000     # type: int
+                 ):                 # type: (...) -> None
+        """
+        Parameters:
+            rate: the maximum number of rows that should be recorded per
+                second for each of the position and attitude streams.
+            capacity: the maximum number of rows that should be kept for each
+                stream. Once full, the oldest rows are discarded.
+        """
+        self.__interval = 1.0 / rate if rate > 0 else 0.0
+        self.__buffers = {name: _RingBuffer(columns, capacity)
+                          for (name, columns) in STREAMS.items()}
+        self.__last = {name: None for name in STREAMS
+                       }  # type: Dict[str, Optional[float]]
+        self.__texts = collections.deque(maxlen=capacity
+                                         )  # type: Deque[Tuple[float, int, str]]
+        self.__conn = None
+        self.__started_at = None  # type: Optional[float]
+
+    def __len__(self):  # type: () -> int
+        """
+        The total number of rows that are held by this recorder.
+        """
+        return sum(len(b) for b in self.__buffers.values()) + \
+            len(self.__texts)
+
+    def __on_message(self, _, name, message):
+        t = timer() - self.__started_at
+        if name == 'STATUSTEXT':
+            self.__texts.append((t, message.severity, message.text))
+            return
+
+        last = self.__last[name]
+        if name != 'HEARTBEAT' and last is not None and \
+           t - last < self.__interval:
+            return
+        self.__last[name] = t
+        self.__buffers[name].append(ROWS[name](t, message))
+
+    def attach(self, conn):  # type: (dronekit.Vehicle) -> None
+        """
+        Begins recording the telemetry produced by a given vehicle.
+        """
+        assert self.__conn is None
+        logger.debug("attaching telemetry recorder")
+        if self.__started_at is None:
+            self.__started_at = timer()
+        self.__conn = conn
+        for name in list(STREAMS) + ['STATUSTEXT']:
+            conn.add_message_listener(name, self.__on_message)
+        logger.debug("attached telemetry recorder")
+
+    def detach(self):  # type: () -> None
+        """
+        Stops recording telemetry.
+        """
+        if self.__conn is None:
+            return
+        logger.debug("detaching telemetry recorder")
+        for name in list(STREAMS) + ['STATUSTEXT']:
+            self.__conn.remove_message_listener(name, self.__on_message)
+        self.__conn = None
+        logger.debug("detached telemetry recorder")
+
+    def save(self,
+             fn,            # type: str
+             metadata=None  # type: Optional[Dict[str, Any]]
+             ):             # type: (...) -> None
+        """
+        Writes the recorded telemetry to a given file. Should only be called
+        once the recorder has been detached.
+
+        Parameters:
+            metadata: optional, JSON-serialisable information that should be
+                stored alongside the trace (e.g., the mission and outcome).
+        """
+        columns = []  # type: List[array.array]
+        streams = {}  # type: Dict[str, Dict[str, Any]]
+        offset = 0
+        for name in sorted(self.__buffers):
+            buff = self.__buffers[name]
+            streams[name] = {'columns': buff.columns,
+                             'length': len(buff),
+                             'offset': offset}
+            for i in range(len(buff.columns)):
+                column = buff.column(i)
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns.append(column)
+                offset += len(column) * column.itemsize
+
+        header = {'magic': MAGIC,
+                  'version': VERSION,
+                  'streams': streams,
+                  'statustext': list(self.__texts),
+                  'metadata': metadata or {}}
+
+        # the offsets within the header depend upon the size of the header
+        offsets = {name: s['offset'] for (name, s) in streams.items()}
+        size_header = ALIGNMENT
+        while True:
+            for (name, stream) in streams.items():
+                stream['offset'] = offsets[name] + size_header
+            line = json.dumps(header, sort_keys=True).encode('utf-8')
+            if len(line) < size_header:
+                break
+            size_header = (len(line) // ALIGNMENT + 1) * ALIGNMENT
+        line = line.ljust(size_header - 1) + b'\n'
+
+        logger.debug("writing telemetry trace to file: %s", fn)
+        with open(fn, 'wb') as f:
+            f.write(line)
+            for column in columns:
+                column.tofile(f)
+        logger.debug("wrote telemetry trace to file: %s", fn)
+
+
+def read_header(fn):  # type: (str) -> Dict[str, Any]
+    """
+    Reads the header of a given telemetry trace file.
+    """
+    with open(fn, 'rb') as f:
+        header = json.loads(f.readline().decode('utf-8'))
+    if header.get('magic') != MAGIC:
+        raise ValueError("not a telemetry trace file: {}".format(fn))
+    return header
+
+
+def load(fn):  # type: (str) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]
+    """
+    Maps the columns of a given telemetry trace file into memory without
+    copying them. Requires NumPy.
+
+    Returns:
+        a tuple of the form `(streams, header)`, where `streams` maps the
+        name of each stream to a dictionary of read-only `numpy.memmap`
+        columns.
+    """
+    import numpy
+    header = read_header(fn)
+    streams = {}  # type: Dict[str, Dict[str, Any]]
+    for (name, stream) in header['streams'].items():
+        length = stream['length']
+        columns = {}
+        for (i, column) in enumerate(stream['columns']):
+            offset = stream['offset'] + i * length * 8
+            if length == 0:
+                columns[column] = numpy.zeros(0, dtype='<f8')
+            else:
+                columns[column] = numpy.memmap(fn, dtype='<f8', mode='r',
+                                               offset=offset,
+                                               shape=(length,))
+        streams[name] = columns
+    return (streams, header)
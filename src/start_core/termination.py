@@ -0,0 +1,441 @@
+"""
+This module is used to abort mission executions as soon as their outcome is
+decided, rather than waiting for the mission to time out. While a mission is
+executed, the live state of the vehicle is periodically checked against a
+set of termination rules. If any rule decides that the mission can no longer
+succeed, the execution is aborted, and that rule's reason becomes the reason
+for the failure.
+
+Rules are stateful, and so a fresh set of rules should be used for each
+execution (see `default_rules`).
+"""
+__all__ = ['VehicleState', 'TerminationRule', 'DisarmedRule', 'ModeRule',
+           'StallRule', 'DeviationRule', 'AttackRule', 'Monitor',
+           'default_rules']
+
+from typing import Callable, List, Optional, Tuple
+import math
+import logging
+
+import attr
+
+from .helper import Location, distance
+from .protocol import GLOBAL_FRAMES
+from .exceptions import AttackServerException
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+# commands whose first parameter is a number of seconds for which the
+# vehicle may stay in place
+MAV_CMD_NAV_LOITER_UNLIM = 17
+MAV_CMD_NAV_LOITER_TIME = 19
+MAV_CMD_NAV_DELAY = 93
+MAV_CMD_CONDITION_DELAY = 112
+DELAY_COMMANDS = [MAV_CMD_NAV_LOITER_TIME, MAV_CMD_NAV_DELAY,
+                  MAV_CMD_CONDITION_DELAY]
+
+
+@attr.s(frozen=True)
+class VehicleState(object):
+    """
+    Describes the live state of a vehicle during a mission execution.
+    """
+    # the number of simulated seconds since the mission was started
+    time = attr.ib(type=float)
+    mode = attr.ib(type=str)
+    armed = attr.ib(type=bool)
+    position = attr.ib(type=Location)
+    num_waypoints_visited = attr.ib(type=int)
+
+
+class TerminationRule(object):
+    """
+    The base class for rules that decide whether a mission execution should
+    be aborted.
+    """
+    @property
+    def name(self):  # type: () -> str
+        return self.__class__.__name__
+
+    def reset(self,
+              mission,  # type: Mission
+              oracle    # type: Oracle
+              ):        # type: (...) -> None
+        """
+        Prepares this rule for the execution of a given mission.
+        """
+        pass
+
+    @property
+    def conclusive(self):  # type: () -> bool
+        """
+        Indicates whether the most recent decision of this rule to abort the
+        execution reflects the behaviour of the vehicle, rather than a
+        failure of the test infrastructure.
+        """
+        return True
+
+    def watch(self, notify):  # type: (Callable[[], None]) -> None
+        """
+        Asks this rule to call a given function whenever it learns something
+        (outside of `check`) that may cause it to abort the execution, so
+        that it is checked without delay.
+        """
+        pass
+
+    def unwatch(self):  # type: () -> None
+        """
+        Stops this rule from calling the function given to `watch`.
+        """
+        pass
+
+    def check(self, state):  # type: (VehicleState) -> Optional[str]
+        """
+        Determines whether the execution should be aborted, given the live
+        state of the vehicle.
+
+        Returns:
+            the reason for aborting the execution, or None if the execution
+            should continue. By default, the execution always continues.
+        """
+        return None
+
+
+class _PersistentRule(TerminationRule):
+    """
+    A rule that aborts the execution once a condition has held continuously
+    for a given number of simulated seconds. The grace period gives the
+    vehicle a chance to report that it has completed its mission (e.g.,
+    copters disarm upon landing).
+    """
+    def __init__(self, grace):  # type: (float) -> None
+        self.__grace = grace
+        self.__since = None  # type: Optional[float]
+
+    def reset(self, mission, oracle):
+        self.__since = None
+
+    def violation(self, state):  # type: (VehicleState) -> Optional[str]
+        """
+        Determines whether the condition of this rule holds, given the live
+        state of the vehicle.
+
+        Returns:
+            the reason for aborting the execution if the condition persists,
+            or None if the condition doesn't hold. By default, the condition
+            never holds.
+        """
+        return None
+
+    def check(self, state):
+        reason = self.violation(state)
+        if reason is None:
+            self.__since = None
+            return None
+        if self.__since is None:
+            self.__since = state.time
+        if state.time - self.__since >= self.__grace:
+            return reason
+        return None
+
+
+class DisarmedRule(_PersistentRule):
+    """
+    Aborts the execution if the vehicle disarms (e.g., because it crashed)
+    without completing its mission.
+    """
+    def __init__(self, grace=2.0):  # type: (float) -> None
+        super(DisarmedRule, self).__init__(grace)
+
+    def violation(self, state):
+        if not state.armed:
+            return "vehicle disarmed before completing the mission"
+        return None
+
+
+class ModeRule(_PersistentRule):
+    """
+    Aborts the execution if the vehicle leaves AUTO mode (e.g., because a
+    failsafe switched it to RTL or LAND), since the harness never returns it
+    to AUTO.
+    """
+    def __init__(self,
+                 allowed=('AUTO',), # type: Tuple[str, ...]
+                 grace=2.0          # type: float
+                 ):                 # type: (...) -> None
+        super(ModeRule, self).__init__(grace)
+        self.__allowed = allowed
+
+    def violation(self, state):
+        if state.mode not in self.__allowed:
+            return "vehicle left AUTO mode (mode: {})".format(state.mode)
+        return None
+
+
+class StallRule(TerminationRule):
+    """
+    Aborts the execution if the vehicle neither visits a waypoint nor moves
+    for a given number of simulated seconds. Any delays and timed loiters in
+    the mission are added to that timeout, and missions that loiter
+    indefinitely are never considered to have stalled.
+    """
+    def __init__(self,
+                 timeout=30.0,      # type: float
+                 min_distance=2.0   # type: float
+                 ):                 # type: (...) -> None
+        self.__timeout = timeout
+        self.__min_distance = min_distance
+        self.__limit = None  # type: Optional[float]
+        self.__anchor = None  # type: Optional[Location]
+        self.__num_visited = 0
+        self.__since = 0.0
+
+    def reset(self, mission, oracle):
+        delays = [0.0]
+        self.__limit = self.__timeout
+        for (_, command, p1, _, _, _, _, _, _) in mission.command_tuples:
+            if command == MAV_CMD_NAV_LOITER_UNLIM:
+                self.__limit = None
+                break
+            if command in DELAY_COMMANDS:
+                delays.append(max(p1, 0.0))
+        if self.__limit is not None:
+            self.__limit += max(delays)
+        self.__anchor = None
+        self.__num_visited = 0
+        self.__since = 0.0
+
+    def check(self, state):
+        if self.__limit is None:
+            return None
+        pos = state.position
+        moved = self.__anchor is None or \
+            state.num_waypoints_visited != self.__num_visited or \
+            distance(self.__anchor, pos) >= self.__min_distance or \
+            abs(self.__anchor.alt - pos.alt) >= self.__min_distance
+        if moved:
+            self.__anchor = pos
+            self.__num_visited = state.num_waypoints_visited
+            self.__since = state.time
+            return None
+        if state.time - self.__since >= self.__limit:
+            return "vehicle made no progress for {:.0f} simulated seconds" \
+                .format(state.time - self.__since)
+        return None
+
+
+class DeviationRule(TerminationRule):
+    """
+    Aborts the execution if the vehicle strays further than a given number
+    of metres from the remainder of its route (e.g., because it has been
+    hijacked). The remainder of the route begins at the last two positions
+    that the vehicle has reached, according to the number of waypoints that
+    it has visited, and ends at the end position expected by the oracle.
+    """
+    def __init__(self, margin=250.0):  # type: (float) -> None
+        self.__margin = margin
+        self.__home = None  # type: Optional[Location]
+        self.__end = None  # type: Optional[Location]
+        self.__offset = 0
+        self.__points = []  # type: List[Tuple[int, Location]]
+        self.__num_visited = None  # type: Optional[int]
+        self.__route = []  # type: List[Location]
+
+    def reset(self, mission, oracle):
+        (lat, lon, alt, _) = mission.home
+        self.__home = Location(lat, lon, alt)
+        self.__end = oracle.end_position
+        # ArduCopter ignores the first mission item, and so the n-th visited
+        # waypoint is the n-th (rather than the n-1-th) item
+        self.__offset = 1 if mission.vehicle == 'ArduCopter' else 0
+        points = []  # type: List[Tuple[int, Location]]
+        for (index, cmd) in enumerate(mission.command_tuples):
+            (frame, _, _, _, _, _, x, y, z) = cmd
+            if frame in GLOBAL_FRAMES and (x != 0.0 or y != 0.0):
+                points.append((index, Location(x, y, z)))
+        self.__points = points
+        self.__num_visited = None
+        self.__route = []
+
+    def __remaining(self, num_visited):  # type: (int) -> List[Location]
+        """
+        Computes the remainder of the route after a given number of
+        waypoints have been visited.
+        """
+        last = num_visited - 1 + self.__offset
+        reached = [self.__home]
+        route = []
+        for (index, location) in self.__points:
+            if index <= last:
+                reached.append(location)
+            else:
+                route.append(location)
+        # the leg into the last reached position is kept, which tolerates
+        # waypoints that are reported slightly before they are reached
+        return reached[-2:] + route + [self.__end]
+
+    def check(self, state):
+        if state.num_waypoints_visited != self.__num_visited:
+            self.__num_visited = state.num_waypoints_visited
+            self.__route = self.__remaining(state.num_waypoints_visited)
+        dist = _distance_to_route(state.position, self.__route)
+        if dist > self.__margin:
+            return "vehicle strayed {:.0f} metres from its route".format(dist)
+        return None
+
+
+def _distance_to_route(position,    # type: Location
+                       route        # type: List[Location]
+                       ):           # type: (...) -> float
+    """
+    Computes the ground distance, in metres, from a given position to the
+    nearest point on a route, using an equirectangular projection centred on
+    that position.
+    """
+    scale = math.cos(math.radians(position.lat))
+
+    def local(loc):  # type: (Location) -> Tuple[float, float]
+        return ((loc.lon - position.lon) * scale, loc.lat - position.lat)
+
+    points = [local(loc) for loc in route]
+    nearest = min(math.hypot(x, y) for (x, y) in points)
+    for ((x1, y1), (x2, y2)) in zip(points, points[1:]):
+        (dx, dy) = (x2 - x1, y2 - y1)
+        length = dx * dx + dy * dy
+        if length == 0.0:
+            continue
+        t = max(0.0, min(1.0, -(x1 * dx + y1 * dy) / length))
+        nearest = min(nearest, math.hypot(x1 + t * dx, y1 + t * dy))
+    return nearest * 1.113195e5
+
+
+class AttackRule(TerminationRule):
+    """
+    Aborts the execution once the attack server reports that its attack was
+    successful. The attack server is asked at most once per given number of
+    simulated seconds, without waiting for its reply; attack servers that
+    push a SUCCESS notification cause the execution to be aborted as soon as
+    that notification arrives. The execution is also aborted if the attack
+    server fails to answer a given number of consecutive requests, since its
+    verdict can no longer be known.
+    """
+    def __init__(self,
+                 attacker,          # type: Attacker
+                 interval=1.0,      # type: float
+                 max_unanswered=3   # type: int
+                 ):                 # type: (...) -> None
+        self.__attacker = attacker
+        self.__interval = interval
+        self.__max_unanswered = max_unanswered
+        self.__checked_at = None  # type: Optional[float]
+        self.__notify = None  # type: Optional[Callable[[], None]]
+        self.__unresponsive = False
+
+    @property
+    def conclusive(self):
+        return not self.__unresponsive
+
+    def reset(self, mission, oracle):
+        self.__checked_at = None
+        self.__unresponsive = False
+
+    def watch(self, notify):
+        self.__notify = notify
+        self.__attacker.add_success_listener(notify)
+
+    def unwatch(self):
+        if self.__notify:
+            self.__attacker.remove_success_listener(self.__notify)
+            self.__notify = None
+
+    def check(self, state):
+        if self.__attacker.succeeded:
+            return "attack was successful"
+        if self.__checked_at is not None and \
+           state.time - self.__checked_at < self.__interval:
+            return None
+        self.__checked_at = state.time
+        try:
+            self.__attacker.check()
+        except AttackServerException:
+            logger.exception("failed to check whether attack was successful")
+            num_unanswered = self.__attacker.num_unanswered
+            if num_unanswered >= self.__max_unanswered:
+                self.__unresponsive = True
+                return "attack server failed to answer {} consecutive requests" \
+                    .format(num_unanswered)
+        return None
+
+
+class Monitor(object):
+    """
+    Checks the live state of a vehicle against a set of termination rules
+    during the execution of a mission.
+    """
+    def __init__(self,
+                 rules,         # type: List[TerminationRule]
+                 mission,       # type: Mission
+                 oracle,        # type: Oracle
+                 notify=None    # type: Optional[Callable[[], None]]
+                 ):             # type: (...) -> None
+        """
+        Parameters:
+            rules: the rules that should be checked.
+            mission: the mission that is being executed.
+            oracle: the oracle for the mission.
+            notify: an optional function that rules may call, from any
+                thread, to ask to be checked without delay.
+        """
+        self.__rules = rules
+        self.__aborted_by = None  # type: Optional[TerminationRule]
+        for rule in rules:
+            rule.reset(mission, oracle)
+        if notify:
+            for rule in rules:
+                rule.watch(notify)
+
+    def close(self):  # type: () -> None
+        """
+        Stops the rules of this monitor from asking to be checked.
+        """
+        for rule in self.__rules:
+            rule.unwatch()
+
+    @property
+    def conclusive(self):  # type: () -> bool
+        """
+        Indicates whether the decision to abort the execution, if any,
+        reflects the behaviour of the vehicle rather than a failure of the
+        test infrastructure.
+        """
+        return self.__aborted_by is None or self.__aborted_by.conclusive
+
+    def check(self, state):  # type: (VehicleState) -> Optional[Tuple[str, str]]
+        """
+        Returns:
+            a tuple of the form `(rule, reason)`, describing the first rule
+            that decided to abort the execution and its reason, or None if
+            the execution should continue.
+        """
+        for rule in self.__rules:
+            reason = rule.check(state)
+            if reason is not None:
+                logger.debug("aborting mission (%s): %s", rule.name, reason)
+                self.__aborted_by = rule
+                return (rule.name, reason)
+        return None
+
+
+def default_rules(attacker=None):  # type: (Optional[Attacker]) -> List[TerminationRule]
+    """
+    Produces a fresh set of the default termination rules. If an attacker is
+    given, the execution is also aborted once its attack succeeds.
+    """
+    rules = [DisarmedRule(),
+             ModeRule(),
+             StallRule(),
+             DeviationRule()]  # type: List[TerminationRule]
+    if attacker:
+        rules.append(AttackRule(attacker))
+    return rules
@@ -4,20 +4,89 @@ a given scenario.
 """
 __all__ = ['execute']
 
-from typing import Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
+import contextlib
 import logging
 
-import dronekit
+import attr
 
 from .sitl import SITL
 from .mission import Mission
 from .attack import Attack, Attacker
-from .exceptions import TimeoutException
+from .warm import SITLPool
+from .snapshot import SnapshotStore
+from .telemetry import TelemetryRecorder
+from .result_cache import ResultCache
+from .outcome import TestOutcome, Timings
+from .simtime import SpeedupController
+from .termination import default_rules
+from .metrics import OutcomeHook
+from .exceptions import TimeoutException, SnapshotException
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
 
+@contextlib.contextmanager
+def _launch(sitl,               # type: SITL
+            prefix,             # type: str
+            speedup,            # type: int
+            timeout_connection, # type: int
+            lightweight,        # type: bool
+            mavproxy,           # type: bool
+            direct,             # type: bool
+            snapshots           # type: Optional[SnapshotStore]
+            ):                  # type: (...) -> Iterator[Tuple[SITL, Callable[[Timings], dronekit.Vehicle]]]
+    """
+    Launches a fresh SITL, or restores one from its snapshot, for the
+    duration of a context.
+
+    Returns:
+        a tuple of the form `(sitl, connect)`, where `connect` is a function
+        that connects to the vehicle.
+    """
+    vehicle = [None]  # type: List[Optional[dronekit.Vehicle]]
+
+    def connect(timings):
+        vehicle[0] = sitl.connect(timeout_connection,
+                                  timings=timings,
+                                  lightweight=lightweight)
+        return vehicle[0]
+
+    if snapshots:
+        launch = snapshots.restore(sitl, speedup)
+    else:
+        launch = sitl.launch(prefix, speedup, mavproxy, direct=direct,
+                             timeout_connection=timeout_connection)
+
+    try:
+        with launch:
+            yield (sitl, connect)
+    finally:
+        if vehicle[0]:
+            logger.debug("closing connection to vehicle")
+            vehicle[0].close()
+            logger.debug("closed connection to vehicle")
+
+
+@contextlib.contextmanager
+def _reuse(pool,    # type: SITLPool
+           sitl,    # type: SITL
+           home,    # type: Tuple[float, float, float, float]
+           prefix,  # type: str
+           speedup  # type: int
+           ):       # type: (...) -> Iterator[Tuple[SITL, Callable[[Timings], dronekit.Vehicle]]]
+    """
+    Borrows a warm SITL from a given pool for the duration of a context.
+
+    Returns:
+        a tuple of the form `(sitl, connect)`, where `connect` is a function
+        that returns the (already connected) vehicle.
+    """
+    with pool.acquire(sitl, home, prefix, speedup) as warm:
+        yield (warm.sitl, lambda timings: warm.vehicle)
+
+
 def execute(sitl,                   # type: SITL
             mission,                # type: Mission
             attack=None,            # type: Optional[Attack]
@@ -26,10 +95,20 @@ def execute(sitl,                   # type: SITL
             timeout_mission=240,    # type: int
             timeout_liveness=1,     # type: int
             timeout_connection=10,  # type: int
-            port_attacker=14300,    # type: int
+            port_attacker=None,     # type: Optional[int]
             check_wps=False,        # type: bool
-            enable_workaround=True  # type: bool
-            ):                      # type: (...) -> Tuple[bool, str]
+            enable_workaround=True, # type: bool
+            pool=None,              # type: Optional[SITLPool]
+            fn_telemetry=None,      # type: Optional[str]
+            cache=None,             # type: Optional[ResultCache]
+            hooks=None,             # type: Optional[List[OutcomeHook]]
+            controller=None,        # type: Optional[SpeedupController]
+            early_termination=True, # type: bool
+            lightweight_client=False, # type: bool
+            mavproxy=True,          # type: bool
+            direct_launch=False,    # type: bool
+            snapshots=None          # type: Optional[SnapshotStore]
+            ):                      # type: (...) -> TestOutcome
     """
     Executes the test.
 
@@ -37,59 +116,196 @@ def execute(sitl,                   # type: SITL
         sitl_prefix: a command to prefix to the SITL binary. (used to
             attach valgrind, for example).
         speedup: the speedup factor that should be used by the simulator.
+            Ignored if a speed-up controller is provided.
+        port_attacker: the port that should be used by the attack server. If
+            left unspecified, the port reserved for the SITL instance will be
+            used.
+        pool: an optional pool of warm SITL instances. If provided, the test
+            will be executed on a (reset) instance from the pool rather than
+            on a freshly launched SITL.
+        fn_telemetry: the name of an optional file to which the telemetry
+            produced by the vehicle during the mission should be written.
+        cache: an optional cache of test outcomes. If the outcome of this test
+            for a byte-identical binary is known, that outcome is returned
+            without executing the test; otherwise, the outcome of the test
+            is added to the cache. The cache is not consulted (though it is
+            still updated) when `fn_telemetry` is given.
+        hooks: an optional list of hooks that should be notified of the
+            outcome of the test (e.g., to export metrics).
+        controller: an optional controller that picks the speed-up for the
+            simulator, and that is informed of the speed-up that the test
+            achieved.
+        early_termination: if True, the mission is aborted as soon as it can
+            no longer succeed (e.g., because the vehicle has disarmed, left
+            AUTO mode, stalled or strayed from its route, or because the
+            attack was successful), rather than when it times out.
+        lightweight_client: if True, the harness connects to the vehicle via
+            a lightweight MAVLink client rather than Dronekit, which avoids
+            downloading the parameters of the vehicle. Ignored when a pool of
+            warm SITLs is used.
+        mavproxy: if False, the SITL is launched without MAVProxy, and its
+            messages are forwarded to the harness and the attacker by an
+            in-process router, which saves a process and a hop per message.
+            Ignored when a pool of warm SITLs is used.
+        direct_launch: if True, the SITL binary is launched directly, with
+            precomputed arguments, rather than through sim_vehicle.py. Its
+            messages are forwarded by an in-process router, and `mavproxy`
+            is ignored. Ignored when a pool of warm SITLs is used.
+        snapshots: an optional store of snapshots of armable SITLs. If
+            provided, the SITL is restored from its snapshot rather than
+            booted from scratch, which skips the wait for the vehicle to
+            become armable. The launch options are ignored when a SITL is
+            restored, and a prefix may not be given, since the SITL isn't
+            launched. Ignored when a pool of warm SITLs is used.
 
     Returns:
-        a tuple of the form `(passed, reason)`, where `passed` is a flag
-        that indicates whether or not the test succeeded, and `reason` is
-        an optional string that is used to describe the reason for the
-        test failure (if indeed there was a failure).
+        the outcome of the test, including the time spent in each of its
+        phases. For compatibility, the outcome may be unpacked as a tuple of
+        the form `(passed, reason)`, where `passed` is a flag that indicates
+        whether or not the test succeeded, and `reason` is an optional string
+        that is used to describe the reason for the test failure (if indeed
+        there was a failure).
+
+    Raises:
+        SnapshotException: if both a prefix and a snapshot store are given.
     """
-    vehicle = None
-    if attack:
-        attack_sitl_url = 'udp:127.0.0.1:14551'
-        attacker = Attacker(attack, attack_sitl_url, port_attacker)
+    if snapshots and prefix and not pool:
+        msg = "a prefix can't be used with snapshots: restored SITLs aren't launched"
+        raise SnapshotException(msg)
+
+    if controller:
+        speedup = controller.speedup
+        logger.debug("using speed-up chosen by controller: %d", speedup)
+
+    key = None  # type: Optional[str]
+    outcome = None  # type: Optional[TestOutcome]
+    if cache:
+        key = cache.key(sitl, mission, attack, speedup, check_wps,
+                        enable_workaround, early_termination, timeout_mission,
+                        timeout_liveness, timeout_connection, prefix)
+        # a cached outcome has no telemetry, and so the test is executed
+        # whenever a trace is requested
+        cached = None
+        if fn_telemetry:
+            logger.debug("bypassing result cache: telemetry was requested")
+        else:
+            cached = cache.lookup(key)
+        if cached:
+            (passed, reason) = cached
+            outcome = TestOutcome(passed, reason, cached=True)
+
+    if not outcome:
+        outcome = _execute(sitl, mission, attack, speedup, prefix,
+                           timeout_mission, timeout_liveness,
+                           timeout_connection, port_attacker, check_wps,
+                           enable_workaround, pool, fn_telemetry,
+                           early_termination, lightweight_client,
+                           mavproxy, direct_launch, snapshots)
+        if cache and outcome.cacheable:
+            cache.record(key, outcome)
+        elif cache:
+            logger.debug("not caching outcome of test: %s", outcome.reason)
+        if controller:
+            controller.record(speedup, outcome.speedup_achieved)
+
+    labels = {'mission': mission.filename, 'vehicle': mission.vehicle}
+    for hook in (hooks or []):
+        try:
+            hook.record(outcome, labels)
+        except Exception:
+            logger.exception("failed to record test outcome with hook: %s",
+                             hook)
+    return outcome
+
+
+def _execute(sitl,                  # type: SITL
+             mission,               # type: Mission
+             attack,                # type: Optional[Attack]
+             speedup,               # type: int
+             prefix,                # type: str
+             timeout_mission,       # type: int
+             timeout_liveness,      # type: int
+             timeout_connection,    # type: int
+             port_attacker,         # type: Optional[int]
+             check_wps,             # type: bool
+             enable_workaround,     # type: bool
+             pool,                  # type: Optional[SITLPool]
+             fn_telemetry,          # type: Optional[str]
+             early_termination,     # type: bool
+             lightweight_client,    # type: bool
+             mavproxy,              # type: bool
+             direct_launch,         # type: bool
+             snapshots              # type: Optional[SnapshotStore]
+             ):                     # type: (...) -> TestOutcome
+    timings = Timings()
+    if pool:
+        context = _reuse(pool, sitl, mission.home, prefix, speedup)
     else:
-        attacker = None
+        context = _launch(sitl, prefix, speedup, timeout_connection,
+                          lightweight_client, mavproxy, direct_launch,
+                          snapshots)
 
+    attacker = None
+    recorder = TelemetryRecorder() if fn_telemetry else None
     try:
-        with sitl.launch(prefix, speedup):
-            if attacker:
-                attacker.prepare()
-
-            # NOTE dronekit is broken!
-            #      it always tries to connect to 127.0.0.1:5760
-            logger.debug("trying to connect to vehicle [%s]", sitl.url)
-            vehicle = dronekit.connect(sitl.url,
-                                       wait_ready=False,
-                                       heartbeat_timeout=timeout_connection)
-            logger.debug("established connection with vehicle.")
-            logger.debug("waiting for vehicle to be ready.")
-            vehicle.wait_ready(True, timeout=timeout_connection)
-            logger.debug("vehicle is ready for mission.")
-
-            # launch the attack, if one was provided
-            if attacker:
-                logger.debug("launching attack on vehicle")
-                attacker.start()
-                logger.debug("launched attack on vehicle")
-            else:
-                logger.debug("skipping attack launch: no attack provided.")
-
-            # execute the mission
-            return mission.execute(time_limit=timeout_mission,
-                                   conn=vehicle,
-                                   speedup=speedup,
-                                   timeout_heartbeat=timeout_liveness,
-                                   enable_workaround=enable_workaround,
-                                   check_wps=check_wps)
+        timings.start('launch')
+        with context as (sitl, connect):
+            timings.stop('launch')
+            try:
+                if attack:
+                    if port_attacker is None:
+                        port_attacker = sitl.ports.attack_server
+                    attacker = Attacker(attack,
+                                        sitl.url_attacker,
+                                        port_attacker,
+                                        timeout_ready=timeout_connection)
+                    with timings.phase('attacker'):
+                        attacker.prepare()
+
+                vehicle = connect(timings)
+
+                # launch the attack, if one was provided
+                if attacker:
+                    logger.debug("launching attack on vehicle")
+                    attacker.start()
+                    logger.debug("launched attack on vehicle")
+                else:
+                    logger.debug("skipping attack launch: no attack provided.")
+
+                # execute the mission
+                rules = default_rules(attacker) if early_termination else []
+                outcome = mission.execute(time_limit=timeout_mission,
+                                          conn=vehicle,
+                                          speedup=speedup,
+                                          timeout_heartbeat=timeout_liveness,
+                                          enable_workaround=enable_workaround,
+                                          check_wps=check_wps,
+                                          recorder=recorder,
+                                          timings=timings,
+                                          rules=rules)
+            finally:
+                with timings.phase('teardown'):
+                    if attacker:
+                        logger.debug("closing attack server")
+                        attacker.stop()
+                        logger.debug("closed attack server")
+                if recorder:
+                    # a failure to save the trace mustn't mask the outcome
+                    # (or exception) of the test
+                    try:
+                        with timings.phase('telemetry'):
+                            recorder.save(fn_telemetry,
+                                          {'mission': mission.filename,
+                                           'vehicle': mission.vehicle,
+                                           'speedup': speedup})
+                    except Exception:
+                        logger.exception("failed to save telemetry to file: %s",
+                                         fn_telemetry)
+                # closing the connection and terminating the SITL is also
+                # part of the teardown
+                timings.start('teardown')
     except TimeoutException:
-        return (False, "timeout occurred")
+        outcome = TestOutcome(False, "timeout occurred", cacheable=False)
     finally:
-        if attacker:
-            logger.debug("closing attack server")
-            attacker.stop()
-            logger.debug("closed attack server")
-        if vehicle:
-            logger.debug("closing connection to vehicle")
-            vehicle.close()
-            logger.debug("closed connection to vehicle")
+        timings.stop('teardown')
+    return attr.evolve(outcome, timings=timings.as_dict())
@@ -0,0 +1,339 @@
+"""
+This module provides a pool of live ("warm") SITL instances that may be
+reused across test executions. Rather than launching a fresh simulator for
+each test, the state of a warm instance is reset between tests, avoiding the
+costs of launching the SITL and MAVProxy, and of connecting to the vehicle.
+"""
+__all__ = ['WarmSITL', 'SITLPool']
+
+from typing import Dict, List, Optional, Tuple
+import threading
+import contextlib
+import logging
+
+import attr
+
+from .sitl import SITL
+from .ports import PortAllocator
+from .deadline import Deadline
+from .helper import wait_until
+from .protocol import MAV_CMD_DO_SET_HOME, MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN, \
+    MAV_CMD_COMPONENT_ARM_DISARM, MAGIC_FORCE_DISARM
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+
+class WarmSITL(object):
+    """
+    A live SITL instance and its connected vehicle.
+    """
+    def __init__(self,
+                 sitl,                  # type: SITL
+                 prefix=None,           # type: Optional[str]
+                 speedup=1,             # type: int
+                 timeout_connection=10, # type: int
+                 mavproxy=True,         # type: bool
+                 direct=False           # type: bool
+                 ):                     # type: (...) -> None
+        """
+        Launches a SITL instance and connects to its vehicle.
+        """
+        self.__sitl = sitl
+        self.__speedup_launched = speedup
+        self.__speedup = speedup
+        self.__launch = sitl.launch(prefix, speedup, mavproxy,
+                                    direct=direct,
+                                    timeout_connection=timeout_connection)
+        self.__launch.__enter__()
+        try:
+            self.__vehicle = sitl.connect(timeout_connection)
+        except Exception:
+            self.__launch.__exit__(None, None, None)
+            raise
+
+        # the parameters of the vehicle immediately after launch
+        self.__parameters = dict(self.__vehicle.parameters.items())
+        self.__is_fresh = True
+
+    @property
+    def sitl(self):  # type: () -> SITL
+        return self.__sitl
+
+    @property
+    def vehicle(self):  # type: () -> dronekit.Vehicle
+        return self.__vehicle
+
+    def __command(self, command, *params):  # type: (int, *float) -> None
+        params = list(params) + [0] * (7 - len(params))
+        message = self.__vehicle.message_factory.command_long_encode(
+            0, 0, command, 0, *params)
+        self.__vehicle.send_mavlink(message)
+
+    @property
+    def speedup(self):  # type: () -> int
+        """
+        The speed-up factor that is currently used by the simulator.
+        """
+        return self.__speedup
+
+    def reset(self,
+              home,                 # type: Tuple[float, float, float, float]
+              timeout=60,           # type: float
+              clear_mission=True,   # type: bool
+              speedup=None          # type: Optional[int]
+              ):                    # type: (...) -> None
+        """
+        Restores this instance to the state that it was in immediately after
+        it was launched: the vehicle is disarmed, its mission is cleared, any
+        modified parameters are restored, and the vehicle is rebooted and
+        its home is set to a given location. Blocks until the vehicle is
+        armable.
+
+        Rebooting returns the vehicle to the location at which the SITL was
+        launched (i.e., `SITL.home`); setting the home location does not
+        move the vehicle. `SITLPool` only reuses instances that were
+        launched at the requested home location.
+
+        Parameters:
+            clear_mission: if False, the vehicle keeps its current mission,
+                allowing an identical mission to be issued without being
+                uploaded again.
+            speedup: the speed-up factor that the simulator should use from
+                now on. Since the SITL reads its speed-up from its
+                SIM_SPEEDUP parameter, the speed-up may be changed without
+                relaunching the instance. If unspecified, the speed-up with
+                which the instance was launched is used.
+
+        Raises:
+            TimeoutException: if the instance couldn't be reset within the
+                given number of seconds.
+        """
+        if speedup is None:
+            speedup = self.__speedup_launched
+        parameters = dict(self.__parameters)
+        if 'SIM_SPEEDUP' in parameters:
+            parameters['SIM_SPEEDUP'] = float(speedup)
+        elif speedup != self.__speedup_launched:
+            logger.debug("unable to change speed-up of SITL from %d to %d",
+                         self.__speedup_launched, speedup)
+            speedup = self.__speedup_launched
+
+        if self.__is_fresh and speedup == self.__speedup:
+            logger.debug("skipping reset of freshly launched SITL")
+            self.__is_fresh = False
+            return
+
+        vehicle = self.__vehicle
+        with Deadline(timeout) as deadline:
+            logger.debug("disarming vehicle")
+            while not wait_until(vehicle,
+                                 lambda: not vehicle.armed,
+                                 ['armed'],
+                                 deadline,
+                                 timeout=1.0):
+                self.__command(MAV_CMD_COMPONENT_ARM_DISARM,
+                               0, MAGIC_FORCE_DISARM)
+            logger.debug("disarmed vehicle")
+
+            if clear_mission:
+                logger.debug("clearing mission")
+                message = vehicle.message_factory.mission_clear_all_encode(0, 0)
+                vehicle.send_mavlink(message)
+                logger.debug("cleared mission")
+
+            logger.debug("restoring modified parameters")
+            for (name, value) in parameters.items():
+                if vehicle.parameters.get(name) != value:
+                    logger.debug("restoring parameter %s: %s -> %s",
+                                 name, vehicle.parameters.get(name), value)
+                    vehicle.parameters[name] = value
+            logger.debug("restored modified parameters")
+            self.__speedup = speedup
+
+            # the boot time reported by the vehicle goes backwards once it has
+            # rebooted. a boot time must be observed before the reboot is
+            # requested, or else a quick reboot would go unnoticed.
+            observed = threading.Event()
+            rebooted = threading.Event()
+            time_boot_ms = [None]  # type: List[Optional[int]]
+
+            def on_message(_, name, message):
+                time_boot = getattr(message, 'time_boot_ms', None)
+                if time_boot is None:
+                    return
+                if time_boot_ms[0] is not None and time_boot < time_boot_ms[0]:
+                    rebooted.set()
+                time_boot_ms[0] = time_boot
+                observed.set()
+
+            vehicle.add_message_listener('*', on_message)
+            try:
+                deadline.wait(observed)
+                logger.debug("rebooting vehicle")
+                self.__command(MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN, 1)
+                deadline.wait(rebooted)
+                logger.debug("rebooted vehicle")
+            finally:
+                vehicle.remove_message_listener('*', on_message)
+
+            logger.debug("waiting for vehicle to become armable")
+            wait_until(vehicle,
+                       lambda: vehicle.is_armable,
+                       ['mode', 'gps_0', 'ekf_ok'],
+                       deadline,
+                       messages=['HEARTBEAT'])
+            logger.debug("vehicle is armable")
+
+            logger.debug("setting home location: %s", home)
+            (lat, lon, alt, _) = home
+            self.__command(MAV_CMD_DO_SET_HOME, 0, 0, 0, 0, lat, lon, alt)
+        self.__is_fresh = False
+
+    def close(self):  # type: () -> None
+        """
+        Closes the connection to the vehicle and terminates the SITL.
+        """
+        logger.debug("closing warm SITL instance %d", self.__sitl.instance)
+        try:
+            self.__vehicle.close()
+        finally:
+            self.__launch.__exit__(None, None, None)
+
+
+class SITLPool(object):
+    """
+    Maintains a pool of warm SITL instances for each SITL binary, allowing
+    consecutive tests of the same binary to skip the cost of launching a
+    fresh simulator. Instances are shared by tests with different speed-ups:
+    the speed-up of a reused instance is changed when it is reset. Thread-safe.
+    """
+    def __init__(self,
+                 allocator=None,        # type: Optional[PortAllocator]
+                 timeout_connection=10, # type: int
+                 timeout_reset=60,      # type: float
+                 clear_mission=False,   # type: bool
+                 mavproxy=True,         # type: bool
+                 direct_launch=False    # type: bool
+                 ):                     # type: (...) -> None
+        """
+        Parameters:
+            allocator: the allocator that should be used to provide each warm
+                instance with its own set of ports.
+            timeout_connection: the number of seconds to wait when connecting
+                to a freshly launched instance.
+            timeout_reset: the number of seconds to wait for an instance to be
+                reset before it is discarded.
+            clear_mission: whether the mission held by an instance should be
+                cleared when it is reset. Since `Mission.issue` only uploads
+                a mission when it differs from the one held by the vehicle,
+                keeping the mission allows repeated tests of the same mission
+                to skip its upload.
+            mavproxy: if False, instances are launched without MAVProxy, and
+                their messages are forwarded by an in-process router.
+            direct_launch: if True, instances are launched by running their
+                SITL binary directly rather than through sim_vehicle.py.
+        """
+        if allocator is None:
+            allocator = PortAllocator()
+        self.__allocator = allocator
+        self.__timeout_connection = timeout_connection
+        self.__timeout_reset = timeout_reset
+        self.__clear_mission = clear_mission
+        self.__mavproxy = mavproxy
+        self.__direct_launch = direct_launch
+        self.__idle = {}  # type: Dict[Tuple[SITL, str], List[WarmSITL]]
+        self.__lock = threading.Lock()
+
+    def __enter__(self):  # type: () -> SITLPool
+        return self
+
+    def __exit__(self, *args):  # type: (...) -> None
+        self.close()
+
+    def __discard(self, warm):  # type: (WarmSITL) -> None
+        try:
+            warm.close()
+        except Exception:
+            logger.exception("failed to close warm SITL instance")
+        self.__allocator.release(warm.sitl.ports)
+
+    def __launch(self,
+                 sitl,      # type: SITL
+                 prefix,    # type: Optional[str]
+                 speedup    # type: int
+                 ):         # type: (...) -> WarmSITL
+        ports = self.__allocator.acquire()
+        try:
+            sitl = attr.evolve(sitl, instance=ports.instance)
+            logger.debug("launching warm SITL instance %d", ports.instance)
+            return WarmSITL(sitl, prefix, speedup, self.__timeout_connection,
+                            self.__mavproxy, self.__direct_launch)
+        except Exception:
+            self.__allocator.release(ports)
+            raise
+
+    @contextlib.contextmanager
+    def acquire(self,
+                sitl,           # type: SITL
+                home,           # type: Tuple[float, float, float, float]
+                prefix=None,    # type: Optional[str]
+                speedup=1       # type: int
+                ):              # type: (...) -> WarmSITL
+        """
+        Provides exclusive access to a warm instance of a given SITL for the
+        duration of a context. An idle instance is reused where possible;
+        otherwise, a fresh instance is launched.
+
+        Parameters:
+            sitl: the SITL. Its instance number is ignored.
+            home: the home location that should be used by the vehicle.
+            prefix: the prefix that should be used to launch the SITL.
+            speedup: the speed-up factor for the simulation.
+        """
+        # instances are interchangeable regardless of their instance number,
+        # but the vehicle only starts at the requested home location if the
+        # SITL was launched there
+        sitl = attr.evolve(sitl, instance=0, home=tuple(home))
+        key = (sitl, prefix or '')
+        warm = None  # type: Optional[WarmSITL]
+        with self.__lock:
+            idle = self.__idle.get(key, [])
+            if idle:
+                warm = idle.pop()
+
+        if warm:
+            logger.debug("reusing warm SITL instance %d", warm.sitl.instance)
+            try:
+                warm.reset(home, self.__timeout_reset, self.__clear_mission,
+                           speedup)
+            except Exception:
+                logger.exception("failed to reset warm SITL instance")
+                self.__discard(warm)
+                warm = None
+        if warm is None:
+            warm = self.__launch(sitl, prefix, speedup)
+            try:
+                warm.reset(home, self.__timeout_reset, self.__clear_mission,
+                           speedup)
+            except Exception:
+                self.__discard(warm)
+                raise
+
+        try:
+            yield warm
+        except Exception:
+            self.__discard(warm)
+            raise
+        with self.__lock:
+            self.__idle.setdefault(key, []).append(warm)
+
+    def close(self):  # type: () -> None
+        """
+        Terminates all idle instances.
+        """
+        with self.__lock:
+            idle = [w for ws in self.__idle.values() for w in ws]
+            self.__idle = {}
+        for warm in idle:
+            self.__discard(warm)
@@ -0,0 +1,232 @@
+import socket
+import time
+import contextlib
+
+import pytest
+
+from start_core.router import split_frames, Endpoint, MAVLinkRouter
+
+mavlink1 = pytest.importorskip('pymavlink.dialects.v10.ardupilotmega')
+mavlink2 = pytest.importorskip('pymavlink.dialects.v20.ardupilotmega')
+
+
+def heartbeat(mavlink):
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    return mav.heartbeat_encode(2, 3, 0, 0, 0, 3).pack(mav)
+
+
+def statustext(mavlink, text=b'hello'):
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    return mav.statustext_encode(6, text).pack(mav)
+
+
+def system_time(mavlink):
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    return mav.system_time_encode(0, 1000).pack(mav)
+
+
+def test_split_frames_v1():
+    hb = heartbeat(mavlink1)
+    text = statustext(mavlink1)
+    (frames, rest) = split_frames(hb + text)
+    assert frames == [(mavlink1.MAVLINK_MSG_ID_HEARTBEAT, hb),
+                      (mavlink1.MAVLINK_MSG_ID_STATUSTEXT, text)]
+    assert rest == b''
+
+
+def test_split_frames_v2():
+    hb = heartbeat(mavlink2)
+    text = statustext(mavlink2)
+    (frames, rest) = split_frames(hb + text)
+    assert frames == [(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, hb),
+                      (mavlink2.MAVLINK_MSG_ID_STATUSTEXT, text)]
+    assert rest == b''
+
+
+def test_split_frames_v2_signed():
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    mav.signing.secret_key = b'\x42' * 32
+    mav.signing.link_id = 0
+    mav.signing.timestamp = 1
+    mav.signing.sign_outgoing = True
+    signed = mav.heartbeat_encode(2, 3, 0, 0, 0, 3).pack(mav)
+    text = statustext(mavlink2)
+    (frames, rest) = split_frames(signed + text)
+    assert frames == [(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, signed),
+                      (mavlink2.MAVLINK_MSG_ID_STATUSTEXT, text)]
+    assert rest == b''
+
+
+def test_split_frames_mixed_versions():
+    v1 = heartbeat(mavlink1)
+    v2 = system_time(mavlink2)
+    (frames, rest) = split_frames(v1 + v2 + v1)
+    assert [frame for (_, frame) in frames] == [v1, v2, v1]
+    assert rest == b''
+
+
+def test_split_frames_skips_garbage():
+    hb = heartbeat(mavlink2)
+    (frames, rest) = split_frames(b'\x00\x01garbage' + hb + b'\x12' + hb)
+    assert frames == [(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, hb)] * 2
+    assert rest == b''
+
+
+@pytest.mark.parametrize('cut', [1, 5, 9, 11, -1])
+def test_split_frames_incomplete(cut):
+    hb = heartbeat(mavlink2)
+    text = statustext(mavlink2)
+    partial = text[:cut]
+    (frames, rest) = split_frames(hb + partial)
+    assert frames == [(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, hb)]
+    assert rest == partial
+
+    # the remainder of the frame completes it
+    (frames, rest) = split_frames(rest + text[len(partial):])
+    assert frames == [(mavlink2.MAVLINK_MSG_ID_STATUSTEXT, text)]
+    assert rest == b''
+
+
+def test_endpoint_converts_filters():
+    endpoint = Endpoint('127.0.0.1', 14550,
+                        include=['HEARTBEAT'], exclude=['STATUSTEXT'])
+    assert endpoint.include == frozenset(['HEARTBEAT'])
+    assert endpoint.exclude == frozenset(['STATUSTEXT'])
+    assert endpoint.address == ('127.0.0.1', 14550)
+    assert Endpoint('127.0.0.1', 14550).include is None
+
+
+@contextlib.contextmanager
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(2.0)
+    try:
+        yield sock
+    finally:
+        sock.close()
+
+
+def receive_all(sock, timeout=0.3):
+    sock.settimeout(timeout)
+    received = []
+    try:
+        while True:
+            (data, _) = sock.recvfrom(65536)
+            received.append(data)
+    except socket.timeout:
+        pass
+    return received
+
+
+@pytest.fixture
+def master():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    server.settimeout(5.0)
+    try:
+        yield server
+    finally:
+        server.close()
+
+
+def test_router_filters_and_forwards(master):
+    hb = heartbeat(mavlink2)
+    text = statustext(mavlink2)
+    clock = system_time(mavlink2)
+    with listener() as everything, listener() as only_hb, \
+            listener() as no_text:
+        endpoints = [
+            Endpoint(*everything.getsockname()),
+            Endpoint(*only_hb.getsockname(), include=['HEARTBEAT']),
+            Endpoint(*no_text.getsockname(), exclude=['STATUSTEXT'])
+        ]
+        with MAVLinkRouter(master.getsockname(), endpoints) as router:
+            router.wait_connected(5.0)
+            (conn, _) = master.accept()
+            try:
+                # frames are split across writes to the stream
+                stream = hb + text + clock
+                conn.sendall(stream[:7])
+                conn.sendall(stream[7:])
+
+                assert receive_all(everything) == [hb, text, clock]
+                assert receive_all(only_hb) == [hb]
+                assert receive_all(no_text) == [hb, clock]
+                assert router.num_forwarded == 6
+                assert router.num_filtered == 3
+
+                # messages from an endpoint are sent to the SITL
+                everything.sendto(text, router_address(everything, conn, hb))
+                conn.settimeout(2.0)
+                assert conn.recv(65536) == text
+            finally:
+                conn.close()
+
+
+def router_address(endpoint, conn, frame):
+    """
+    Determines the address from which the router sends messages to a
+    given endpoint.
+    """
+    conn.sendall(frame)
+    endpoint.settimeout(2.0)
+    (_, address) = endpoint.recvfrom(65536)
+    return address
+
+
+def test_router_reconnects(master):
+    hb = heartbeat(mavlink2)
+    with listener() as sock:
+        with MAVLinkRouter(master.getsockname(),
+                           [Endpoint(*sock.getsockname())]) as router:
+            (conn, _) = master.accept()
+            conn.close()
+
+            # the router reconnects once its connection is lost
+            (conn, _) = master.accept()
+            try:
+                router.wait_connected(5.0)
+                conn.sendall(hb)
+                assert receive_all(sock) == [hb]
+            finally:
+                conn.close()
+
+
+def test_router_keeps_frames_whole_under_backpressure(master):
+    # a small receive buffer on the SITL side, together with a flood of
+    # messages from the endpoint, forces the router to make partial writes
+    master.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    hb = heartbeat(mavlink2)
+    text = statustext(mavlink2, b'x' * 50)
+    with listener() as sock:
+        with MAVLinkRouter(master.getsockname(),
+                           [Endpoint(*sock.getsockname())]) as router:
+            (conn, _) = master.accept()
+            try:
+                address = router_address(sock, conn, hb)
+                for i in range(100000):
+                    sock.sendto(text, address)
+                    if i % 100 == 0:
+                        time.sleep(0.001)
+
+                conn.settimeout(1.0)
+                stream = b''
+                try:
+                    while True:
+                        data = conn.recv(65536)
+                        if not data:
+                            break
+                        stream += data
+                except socket.timeout:
+                    pass
+            finally:
+                conn.close()
+
+    assert stream
+    assert len(stream) % len(text) == 0
+    (frames, rest) = split_frames(stream)
+    assert rest == b''
+    assert all(frame == text for (_, frame) in frames)
@@ -0,0 +1,62 @@
+import os
+import subprocess
+
+import attr
+import pytest
+
+from start_core.sitl import SITL
+from start_core.snapshot import SnapshotStore
+from start_core.exceptions import SnapshotException
+
+
+def has_criu():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            code = subprocess.call(['criu', 'check'],
+                                   stdout=devnull, stderr=devnull)
+    except OSError:
+        return False
+    return code == 0
+
+
+requires_criu = pytest.mark.skipif(not has_criu(),
+                                   reason="CRIU is unable to checkpoint processes")
+
+
+@pytest.fixture
+def sitl(tmpdir):
+    dir_autotest = tmpdir.mkdir('Tools').mkdir('autotest')
+    fn_harness = dir_autotest.join('sim_vehicle.py')
+    fn_harness.write('')
+    dir_bin = tmpdir.mkdir('build').mkdir('sitl').mkdir('bin')
+    dir_bin.join('arducopter').write('binary')
+    return SITL(str(fn_harness), 'ArduCopter',
+                (-35.362938, 149.165085, 584.0, 270.0))
+
+
+def test_missing_criu(tmpdir):
+    with pytest.raises(SnapshotException):
+        SnapshotStore(str(tmpdir), criu=str(tmpdir.join('missing-criu')))
+
+
+def test_prefix_with_snapshots(sitl):
+    from start_core.test import execute
+    from start_core.mission import Mission
+    mission = Mission.from_commands('mission.wpl', sitl.vehicle, [], sitl.home)
+    with pytest.raises(SnapshotException):
+        execute(sitl, mission, prefix='valgrind', snapshots=object())
+
+
+@requires_criu
+def test_key(sitl, tmpdir):
+    store = SnapshotStore(str(tmpdir.join('snapshots')))
+    key = store.key(sitl, 1)
+    assert store.key(sitl, 1) == key
+    assert store.key(sitl, 2) != key
+    assert store.key(attr.evolve(sitl, instance=1), 1) != key
+
+    # the key changes once the binary is modified
+    with open(sitl.binary, 'w') as f:
+        f.write('modified binary')
+    os.utime(sitl.binary, (0, 0))
+    assert store.key(sitl, 1) != key